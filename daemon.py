@@ -0,0 +1,280 @@
+"""
+Keeps huckle running in the background, so scripts run without waiting for Python, Numpy and
+the parser to start. The server listens on a Unix socket and runs each script on one of its
+worker processes, which have everything loaded and keep the programs they compiled:
+
+    python daemon.py serve --workers 4
+    python daemon.py run script.hk --input x=3
+
+The client only needs the standard library, so it starts quickly as well. Workers are replaced
+after a number of jobs, or once they use too much memory, so leaks can't build up.
+"""
+import argparse
+import itertools
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+
+BUFFER_SIZE = 64 * 1024
+
+
+def default_socket() -> str:
+    """
+    :return: the path of the socket used when none is given
+    """
+    directory = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(directory, f"huckle-{os.getuid()}.sock")
+
+
+# ******
+# CLIENT
+# ******
+def request(source: str, inputs: dict | None = None, timeout: float | None = None,
+            script: str = "<string>", path: str | None = None) -> dict:
+    """
+    Runs a script on the server.
+    :param source: the source code of the script
+    :param inputs: the variables to set before running
+    :param timeout: the maximum amount of seconds the script can run, or ``None`` for no maximum
+    :param script: the name of the script in the result
+    :param path: the path of the socket, or ``None`` for the default one
+    :return: the result, like the lines written by ``huckle.py``
+    """
+    message = {"script": script, "source": source, "inputs": inputs or {}, "timeout": timeout}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path or default_socket())
+        connection.sendall(json.dumps(message).encode() + b"\n")
+        response = bytearray()
+        while not response.endswith(b"\n"):
+            received = connection.recv(BUFFER_SIZE)
+            if not received:
+                raise RuntimeError("The server closed the connection")
+            response += received
+    return json.loads(response)
+
+
+def _run_command(options) -> int:
+    inputs = {}
+    for entry in options.input:
+        name, _, value = entry.partition("=")
+        try:
+            inputs[name] = json.loads(value)
+        except json.JSONDecodeError:
+            inputs[name] = value
+    with open(options.script, "r") as file:
+        source = file.read()
+    result = request(source, inputs, options.timeout, options.script, options.socket)
+    if options.json:
+        sys.stdout.write(json.dumps(result) + "\n")
+    else:
+        sys.stdout.write(result["output"])
+        if result["status"] == "timeout":
+            sys.stderr.write(f"The script ran for longer than {options.timeout} seconds\n")
+        elif result["status"] != "ok":
+            sys.stderr.write(result["error"] + "\n")
+    return 0 if result["status"] == "ok" else 1
+
+
+# ******
+# SERVER
+# ******
+def _serve_worker(connection):
+    """
+    Runs the jobs it receives until the connection to the supervisor is closed.
+    :param connection: the connection to the supervisor
+    """
+    import resource
+    import huckle
+    huckle._warm_up()
+    while True:
+        try:
+            job, message = connection.recv()
+        except EOFError:
+            return
+        result = huckle._run_job(job, message.get("script", "<string>"), message["source"],
+                                 message.get("inputs") or {}, message.get("timeout"))
+        # The maximum amount of memory used so far, in kilobytes on Linux
+        connection.send((result, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+class _Worker:
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_serve_worker, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self.jobs = 0
+
+    def run(self, job: int, message: dict) -> tuple[dict, int]:
+        self.connection.send((job, message))
+        return self.connection.recv()
+
+    def stop(self):
+        self.connection.close()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class Supervisor:
+    """
+    Hands out jobs to a fixed amount of worker processes. The workers are forked from a process
+    that has already imported everything, and a spare worker is kept ready to take the place of
+    a worker that is replaced, so jobs don't have to wait for a new worker to start.
+    """
+    def __init__(self, workers: int, max_jobs: int | None = 1000, max_memory: int | None = None):
+        """
+        :param workers: the amount of worker processes
+        :param max_jobs: the amount of jobs after which a worker is replaced, or ``None`` for no maximum
+        :param max_memory: the amount of megabytes after which a worker is replaced, or ``None`` for no maximum
+        """
+        import multiprocessing
+        # The fork server imports huckle before forking the workers, so it must be able to find it
+        root = os.path.dirname(os.path.abspath(__file__))
+        paths = [path for path in os.environ.get("PYTHONPATH", "").split(os.pathsep) if path]
+        if root not in paths:
+            os.environ["PYTHONPATH"] = os.pathsep.join([root] + paths)
+        self.context = multiprocessing.get_context("forkserver")
+        self.context.set_forkserver_preload(["huckle", "numpy"])
+        self.max_jobs = max_jobs
+        self.max_memory = max_memory
+        self.jobs = itertools.count()
+        self.recycled = 0
+        self.lock = threading.Lock()
+        self.workers = [_Worker(self.context) for _ in range(workers)]
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+        self.spares = queue.Queue()
+        self.spares.put(_Worker(self.context))
+
+    def execute(self, message: dict) -> dict:
+        """
+        Runs a job on the first worker that is free.
+        :param message: the script, its source, inputs and timeout
+        :return: the result
+        """
+        worker = self.idle.get()
+        try:
+            result, memory = worker.run(next(self.jobs), message)
+        except (EOFError, OSError):
+            result = {"script": message.get("script"), "status": "error", "error": "The worker stopped unexpectedly"}
+            memory = None
+        worker.jobs += 1
+        if memory is None \
+                or self.max_jobs is not None and worker.jobs >= self.max_jobs \
+                or self.max_memory is not None and memory > self.max_memory * 1024:
+            # The result is sent back while the worker is replaced
+            threading.Thread(target=self._recycle, args=(worker,), daemon=True).start()
+        else:
+            self.idle.put(worker)
+        return result
+
+    def _recycle(self, worker: _Worker):
+        # If several workers are replaced at once, they wait for the next spare in turn
+        replacement = self.spares.get()
+        with self.lock:
+            self.workers[self.workers.index(worker)] = replacement
+            self.recycled += 1
+        self.idle.put(replacement)
+        worker.stop()
+        self.spares.put(_Worker(self.context))
+
+    def stop(self):
+        with self.lock:
+            workers = self.workers + list(self.spares.queue)
+        for worker in workers:
+            worker.stop()
+
+
+def _check_request(message) -> dict:
+    """
+    Checks that a request has everything a worker needs, so an invalid request is answered
+    with an error instead of reaching a worker.
+    :param message: the decoded request
+    :return: the request
+    """
+    if not isinstance(message, dict):
+        raise TypeError("the request must be an object")
+    if not isinstance(message.get("source"), str):
+        raise TypeError("the source must be a string")
+    if message.get("script") is not None and not isinstance(message["script"], str):
+        raise TypeError("the script must be a string")
+    if not isinstance(message.get("inputs") or {}, dict):
+        raise TypeError("the inputs must be an object")
+    timeout = message.get("timeout")
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0):
+        raise ValueError("the timeout must be a positive number of seconds")
+    return message
+
+
+def serve(path: str, supervisor: Supervisor):
+    """
+    Runs jobs from the socket until the process is interrupted. Every line a client sends is a
+    job, and every line it receives back is the result of a job.
+    :param path: the path of the socket
+    :param supervisor: the supervisor of the workers
+    """
+    import signal
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    message = _check_request(json.loads(line))
+                except (ValueError, TypeError) as e:
+                    # Decoding errors are value errors as well
+                    result = {"status": "error", "error": f"Invalid request: {e}"}
+                else:
+                    result = supervisor.execute(message)
+                self.wfile.write(json.dumps(result).encode() + b"\n")
+                self.wfile.flush()
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = Server(path, Handler)
+    os.chmod(path, 0o600)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+        supervisor.stop()
+
+
+def main(arguments: list[str] | None = None) -> int:
+    argument_parser = argparse.ArgumentParser(prog="huckle daemon", description="Runs huckle scripts in the background.")
+    commands = argument_parser.add_subparsers(dest="command", required=True)
+
+    serve_command = commands.add_parser("serve", help="starts the server")
+    serve_command.add_argument("--socket", default=None, help="the path of the socket")
+    serve_command.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="the amount of worker processes")
+    serve_command.add_argument("--max-jobs", type=int, default=1000, help="the amount of jobs after which a worker is replaced")
+    serve_command.add_argument("--max-memory", type=int, default=None, help="the amount of megabytes after which a worker is replaced")
+
+    run_command = commands.add_parser("run", help="runs a script on the server")
+    run_command.add_argument("script", help="the script to run")
+    run_command.add_argument("--input", "-i", action="append", default=[], metavar="NAME=VALUE", help="sets a variable before running")
+    run_command.add_argument("--timeout", type=float, default=None, help="the maximum amount of seconds the script can run")
+    run_command.add_argument("--json", action="store_true", help="writes the whole result as JSON")
+    run_command.add_argument("--socket", default=None, help="the path of the socket")
+
+    options = argument_parser.parse_args(arguments)
+    if options.command == "serve":
+        serve(options.socket or default_socket(), Supervisor(options.workers, options.max_jobs, options.max_memory))
+        return 0
+    return _run_command(options)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
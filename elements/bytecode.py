@@ -0,0 +1,564 @@
+from array import array
+from copy import copy
+from enum import IntEnum
+from typing import Any
+
+from elements.expressions import *
+from elements.statements import *
+from utils.parser_utils import Context
+from utils.primitives import Function, Matrix
+
+
+class Op(IntEnum):
+    """
+    The instructions of the virtual machine. Every instruction is followed by exactly one
+    operand, which is 0 if the instruction does not need one.
+    """
+    # Stack manipulation
+    LOAD_CONST = 0      # Pushes constants[operand]
+    LOAD_NAME = 1       # Pushes the variable names[operand]
+    LOAD_INFIX = 2      # Pushes the variable names[operand], which must be an infix function
+    STORE_NAME = 3      # Pops a value into the variable names[operand]
+    POP = 4             # Discards the top of the stack
+
+    # Operators, the operand is the index of the operator in the constants
+    UNARY = 5
+    BINARY = 6
+    COMPARE = 7
+    CHAIN_COMPARE = 8   # Pops the right and left side and the result of the previous comparisons in the chain
+    TERNARY = 9
+
+    # Matrices
+    BUILD_MATRIX = 10   # Pushes an empty matrix
+    UNIT_MATRIX = 11    # Pops a value and pushes a matrix containing it
+    CONCAT_MATRIX = 12  # Pops the right and left side and concatenates them with the operator constants[operand]
+    BUILD_DICTIONARY = 13  # Pops the keys and values (operand is the amount of pairs) and pushes a dictionary
+    BUILD_SET = 14      # Pops the elements (operand is the amount) and pushes a set
+
+    # Calls and variable changes
+    CALL = 15           # Pops the arguments (operand is the amount) and the function and pushes the result
+    CALL_SPREAD = 16    # Same as CALL, but spreads the arguments
+    LIST_ACCESS = 17    # Pops the keys (operand is the amount) and the list and pushes the element
+    # Pops a value and changes a variable, constants[operand] is the mode, the name and whether the value is new
+    CHANGE_NAME = 18
+    # Pops a value, the keys and the list, constants[operand] is the mode, the amount of keys and whether the value is new
+    CHANGE_ITEM = 19
+    EVAL = 20           # Evaluates the expression constants[operand] with the tree interpreter
+
+    # Control flow, the operand is the index of the instruction to jump to
+    JUMP = 21
+    JUMP_IF_FALSE = 22  # Pops the condition
+    GET_ITER = 23       # Pops a value and pushes an iterator over its elements
+    FOR_ITER = 24       # Pushes the next element of the iterator, or pops the iterator and jumps if exhausted
+    RETURN_VALUE = 25   # Pops the return value and leaves the code
+
+    # Same as CALL, but pushes a result that nothing else refers to, which is assigned without copying it
+    CALL_NEW = 26
+    # Same as CALL, but marks the result as a temporary if nothing else refers to it. Used for the
+    # arguments of CALL_NEW, whose result may then share memory with them
+    CALL_TEMPORARY = 27
+    TEMPORARY = 28      # Marks the value on top of the stack as a temporary for CALL_NEW or CALL_TEMPORARY
+
+
+# Plain integers, comparing those is faster than comparing enum members in the dispatch loop
+(LOAD_CONST, LOAD_NAME, LOAD_INFIX, STORE_NAME, POP, UNARY, BINARY, COMPARE, CHAIN_COMPARE, TERNARY,
+ BUILD_MATRIX, UNIT_MATRIX, CONCAT_MATRIX, BUILD_DICTIONARY, BUILD_SET, CALL, CALL_SPREAD, LIST_ACCESS,
+ CHANGE_NAME, CHANGE_ITEM, EVAL, JUMP, JUMP_IF_FALSE, GET_ITER, FOR_ITER, RETURN_VALUE, CALL_NEW, CALL_TEMPORARY,
+ TEMPORARY) = [int(op) for op in Op]
+
+JUMPS = {Op.JUMP, Op.JUMP_IF_FALSE, Op.FOR_ITER}
+
+
+class CodeObject:
+    """
+    A compiled program or function body. The instructions are stored as pairs of an opcode
+    and an operand in ``code``. Operands refer to the ``constants`` and ``names`` tables,
+    or to the index of an instruction for jumps.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.code = array("H")
+        self.constants: list = []
+        self.names: list[str] = []
+        self._constant_indices: dict = {}
+
+    def emit(self, op: Op, operand=0) -> int:
+        """
+        Adds an instruction.
+        :return: the index of the instruction
+        """
+        if not 0 <= operand <= 0xFFFF:
+            raise RuntimeError("The program is too large to compile")
+        self.code.append(op)
+        self.code.append(operand)
+        return len(self.code) // 2 - 1
+
+    def patch(self, instruction: int, operand: int):
+        """
+        Changes the operand of an instruction, which is needed for jumps to code that was not compiled yet.
+        """
+        self.code[instruction * 2 + 1] = operand
+
+    def here(self) -> int:
+        """
+        :return: the index of the next instruction that will be added
+        """
+        return len(self.code) // 2
+
+    def constant(self, value) -> int:
+        # Equal constants are stored only once, but the type is part of the key so 1 and True stay separate
+        try:
+            key = (type(value), value)
+            if key in self._constant_indices:
+                return self._constant_indices[key]
+        except TypeError:
+            key = None
+        self.constants.append(value)
+        if key is not None:
+            self._constant_indices[key] = len(self.constants) - 1
+        return len(self.constants) - 1
+
+    def name_index(self, name: str) -> int:
+        if name not in self.names:
+            self.names.append(name)
+        return self.names.index(name)
+
+    def __len__(self):
+        return len(self.code) // 2
+
+
+class CompiledFunction(Function):
+    """
+    A function whose body is compiled to bytecode and run by the virtual machine.
+    """
+    def __init__(self, code: CodeObject, parameters: list[str], infix=False, memo=None):
+        super().__init__(parameters, None, infix=infix, memo=memo)
+        self.code = code
+
+    def _get_return_value(self, ctx: Context, parameters: dict[str, Any]):
+        # TODO Remove variables afterwards
+        ctx.variables().update(parameters)
+        return execute(self.code, ctx)
+
+
+class Compiler:
+    """
+    Compiles the statements and expressions of a parsed program into a code object.
+    """
+    def __init__(self, name="<program>"):
+        self.code = CodeObject(name)
+        # For every loop being compiled, the start of the loop, where continue statements jump to
+        self.loops: list[int] = []
+
+    def compile_statement(self, statement: Statement):
+        code = self.code
+        match statement:
+            case ForBlock():
+                self.compile_expression(statement.expression)
+                code.emit(Op.GET_ITER)
+                start = code.emit(Op.FOR_ITER)
+                code.emit(Op.STORE_NAME, code.name_index(statement.identifier))
+                self._compile_loop_body(statement, start, start)
+            case WhileBlock():
+                start = code.here()
+                self.compile_expression(statement.expression)
+                jump = code.emit(Op.JUMP_IF_FALSE)
+                self._compile_loop_body(statement, start, jump)
+            case Block():
+                for child in statement.children:
+                    self.compile_statement(child)
+            case ConditionalStatement():
+                ends = []
+                branches = [(statement.if_expression, statement.if_block),
+                            *zip(statement.elif_expressions, statement.elif_blocks)]
+                for expression, block in branches:
+                    self.compile_expression(expression)
+                    jump = code.emit(Op.JUMP_IF_FALSE)
+                    self.compile_statement(block)
+                    ends.append(code.emit(Op.JUMP))
+                    code.patch(jump, code.here())
+                if statement.else_block is not None:
+                    self.compile_statement(statement.else_block)
+                for end in ends:
+                    code.patch(end, code.here())
+            case StatementWrapper():
+                self.compile_expression(statement.expression)
+                code.emit(Op.POP)
+            case ReturnStatement():
+                self.compile_expression(statement.expression)
+                code.emit(Op.RETURN_VALUE)
+            case ContinueStatement():
+                if not self.loops:
+                    raise RuntimeError("Cannot continue outside of a loop")
+                code.emit(Op.JUMP, self.loops[-1])
+            case PassStatement():
+                pass
+            case _:
+                raise RuntimeError(f"Cannot compile {type(statement).__name__}")
+
+    def _compile_loop_body(self, block: Block, start: int, exit_jump: int):
+        self.loops.append(start)
+        for child in block.children:
+            self.compile_statement(child)
+        self.loops.pop()
+        self.code.emit(Op.JUMP, start)
+        self.code.patch(exit_jump, self.code.here())
+
+    def compile_expression(self, expression: Expression):
+        code = self.code
+        match expression:
+            case Primitive(value=Function() as function) if type(function) is Function:
+                code.emit(Op.LOAD_CONST, code.constant(compile_function(function)))
+            case Primitive():
+                code.emit(Op.LOAD_CONST, code.constant(expression.value))
+            case NestedExpression():
+                self.compile_expression(expression.expression)
+            case MatrixExpression():
+                if expression.last_operation is None:
+                    code.emit(Op.BUILD_MATRIX)
+                else:
+                    self.compile_expression(expression.last_operation)
+            case UnitMatrixExpression():
+                self.compile_expression(expression.expression)
+                code.emit(Op.UNIT_MATRIX)
+            case MatrixOperation():
+                self.compile_expression(expression.left)
+                self.compile_expression(expression.right)
+                code.emit(Op.CONCAT_MATRIX, code.constant(expression.operator))
+            case DictionaryExpression():
+                for key, value in zip(expression.keys, expression.values):
+                    self.compile_expression(key)
+                    self.compile_expression(value)
+                code.emit(Op.BUILD_DICTIONARY, len(expression.keys))
+            case SetExpression():
+                for element in expression.elements:
+                    self.compile_expression(element)
+                code.emit(Op.BUILD_SET, len(expression.elements))
+            case UnaryOperator():
+                self.compile_expression(expression.expression)
+                code.emit(Op.UNARY, code.constant(expression.operator))
+            case ComparisonOperator(left=ComparisonOperator() as left):
+                # Chained comparison operators combine the comparison with the result of the left side,
+                # which can be element-wise for matrices
+                self.compile_expression(left)
+                self.compile_expression(left.right)
+                self.compile_expression(expression.right)
+                code.emit(Op.CHAIN_COMPARE, code.constant(expression.operator))
+            case ComparisonOperator():
+                self.compile_expression(expression.left)
+                self.compile_expression(expression.right)
+                code.emit(Op.COMPARE, code.constant(expression.operator))
+            case BinaryOperator():
+                self.compile_expression(expression.left)
+                self.compile_expression(expression.right)
+                code.emit(Op.BINARY, code.constant(expression.operator))
+            case TernaryOperator():
+                self.compile_expression(expression.first)
+                self.compile_expression(expression.second)
+                self.compile_expression(expression.third)
+                code.emit(Op.TERNARY, code.constant(expression.operator))
+            case FunctionCall():
+                self.compile_expression(expression.expression)
+                for argument in expression.arguments:
+                    self.compile_expression(argument)
+                code.emit(Op.CALL_SPREAD if expression.spread else Op.CALL, len(expression.arguments))
+            case ListAccess():
+                self.compile_expression(expression.expression)
+                for argument in expression.arguments:
+                    self.compile_expression(argument)
+                code.emit(Op.LIST_ACCESS, len(expression.arguments))
+            case InfixAccess():
+                code.emit(Op.LOAD_INFIX, code.name_index(expression.identifier))
+            case VariableAccess():
+                code.emit(Op.LOAD_NAME, code.name_index(expression.identifier))
+            case VariableChange():
+                self._compile_change(expression)
+            case _:
+                # Expressions without their own instructions are evaluated by the tree interpreter
+                code.emit(Op.EVAL, code.constant(expression))
+
+    def _compile_change(self, change: VariableChange):
+        code = self.code
+        changing = change.changing
+        while isinstance(changing, NestedExpression):
+            changing = changing.expression
+        mode = ChangeMode(change.operator)
+
+        if isinstance(changing, VariableAccess):
+            new = self._compile_change_value(change)
+            code.emit(Op.CHANGE_NAME, code.constant((mode, changing.identifier, new)))
+        elif isinstance(changing, ListAccess):
+            self.compile_expression(changing.expression)
+            for argument in changing.arguments:
+                self.compile_expression(argument)
+            new = self._compile_change_value(change)
+            code.emit(Op.CHANGE_ITEM, code.constant((mode, len(changing.arguments), new)))
+        else:
+            # This will fail the same way as in the tree interpreter
+            code.emit(Op.EVAL, code.constant(change))
+
+    def _compile_change_value(self, change: VariableChange) -> bool:
+        """
+        Compiles the value a variable or element is changed to, see ``Expression.evaluate_new``.
+        :param change: the change
+        :return: whether the value is always new, so it doesn't have to be copied
+        """
+        code = self.code
+        value = change.change_to
+        while isinstance(value, NestedExpression):
+            value = value.expression
+        if value is None:
+            code.emit(Op.LOAD_CONST, code.constant(None))
+            return True
+        elif isinstance(value, FunctionCall) and not value.spread:
+            self._compile_call(value, Op.CALL_NEW)
+            return True
+        else:
+            self.compile_expression(value)
+            return value.creates_value()
+
+    def _compile_call(self, call: FunctionCall, op: Op):
+        """
+        Compiles a call whose result is assigned, or one of the calls in its arguments. Those mark the
+        arguments that are temporaries, see ``Expression.evaluate_temporary``.
+        :param call: the call
+        :param op: CALL_NEW or CALL_TEMPORARY
+        """
+        code = self.code
+        self.compile_expression(call.expression)
+        for argument in call.arguments:
+            while isinstance(argument, NestedExpression):
+                argument = argument.expression
+            if isinstance(argument, FunctionCall) and not argument.spread:
+                self._compile_call(argument, Op.CALL_TEMPORARY)
+            else:
+                self.compile_expression(argument)
+                if argument.creates_value():
+                    code.emit(Op.TEMPORARY)
+        code.emit(op, len(call.arguments))
+
+
+def compile_program(block: Statement) -> CodeObject:
+    """
+    Compiles a parsed program to bytecode.
+    :param block: the first statement of the program, as returned by the parser
+    :return: the code object of the program
+    """
+    compiler = Compiler()
+    compiler.compile_statement(block)
+    compiler.code.emit(Op.LOAD_CONST, compiler.code.constant(None))
+    compiler.code.emit(Op.RETURN_VALUE)
+    return compiler.code
+
+
+def compile_function(function: Function) -> CompiledFunction:
+    """
+    Compiles the body of a function defined in a program.
+    :param function: the function, as created by the parser
+    :return: the compiled function, which keeps the parameters and modifiers of the original one
+    """
+    compiler = Compiler(str(function))
+    compiler.compile_statement(function.block)
+    compiler.code.emit(Op.LOAD_CONST, compiler.code.constant(None))
+    compiler.code.emit(Op.RETURN_VALUE)
+    return CompiledFunction(compiler.code, function.parameters, infix=function.infix, memo=function.memo)
+
+
+def run_program(code: CodeObject, ctx: Context):
+    """
+    Runs a compiled program, and flushes its output when it ends.
+    :param code: the code object of the program
+    :param ctx: the context
+    """
+    try:
+        if execute(code, ctx) is not None:
+            raise RuntimeError("Cannot return outside of a function")
+    finally:
+        ctx.output.flush()
+
+
+def execute(code_object: CodeObject, ctx: Context):
+    """
+    Runs a code object until it returns.
+    :param code_object: the code object
+    :param ctx: the context
+    :return: the returned value
+    """
+    code = code_object.code
+    constants = code_object.constants
+    names = code_object.names
+    variables = ctx.variables()
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    # The values on the stack that nothing else refers to, see TEMPORARY
+    temporaries = []
+    pc = 0
+
+    while True:
+        op = code[pc]
+        operand = code[pc + 1]
+        pc += 2
+
+        if op == LOAD_NAME:
+            push(variables.get(names[operand]))
+        elif op == LOAD_CONST:
+            push(constants[operand])
+        elif op == BINARY:
+            right = pop()
+            push(BinaryOperator.calculate(pop(), constants[operand], right))
+        elif op == CALL or op == CALL_SPREAD:
+            args = stack[len(stack) - operand:]
+            del stack[len(stack) - operand:]
+            func = pop()
+            if 0 < len(args) < func.arguments_needed():
+                push(func.partial(args))
+            else:
+                push(func.execute(ctx, args, spread=op == CALL_SPREAD))
+            # Calling a function could have changed the variable dictionary that is in use
+            variables = ctx.variables()
+        elif op == POP:
+            pop()
+        elif op == JUMP:
+            pc = operand * 2
+        elif op == JUMP_IF_FALSE:
+            if not pop():
+                pc = operand * 2
+        elif op == COMPARE:
+            right = pop()
+            push(ComparisonOperator.compare(pop(), constants[operand], right))
+        elif op == CHAIN_COMPARE:
+            right = pop()
+            left = pop()
+            push(ComparisonOperator.chain(pop(), left, constants[operand], right))
+        elif op == CHANGE_NAME:
+            value = pop()
+            mode, name, new = constants[operand]
+            push(VariableAccess.change_variable(variables, name, mode, value if new else copy(value)))
+        elif op == FOR_ITER:
+            try:
+                push(next(stack[-1]))
+            except StopIteration:
+                pop()
+                pc = operand * 2
+        elif op == STORE_NAME:
+            variables[names[operand]] = pop()
+        elif op == GET_ITER:
+            push(iter(pop()))
+        elif op == RETURN_VALUE:
+            return pop()
+        elif op == LIST_ACCESS:
+            keys = stack[len(stack) - operand:]
+            del stack[len(stack) - operand:]
+            push(pop()[keys])
+        elif op == CHANGE_ITEM:
+            value = pop()
+            mode, count, new = constants[operand]
+            keys = stack[len(stack) - count:]
+            del stack[len(stack) - count:]
+            push(ListAccess.change_item(pop(), keys, mode, value if new else copy(value)))
+        elif op == UNARY:
+            push(UnaryOperator.calculate(constants[operand], pop()))
+        elif op == TERNARY:
+            third = pop()
+            second = pop()
+            push(TernaryOperator.calculate(constants[operand], pop(), second, third))
+        elif op == LOAD_INFIX:
+            result = variables.get(names[operand])
+            if not getattr(result, "infix", False):
+                raise RuntimeError("This function is not an infix function")
+            push(result)
+        elif op == BUILD_MATRIX:
+            push(Matrix())
+        elif op == UNIT_MATRIX:
+            push(Matrix(pop()))
+        elif op == CONCAT_MATRIX:
+            right = pop()
+            push(MatrixOperation.combine(pop(), constants[operand], right))
+        elif op == BUILD_DICTIONARY:
+            values = stack[len(stack) - operand * 2:]
+            del stack[len(stack) - operand * 2:]
+            push(DictionaryExpression.build(values[0::2], values[1::2]))
+        elif op == BUILD_SET:
+            elements = stack[len(stack) - operand:]
+            del stack[len(stack) - operand:]
+            push(SetExpression.build(elements))
+        elif op == CALL_NEW or op == CALL_TEMPORARY:
+            args = stack[len(stack) - operand:]
+            del stack[len(stack) - operand:]
+            func = pop()
+            arguments_temporary = _take_temporaries(temporaries, args)
+            if 0 < len(args) < func.arguments_needed():
+                push(func.partial(args))
+            else:
+                result = func.execute(ctx, args)
+                new = FunctionCall.returns_new(func, args, arguments_temporary, result)
+                if op == CALL_NEW:
+                    push(result if new else copy(result))
+                else:
+                    push(result)
+                    if new:
+                        temporaries.append(result)
+            variables = ctx.variables()
+        elif op == TEMPORARY:
+            temporaries.append(stack[-1])
+        elif op == EVAL:
+            push(constants[operand].evaluate(ctx))
+        else:
+            raise RuntimeError(f"Unknown instruction {op}")
+
+
+def _take_temporaries(temporaries: list, args: list) -> list[bool]:
+    """
+    Tells which arguments of a call are temporaries, and removes those from the temporaries.
+    :param temporaries: the values on the stack that are temporaries
+    :param args: the arguments
+    :return: whether each argument is a temporary
+    """
+    if not temporaries:
+        return [False] * len(args)
+    taken = []
+    for arg in args:
+        for i, temporary in enumerate(temporaries):
+            if temporary is arg:
+                del temporaries[i]
+                taken.append(True)
+                break
+        else:
+            taken.append(False)
+    return taken
+
+
+def disassemble(code_object: CodeObject) -> str:
+    """
+    Returns a readable listing of the instructions of a code object, including those of the functions
+    defined in it.
+    :param code_object: the code object
+    :return: the listing
+    """
+    lines = [f"Disassembly of {code_object.name}:"]
+    functions = []
+    for i in range(len(code_object)):
+        op = Op(code_object.code[i * 2])
+        operand = code_object.code[i * 2 + 1]
+        match op:
+            case Op.LOAD_NAME | Op.LOAD_INFIX | Op.STORE_NAME:
+                argument = f"{operand} ({code_object.names[operand]})"
+            case Op.LOAD_CONST | Op.UNARY | Op.BINARY | Op.COMPARE | Op.CHAIN_COMPARE | Op.TERNARY | Op.CONCAT_MATRIX | \
+                 Op.CHANGE_NAME | Op.CHANGE_ITEM | Op.EVAL:
+                constant = code_object.constants[operand]
+                if isinstance(constant, CompiledFunction):
+                    functions.append(constant.code)
+                argument = f"{operand} ({constant!r})"
+            case Op.CALL | Op.CALL_SPREAD | Op.CALL_NEW | Op.CALL_TEMPORARY | Op.LIST_ACCESS | Op.BUILD_DICTIONARY | \
+                 Op.BUILD_SET:
+                argument = str(operand)
+            case _ if op in JUMPS:
+                argument = f"to {operand}"
+            case _:
+                argument = ""
+        lines.append(f"{i:>6} {op.name:<22}{argument}".rstrip())
+    for function in functions:
+        lines.append("")
+        lines.append(disassemble(function))
+    return "\n".join(lines)
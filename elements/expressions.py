@@ -2,8 +2,11 @@ from copy import copy
 from enum import Enum
 
 from utils.builtins import transpose
+from utils.lazy import lazy_import
 from utils.parser_utils import Context
-from utils.primitives import Function, Matrix, Slice
+from utils.primitives import ContextFunction, Dictionary, Function, LazyFunction, Matrix, PythonFunction, Set, Slice
+
+_linalg = lazy_import("utils.linalg")
 
 
 class ChangeMode(Enum):
@@ -11,14 +14,44 @@ class ChangeMode(Enum):
 
 
 class Expression:
+    # The line in the source where the expression starts, which is set by the parser
+    __slots__ = ("lineno",)
+
     def evaluate(self, ctx: Context):
         raise NotImplementedError("This method should be implemented")
 
     def change(self, ctx: Context, mode: ChangeMode, value):
         raise RuntimeError("This expression cannot be changed")
 
+    def creates_value(self) -> bool:
+        """
+        :return: whether the value of this expression is always a new one that nothing else refers
+         to, so it doesn't have to be copied when it is assigned
+        """
+        return False
+
+    def evaluate_temporary(self, ctx: Context) -> tuple:
+        """
+        Evaluates the expression, and tells whether its value is a temporary: a new value that
+        nothing else refers to.
+        :param ctx: the context
+        :return: the value, and whether it is a temporary
+        """
+        return self.evaluate(ctx), self.creates_value()
+
+    def evaluate_new(self, ctx: Context):
+        """
+        Evaluates the expression to a value that can be assigned: a value that nothing else refers to.
+        :param ctx: the context
+        :return: the value, which is a copy if the expression could refer to an existing value
+        """
+        value, temporary = self.evaluate_temporary(ctx)
+        return value if temporary else copy(value)
+
 
 class Primitive(Expression):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = value
 
@@ -27,6 +60,8 @@ class Primitive(Expression):
 
 
 class NestedExpression(Expression):
+    __slots__ = ("expression",)
+
     def __init__(self, expression: Expression):
         self.expression = expression
 
@@ -36,8 +71,16 @@ class NestedExpression(Expression):
     def change(self, ctx: Context, mode: ChangeMode, value):
         self.expression.change(ctx, mode, value)
 
+    def creates_value(self) -> bool:
+        return self.expression.creates_value()
+
+    def evaluate_temporary(self, ctx: Context) -> tuple:
+        return self.expression.evaluate_temporary(ctx)
+
 
 class MatrixExpression(Expression):
+    __slots__ = ("last_operation",)
+
     def __init__(self, last_operation: 'MatrixOperation' = None):
         self.last_operation = last_operation
 
@@ -47,25 +90,37 @@ class MatrixExpression(Expression):
         else:
             return self.last_operation.evaluate(ctx)
 
+    def creates_value(self) -> bool:
+        return True
+
 
 class UnitMatrixExpression(Expression):
+    __slots__ = ("expression",)
+
     def __init__(self, expression: Expression):
         self.expression = expression
 
     def evaluate(self, ctx: Context):
         return Matrix(self.expression.evaluate(ctx))
 
+    def creates_value(self) -> bool:
+        return True
+
 
 class MatrixOperation(Expression):
+    __slots__ = ("left", "operator", "right")
+
     def __init__(self, left: Expression, operator: str, right: Expression):
         self.left = left
         self.operator = operator
         self.right = right
 
     def evaluate(self, ctx: Context):
-        left: Matrix = self.left.evaluate(ctx)
-        right = self.right.evaluate(ctx)
-        match self.operator:
+        return self.combine(self.left.evaluate(ctx), self.operator, self.right.evaluate(ctx))
+
+    @staticmethod
+    def combine(left: Matrix, operator, right):
+        match operator:
             case ",":
                 # Add element to row or add column vector to matrix
                 if isinstance(right, Matrix):
@@ -81,14 +136,58 @@ class MatrixOperation(Expression):
         return left
 
 
+class DictionaryExpression(Expression):
+    __slots__ = ("keys", "values")
+
+    def __init__(self, keys: list[Expression], values: list[Expression]):
+        self.keys = keys
+        self.values = values
+
+    def evaluate(self, ctx: Context):
+        return self.build([key.evaluate(ctx) for key in self.keys], [value.evaluate(ctx) for value in self.values])
+
+    @staticmethod
+    def build(keys: list, values: list) -> Dictionary:
+        result = Dictionary()
+        for key, value in zip(keys, values):
+            # Just like assigning a variable, the dictionary gets its own copy of the value
+            result[[key]] = copy(value)
+        return result
+
+
+class SetExpression(Expression):
+    __slots__ = ("elements",)
+
+    def __init__(self, elements: list[Expression]):
+        self.elements = elements
+
+    def evaluate(self, ctx: Context):
+        return self.build([element.evaluate(ctx) for element in self.elements])
+
+    @staticmethod
+    def build(elements: list) -> Set:
+        result = Set()
+        for element in elements:
+            result.add(element)
+        return result
+
+
 class UnaryOperator(Expression):
+    __slots__ = ("operator", "expression")
+
     def __init__(self, operator: str, expression: Expression):
         self.operator = operator
         self.expression = expression
 
     def evaluate(self, ctx: Context):
-        expression = self.expression.evaluate(ctx)
-        match self.operator:
+        return self.calculate(self.operator, self.expression.evaluate(ctx))
+
+    def creates_value(self) -> bool:
+        return True
+
+    @staticmethod
+    def calculate(operator, expression):
+        match operator:
             case "-":
                 return -expression
             case "not":
@@ -98,6 +197,8 @@ class UnaryOperator(Expression):
 
 
 class BinaryOperator(Expression):
+    __slots__ = ("left", "operator", "right", "commutative")
+
     def __init__(self, left: Expression, operator: str, right: Expression, commutative=True):
         self.left = left
         self.operator = operator
@@ -118,6 +219,10 @@ class BinaryOperator(Expression):
         #         result = self.calculate(right, self.operator, left)
         #         return result
 
+    def creates_value(self) -> bool:
+        # These result in one of their operands instead of a new value
+        return self.operator not in ("and", "or", "if")
+
     @staticmethod
     def calculate(left, operator, right):
         match operator:
@@ -131,6 +236,8 @@ class BinaryOperator(Expression):
                 return left.__elmul__(right)
             case "/":
                 return left / right
+            case "\\":
+                return _linalg.left_divide(left, right)
             case "%":
                 return left % right
             case "^":
@@ -148,6 +255,8 @@ class BinaryOperator(Expression):
 
 
 class TernaryOperator(Expression):
+    __slots__ = ("operator", "first", "second", "third")
+
     def __init__(self, operator: str, first: Expression, second: Expression, third: Expression):
         self.operator = operator
         self.first = first
@@ -155,10 +264,11 @@ class TernaryOperator(Expression):
         self.third = third
 
     def evaluate(self, ctx: Context):
-        first = self.first.evaluate(ctx)
-        second = self.second.evaluate(ctx)
-        third = self.third.evaluate(ctx)
-        match self.operator:
+        return self.calculate(self.operator, self.first.evaluate(ctx), self.second.evaluate(ctx), self.third.evaluate(ctx))
+
+    @staticmethod
+    def calculate(operator, first, second, third):
+        match operator:
             case "conditional":
                 return first if second else third
             case "slice":
@@ -166,6 +276,8 @@ class TernaryOperator(Expression):
 
 
 class ComparisonOperator(BinaryOperator):
+    __slots__ = ()
+
     def __init__(self, left: Expression, operator: str, right: Expression):
         super().__init__(left, operator, right, commutative=operator in ("==", "!="))
 
@@ -179,9 +291,11 @@ class ComparisonOperator(BinaryOperator):
             left = self.left.right.evaluate(ctx)
             valid = self.left.evaluate(ctx)
 
-        if not valid:
-            return False
-        match self.operator:
+        return self.chain(valid, left, self.operator, right)
+
+    @staticmethod
+    def compare(left, operator, right):
+        match operator:
             case "==":
                 return left == right
             case "!=":
@@ -195,26 +309,98 @@ class ComparisonOperator(BinaryOperator):
             case ">=":
                 return left >= right
 
+    @staticmethod
+    def chain(valid, left, operator, right):
+        """
+        Compares two values, given the result of the comparisons before them in a chain like
+        ``a < b < c``. Element-wise results of matrices are combined element by element.
+        :param valid: the result of the previous comparisons, or ``True`` if there are none
+        :param left: the left value
+        :param operator: the comparison operator
+        :param right: the right value
+        :return: whether the whole chain holds
+        """
+        if isinstance(valid, Matrix):
+            return valid & ComparisonOperator.compare(left, operator, right)
+        if not valid:
+            return False
+        return ComparisonOperator.compare(left, operator, right)
+
 
 class FunctionCall(Expression):
+    __slots__ = ("expression", "arguments", "spread", "constant", "partial")
+
     def __init__(self, expression: Expression, arguments: list[Expression], spread=False):
         self.expression = expression
         self.arguments = arguments
         self.spread = spread
+        # If all arguments are constants, currying the same function always results in the same
+        # partial function, so it only needs to be created once for this call.
+        self.constant = all(isinstance(expr, Primitive) for expr in arguments)
+        self.partial: tuple[Function, Function] | None = None
 
     def evaluate(self, ctx: Context):
         func = self.expression.evaluate(ctx)
-        if len(self.arguments) < func.arguments_needed():
-            # If not enough arguments are given, return the same function
-            # but with the curried arguments.
-            curried = list(func.curried)
-            curried.extend([expr.evaluate(ctx) for expr in self.arguments])
-            return Function(func.parameters, func.block, curried=curried)
+        if 0 < len(self.arguments) < func.arguments_needed():
+            return self.curry(ctx, func)
+        elif ctx.profiler is not None:
+            return ctx.profiler.call(self, func, ctx, [expr.evaluate(ctx) for expr in self.arguments])
         else:
             return func.execute(ctx, [expr.evaluate(ctx) for expr in self.arguments], spread=self.spread)
 
+    def evaluate_temporary(self, ctx: Context) -> tuple:
+        func = self.expression.evaluate(ctx)
+        if 0 < len(self.arguments) < func.arguments_needed():
+            # Partial functions never change, so they can be shared
+            return self.curry(ctx, func), True
+        # Calls in the arguments tell whether their result is a temporary as well, so a result
+        # sharing memory with it, like disk(load("big.npy")), doesn't have to be copied
+        evaluated = [expr.evaluate_temporary(ctx) for expr in self.arguments]
+        args = [value for value, _ in evaluated]
+        temporaries = [temporary for _, temporary in evaluated]
+        if ctx.profiler is not None:
+            result = ctx.profiler.call(self, func, ctx, args)
+        else:
+            result = func.execute(ctx, args, spread=self.spread)
+        return result, self.returns_new(func, args, temporaries, result)
+
+    def curry(self, ctx: Context, func: Function) -> Function:
+        """
+        If not enough arguments are given, returns the same function but with the curried arguments.
+        :param ctx: the context
+        :param func: the function that is called
+        :return: the partial function
+        """
+        cached = self.partial
+        if cached is not None and cached[0] is func:
+            return cached[1]
+        partial = func.partial([expr.evaluate(ctx) for expr in self.arguments])
+        if self.constant:
+            self.partial = (func, partial)
+        return partial
+
+    @staticmethod
+    def returns_new(func: Function, args, temporaries, result) -> bool:
+        """
+        Tells whether the result of a call is a value that nothing else refers to, which is the case
+        for the matrices that built-in functions create. Those can only refer to a matrix of the program
+        by returning (a part of) one of their arguments, unless that argument is a temporary itself,
+        while the functions of the program can return any of its variables.
+        :param func: the function that was called
+        :param args: the arguments it was called with
+        :param temporaries: whether each argument is a temporary, see ``Expression.evaluate_temporary``
+        :param result: the result of the call
+        :return: whether the result is new
+        """
+        return isinstance(func, (PythonFunction, ContextFunction, LazyFunction)) and isinstance(result, Matrix) \
+            and not any(isinstance(arg, (Dictionary, Set, Function))
+                        or isinstance(arg, Matrix) and not temporary and result.shares_memory(arg)
+                        for arg, temporary in zip(args, temporaries))
+
 
 class ListAccess(Expression):
+    __slots__ = ("expression", "arguments")
+
     def __init__(self, expression: Expression, arguments: list[Expression]):
         self.expression = expression
         self.arguments = arguments
@@ -223,57 +409,93 @@ class ListAccess(Expression):
         return self.expression.evaluate(ctx)[[expr.evaluate(ctx) for expr in self.arguments]]
 
     def change(self, ctx: Context, mode: ChangeMode, value):
+        return self.change_item(self.expression.evaluate(ctx),
+                                [expr.evaluate(ctx) for expr in self.arguments],
+                                mode,
+                                value)
+
+    @staticmethod
+    def change_item(changing, keys, mode: ChangeMode, value):
         # TODO Add preconditions
         # Currently, only Matrices can have their values changed by using their list access
-        changing = self.expression.evaluate(ctx)
         match mode:
             case ChangeMode.ADD:
-                changing[[expr.evaluate(ctx) for expr in self.arguments]] += value
+                changing[keys] += value
             case ChangeMode.ADD_ONE:
-                changing[[expr.evaluate(ctx) for expr in self.arguments]] += 1
+                changing[keys] += 1
             case ChangeMode.DELETE:
-                del changing[[expr.evaluate(ctx) for expr in self.arguments]]
+                del changing[keys]
             case ChangeMode.REMOVE:
-                changing[[expr.evaluate(ctx) for expr in self.arguments]] -= value
+                changing[keys] -= value
             case ChangeMode.REMOVE_ONE:
-                changing[[expr.evaluate(ctx) for expr in self.arguments]] -= 1
+                changing[keys] -= 1
             case ChangeMode.SET:
-                changing[[expr.evaluate(ctx) for expr in self.arguments]] = value
+                changing[keys] = value
         return changing
 
 
 class VariableAccess(Expression):
+    __slots__ = ("identifier", "post_condition", "error_message", "resolved")
+
     def __init__(self, identifier: str, post_condition=lambda x: True, error_message=None):
         self.identifier = identifier
         self.post_condition = post_condition
         self.error_message = error_message
+        # The version of the variable and the function it resolved to the last time.
+        # Functions (like built-ins and infix operators) are almost never rebound, so this
+        # saves validating them each time, until the binding changes.
+        self.resolved: tuple[int, Function] | None = None
 
     def evaluate(self, ctx: Context):
-        result = ctx.variables()[self.identifier] if self.identifier in ctx.variables() else None
+        variables = ctx.variables()
+        version = variables.versions.get(self.identifier)
+        resolved = self.resolved
+        if resolved is not None and resolved[0] == version:
+            return resolved[1]
+
+        result = variables.get(self.identifier)
         if not self.post_condition(result):
             raise RuntimeError("The variable did not comply with the condition"
                                if self.error_message is None
                                else self.error_message)
+        if isinstance(result, Function):
+            self.resolved = (version, result)
         return result
 
     def change(self, ctx: Context, mode: ChangeMode, value):
+        return self.change_variable(ctx.variables(), self.identifier, mode, value)
+
+    @staticmethod
+    def change_variable(variables: dict, identifier: str, mode: ChangeMode, value):
         match mode:
             case ChangeMode.ADD:
-                ctx.variables()[self.identifier] += value
+                variables[identifier] += value
             case ChangeMode.ADD_ONE:
-                ctx.variables()[self.identifier] += 1
+                variables[identifier] += 1
             case ChangeMode.DELETE:
-                return ctx.variables().pop(self.identifier) if self.identifier in ctx.variables() else None
+                return variables.pop(identifier) if identifier in variables else None
             case ChangeMode.REMOVE:
-                ctx.variables()[self.identifier] -= value
+                variables[identifier] -= value
             case ChangeMode.REMOVE_ONE:
-                ctx.variables()[self.identifier] -= 1
+                variables[identifier] -= 1
             case ChangeMode.SET:
-                ctx.variables()[self.identifier] = value
-        return ctx.variables()[self.identifier]
+                variables[identifier] = value
+        return variables[identifier]
+
+
+class InfixAccess(VariableAccess):
+    """
+    Accesses the function used as an infix operator, which must be marked as infix.
+    """
+    __slots__ = ()
+
+    def __init__(self, identifier: str):
+        super().__init__(identifier, lambda x: getattr(x, "infix", False), "This function is not an infix function")
 
 
 class VariableChange(Expression):
+    __slots__ = ("changing", "operator", "change_to")
+
     def __init__(self, changing: Expression, operator: str, change_to: Expression = None):
         self.changing = changing
         self.operator = operator
@@ -282,4 +504,4 @@ class VariableChange(Expression):
     def evaluate(self, ctx: Context):
         return self.changing.change(ctx,
                                     ChangeMode(self.operator),
-                                    copy(self.change_to.evaluate(ctx)) if self.change_to is not None else None)
+                                    self.change_to.evaluate_new(ctx) if self.change_to is not None else None)
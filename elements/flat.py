@@ -0,0 +1,449 @@
+import pickle
+from array import array
+from copy import copy
+from enum import IntEnum
+from typing import Any
+
+from elements.expressions import *
+from elements.statements import *
+from utils.cache import LRUCache
+from utils.parser_utils import Context
+from utils.primitives import Function, Matrix
+
+
+class Kind(IntEnum):
+    """
+    The type of a node in a flat program. Statements come first, expressions afterwards.
+    """
+    BLOCK, RETURN_BLOCK, WHILE, FOR, CONDITIONAL, STATEMENT, PASS, RETURN, CONTINUE, \
+        PRIMITIVE, FUNCTION, NESTED, MATRIX, UNIT_MATRIX, MATRIX_OPERATION, DICTIONARY, SET, UNARY, BINARY, \
+        TERNARY, COMPARISON, CALL, LIST_ACCESS, VARIABLE, INFIX, CHANGE = range(26)
+
+
+class _Continue:
+    """
+    Signals that a statement wants to skip to the next iteration of the surrounding loop.
+    """
+
+
+CONTINUE = _Continue()
+
+NO_OPERAND = object()
+"""
+Used while flattening for nodes without an operand, since ``None`` is a valid operand.
+"""
+
+
+class _Returned:
+    """
+    Signals that a statement returned a value from the surrounding function.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class FlatProgram:
+    """
+    A program stored in parallel arrays instead of a tree of statement and expression objects.
+    Each node is identified by its index in these arrays:
+
+    - ``kinds`` contains the type of the node (see ``Kind``),
+    - ``operands`` contains the index of the node's operand in ``constants``, or -1 if it has none,
+      for example the operator of a binary operator or the identifier of a variable, and
+    - ``starts`` and ``ends`` contain the range of the node's children in ``children``.
+
+    The program can be run directly and can cheaply be turned into bytes and back.
+    """
+    def __init__(self):
+        self.kinds = array("B")
+        self.operands = array("i")
+        self.starts = array("I")
+        self.ends = array("I")
+        self.children = array("I")
+        self.constants: list = []
+        # The functions defined in this program, created the first time their definition is evaluated
+        self.functions: dict[int, 'FlatFunction'] = {}
+        self._constant_indices: dict = {}
+
+        self._evaluators = {
+            Kind.PRIMITIVE: self._evaluate_primitive,
+            Kind.FUNCTION: self._evaluate_function,
+            Kind.NESTED: self._evaluate_nested,
+            Kind.MATRIX: self._evaluate_matrix,
+            Kind.UNIT_MATRIX: self._evaluate_unit_matrix,
+            Kind.MATRIX_OPERATION: self._evaluate_matrix_operation,
+            Kind.DICTIONARY: self._evaluate_dictionary,
+            Kind.SET: self._evaluate_set,
+            Kind.UNARY: self._evaluate_unary,
+            Kind.BINARY: self._evaluate_binary,
+            Kind.TERNARY: self._evaluate_ternary,
+            Kind.COMPARISON: self._evaluate_comparison,
+            Kind.CALL: self._evaluate_call,
+            Kind.LIST_ACCESS: self._evaluate_list_access,
+            Kind.VARIABLE: self._evaluate_variable,
+            Kind.INFIX: self._evaluate_variable,
+            Kind.CHANGE: self._evaluate_change,
+        }
+
+    @classmethod
+    def from_tree(cls, block: Statement) -> 'FlatProgram':
+        """
+        Flattens a parsed program. The root of the program will always be the node with id 0.
+        :param block: the first statement of the program, as returned by the parser
+        :return: the flat program
+        """
+        program = cls()
+        program._add(block)
+        program._constant_indices = {}
+        return program
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'FlatProgram':
+        program = cls()
+        kinds, operands, starts, ends, children, program.constants = pickle.loads(data)
+        program.kinds.frombytes(kinds)
+        program.operands.frombytes(operands)
+        program.starts.frombytes(starts)
+        program.ends.frombytes(ends)
+        program.children.frombytes(children)
+        return program
+
+    def to_bytes(self) -> bytes:
+        return pickle.dumps((self.kinds.tobytes(),
+                             self.operands.tobytes(),
+                             self.starts.tobytes(),
+                             self.ends.tobytes(),
+                             self.children.tobytes(),
+                             self.constants))
+
+    def run(self, ctx: Context):
+        """
+        Runs the program from its root, and flushes its output when it ends.
+        :param ctx: the context
+        """
+        try:
+            if isinstance(self.execute(0, ctx), _Returned):
+                raise RuntimeError("Cannot return outside of a function")
+        finally:
+            ctx.output.flush()
+
+    def call(self, node: int, ctx: Context):
+        """
+        Runs the body of a function and returns the value it returned.
+        :param node: the return block of the function
+        :param ctx: the context
+        :return: the returned value, or ``None`` if nothing was returned
+        """
+        signal = self.execute(node, ctx)
+        return signal.value if isinstance(signal, _Returned) else None
+
+    def __len__(self):
+        return len(self.kinds)
+
+    # *******************
+    # BUILDING THE ARRAYS
+    # *******************
+    def _add(self, node) -> int:
+        """
+        Adds a node and, recursively, all of its children. The children of a node are only added
+        after the node itself, so the node's children range needs to be filled in afterwards.
+        :return: the id of the node
+        """
+        kind, operand, children = self._describe(node)
+        index = len(self.kinds)
+        self.kinds.append(kind)
+        self.operands.append(-1 if operand is NO_OPERAND else self._constant(operand))
+        self.starts.append(0)
+        self.ends.append(0)
+
+        ids = [self._add(child) for child in children]
+        self.starts[index] = len(self.children)
+        self.children.extend(ids)
+        self.ends[index] = len(self.children)
+        return index
+
+    def _constant(self, value) -> int:
+        # Equal constants are stored only once, but the type is part of the key so 1 and True stay separate
+        try:
+            key = (type(value), value)
+            if key in self._constant_indices:
+                return self._constant_indices[key]
+        except TypeError:
+            key = None
+        self.constants.append(value)
+        if key is not None:
+            self._constant_indices[key] = len(self.constants) - 1
+        return len(self.constants) - 1
+
+    @staticmethod
+    def _describe(node):
+        """
+        :return: the kind, the operand and the children of a tree node
+        """
+        match node:
+            case ReturnBlock():
+                return Kind.RETURN_BLOCK, NO_OPERAND, node.children
+            case ForBlock():
+                return Kind.FOR, node.identifier, [node.expression, *node.children]
+            case WhileBlock():
+                return Kind.WHILE, NO_OPERAND, [node.expression, *node.children]
+            case Block():
+                return Kind.BLOCK, NO_OPERAND, node.children
+            case ConditionalStatement():
+                children = [node.if_expression, node.if_block]
+                for expression, block in zip(node.elif_expressions, node.elif_blocks):
+                    children.extend([expression, block])
+                if node.else_block is not None:
+                    children.append(node.else_block)
+                return Kind.CONDITIONAL, NO_OPERAND, children
+            case StatementWrapper():
+                return Kind.STATEMENT, NO_OPERAND, [node.expression]
+            case PassStatement():
+                return Kind.PASS, NO_OPERAND, []
+            case ReturnStatement():
+                return Kind.RETURN, NO_OPERAND, [node.expression]
+            case ContinueStatement():
+                return Kind.CONTINUE, NO_OPERAND, []
+            case Primitive(value=Function() as function) if type(function) is Function:
+                memo = (function.memo is not None, function.memo.size if function.memo is not None else None)
+                return Kind.FUNCTION, (tuple(function.parameters), function.infix, memo), [function.block]
+            case Primitive():
+                return Kind.PRIMITIVE, node.value, []
+            case NestedExpression():
+                return Kind.NESTED, NO_OPERAND, [node.expression]
+            case MatrixExpression():
+                return Kind.MATRIX, NO_OPERAND, [] if node.last_operation is None else [node.last_operation]
+            case UnitMatrixExpression():
+                return Kind.UNIT_MATRIX, NO_OPERAND, [node.expression]
+            case MatrixOperation():
+                return Kind.MATRIX_OPERATION, node.operator, [node.left, node.right]
+            case DictionaryExpression():
+                # The keys and values alternate
+                return Kind.DICTIONARY, NO_OPERAND, [child for pair in zip(node.keys, node.values) for child in pair]
+            case SetExpression():
+                return Kind.SET, NO_OPERAND, node.elements
+            case UnaryOperator():
+                return Kind.UNARY, node.operator, [node.expression]
+            case ComparisonOperator():
+                return Kind.COMPARISON, node.operator, [node.left, node.right]
+            case BinaryOperator():
+                return Kind.BINARY, node.operator, [node.left, node.right]
+            case TernaryOperator():
+                return Kind.TERNARY, node.operator, [node.first, node.second, node.third]
+            case FunctionCall():
+                return Kind.CALL, node.spread, [node.expression, *node.arguments]
+            case ListAccess():
+                return Kind.LIST_ACCESS, NO_OPERAND, [node.expression, *node.arguments]
+            case InfixAccess():
+                return Kind.INFIX, node.identifier, []
+            case VariableAccess():
+                return Kind.VARIABLE, node.identifier, []
+            case VariableChange():
+                children = [node.changing] if node.change_to is None else [node.changing, node.change_to]
+                return Kind.CHANGE, node.operator, children
+        raise RuntimeError(f"Cannot flatten {type(node).__name__}")
+
+    # ******************
+    # RUNNING STATEMENTS
+    # ******************
+    def execute(self, node: int, ctx: Context):
+        """
+        Runs a statement.
+        :param node: the statement
+        :param ctx: the context
+        :return: ``None`` if the next statement can be run, otherwise ``CONTINUE`` or the returned value
+        """
+        kind = self.kinds[node]
+        children = self.children[self.starts[node]:self.ends[node]]
+        match kind:
+            case Kind.BLOCK | Kind.RETURN_BLOCK:
+                return self._execute_all(children, ctx)
+            case Kind.STATEMENT:
+                self.evaluate(children[0], ctx)
+            case Kind.WHILE:
+                while self.evaluate(children[0], ctx):
+                    signal = self._execute_all(children[1:], ctx)
+                    if isinstance(signal, _Returned):
+                        return signal
+            case Kind.FOR:
+                identifier = self.constants[self.operands[node]]
+                for value in self.evaluate(children[0], ctx):
+                    ctx.variables()[identifier] = value
+                    signal = self._execute_all(children[1:], ctx)
+                    if isinstance(signal, _Returned):
+                        return signal
+            case Kind.CONDITIONAL:
+                for i in range(0, len(children) - 1, 2):
+                    if self.evaluate(children[i], ctx):
+                        return self.execute(children[i + 1], ctx)
+                if len(children) % 2 == 1:
+                    return self.execute(children[-1], ctx)
+            case Kind.RETURN:
+                return _Returned(self.evaluate(children[0], ctx))
+            case Kind.CONTINUE:
+                return CONTINUE
+            case Kind.PASS:
+                pass
+        return None
+
+    def _execute_all(self, nodes, ctx: Context):
+        for node in nodes:
+            signal = self.execute(node, ctx)
+            if signal is not None:
+                return signal
+        return None
+
+    # **********************
+    # EVALUATING EXPRESSIONS
+    # **********************
+    def evaluate(self, node: int, ctx: Context):
+        return self._evaluators[self.kinds[node]](node, ctx)
+
+    def _operand(self, node: int):
+        return self.constants[self.operands[node]]
+
+    def _child(self, node: int, index=0) -> int:
+        return self.children[self.starts[node] + index]
+
+    def _evaluate_primitive(self, node: int, ctx: Context):
+        return self._operand(node)
+
+    def _evaluate_function(self, node: int, ctx: Context):
+        # Just like in the tree, a definition always evaluates to the same function
+        function = self.functions.get(node)
+        if function is None:
+            parameters, infix, (memoized, size) = self._operand(node)
+            function = FlatFunction(self, self._child(node), list(parameters), infix=infix,
+                                    memo=LRUCache(size) if memoized else None)
+            # Another thread may have created it in the meantime, in which case that one is used
+            function = self.functions.setdefault(node, function)
+        return function
+
+    def _evaluate_nested(self, node: int, ctx: Context):
+        return self.evaluate(self._child(node), ctx)
+
+    def _evaluate_matrix(self, node: int, ctx: Context):
+        if self.starts[node] == self.ends[node]:
+            return Matrix()
+        return self.evaluate(self._child(node), ctx)
+
+    def _evaluate_unit_matrix(self, node: int, ctx: Context):
+        return Matrix(self.evaluate(self._child(node), ctx))
+
+    def _evaluate_matrix_operation(self, node: int, ctx: Context):
+        left = self.evaluate(self._child(node), ctx)
+        return MatrixOperation.combine(left, self._operand(node), self.evaluate(self._child(node, 1), ctx))
+
+    def _evaluate_dictionary(self, node: int, ctx: Context):
+        values = [self.evaluate(child, ctx) for child in self.children[self.starts[node]:self.ends[node]]]
+        return DictionaryExpression.build(values[0::2], values[1::2])
+
+    def _evaluate_set(self, node: int, ctx: Context):
+        return SetExpression.build([self.evaluate(child, ctx) for child in self.children[self.starts[node]:self.ends[node]]])
+
+    def _evaluate_unary(self, node: int, ctx: Context):
+        return UnaryOperator.calculate(self._operand(node), self.evaluate(self._child(node), ctx))
+
+    def _evaluate_binary(self, node: int, ctx: Context):
+        left = self.evaluate(self._child(node), ctx)
+        return BinaryOperator.calculate(left, self._operand(node), self.evaluate(self._child(node, 1), ctx))
+
+    def _evaluate_ternary(self, node: int, ctx: Context):
+        first, second, third = [self.evaluate(child, ctx) for child in self.children[self.starts[node]:self.ends[node]]]
+        return TernaryOperator.calculate(self._operand(node), first, second, third)
+
+    def _evaluate_comparison(self, node: int, ctx: Context):
+        left_node = self._child(node)
+        left = self.evaluate(left_node, ctx)
+        valid = True
+        right = self.evaluate(self._child(node, 1), ctx)
+
+        # Chained comparison operators
+        if self.kinds[left_node] == Kind.COMPARISON:
+            left = self.evaluate(self._child(left_node, 1), ctx)
+            valid = self.evaluate(left_node, ctx)
+
+        return ComparisonOperator.chain(valid, left, self._operand(node), right)
+
+    def _evaluate_call(self, node: int, ctx: Context):
+        children = self.children[self.starts[node]:self.ends[node]]
+        func = self.evaluate(children[0], ctx)
+        args = [self.evaluate(child, ctx) for child in children[1:]]
+        if 0 < len(args) < func.arguments_needed():
+            return func.partial(args)
+        return func.execute(ctx, args, spread=self._operand(node))
+
+    def _evaluate_temporary(self, node: int, ctx: Context) -> tuple:
+        """
+        Evaluates a node, and tells whether its value is a temporary, see ``Expression.evaluate_temporary``.
+        """
+        match self.kinds[node]:
+            case Kind.NESTED:
+                return self._evaluate_temporary(self._child(node), ctx)
+            case Kind.MATRIX | Kind.UNIT_MATRIX | Kind.UNARY | Kind.COMPARISON:
+                return self.evaluate(node, ctx), True
+            case Kind.BINARY if self._operand(node) not in ("and", "or", "if"):
+                return self.evaluate(node, ctx), True
+            case Kind.CALL if not self._operand(node):
+                children = self.children[self.starts[node]:self.ends[node]]
+                func = self.evaluate(children[0], ctx)
+                evaluated = [self._evaluate_temporary(child, ctx) for child in children[1:]]
+                args = [value for value, _ in evaluated]
+                if 0 < len(args) < func.arguments_needed():
+                    return func.partial(args), True
+                result = func.execute(ctx, args)
+                return result, FunctionCall.returns_new(func, args, [temporary for _, temporary in evaluated], result)
+        return self.evaluate(node, ctx), False
+
+    def _evaluate_new(self, node: int, ctx: Context):
+        """
+        Evaluates a node to a value that can be assigned, see ``Expression.evaluate_new``.
+        """
+        value, temporary = self._evaluate_temporary(node, ctx)
+        return value if temporary else copy(value)
+
+    def _evaluate_list_access(self, node: int, ctx: Context):
+        children = self.children[self.starts[node]:self.ends[node]]
+        return self.evaluate(children[0], ctx)[[self.evaluate(child, ctx) for child in children[1:]]]
+
+    def _evaluate_variable(self, node: int, ctx: Context):
+        result = ctx.variables().get(self._operand(node))
+        if self.kinds[node] == Kind.INFIX and not getattr(result, "infix", False):
+            raise RuntimeError("This function is not an infix function")
+        return result
+
+    def _evaluate_change(self, node: int, ctx: Context):
+        changing = self._child(node)
+        mode = ChangeMode(self._operand(node))
+        value = self._evaluate_new(self._child(node, 1), ctx) if self.ends[node] - self.starts[node] > 1 else None
+
+        # Changing a nested expression changes the expression inside of it
+        while self.kinds[changing] == Kind.NESTED:
+            changing = self._child(changing)
+        match self.kinds[changing]:
+            case Kind.VARIABLE | Kind.INFIX:
+                return VariableAccess.change_variable(ctx.variables(), self._operand(changing), mode, value)
+            case Kind.LIST_ACCESS:
+                children = self.children[self.starts[changing]:self.ends[changing]]
+                return ListAccess.change_item(self.evaluate(children[0], ctx),
+                                              [self.evaluate(child, ctx) for child in children[1:]],
+                                              mode,
+                                              value)
+        raise RuntimeError("This expression cannot be changed")
+
+
+class FlatFunction(Function):
+    """
+    A function defined in a flat program, whose body is run by that program.
+    """
+    def __init__(self, program: FlatProgram, body: int, parameters: list[str], infix=False, memo=None):
+        super().__init__(parameters, None, infix=infix, memo=memo)
+        self.program = program
+        self.body = body
+
+    def _get_return_value(self, ctx: Context, parameters: dict[str, Any]):
+        # TODO Remove variables afterwards
+        ctx.variables().update(parameters)
+        return self.program.call(self.body, ctx)
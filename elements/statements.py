@@ -4,6 +4,8 @@ from elements.expressions import Expression
 from utils.builtins import pretty_print
 from utils.parser_utils import Context
 
+_EXHAUSTED = object()
+
 
 def run_statements(start, ctx, predicate=lambda x: x is not None, debug=False):
     """
@@ -17,22 +19,36 @@ def run_statements(start, ctx, predicate=lambda x: x is not None, debug=False):
     :return: the last statement that was called
     """
     current = start
+    # Asynchronous programs check before every statement whether they should let others run
+    task = ctx.task
+    if task is not None:
+        task.checkpoint()
+    # A profiler measures every statement, see utils.profiling
+    profiler = ctx.profiler
     if debug:
         print("DEBUG: Currently walking over", current)
-    following = start.walk(ctx)
+    following = start.walk(ctx) if profiler is None else profiler.walk(start, ctx)
     while predicate(following):
         current = following
+        if task is not None:
+            task.checkpoint()
         if debug:
             print("DEBUG: Currently walking over", current)
-        following = current.walk(ctx)
+        following = current.walk(ctx) if profiler is None else profiler.walk(current, ctx)
     else:
         return current
 
 
 class Statement:
+    __slots__ = ("parent", "next", "lineno")
+
     def __init__(self):
         self.parent: Optional['Statement'] = None
         self.next: Optional['Statement'] = None
+        self.lineno = 0
+        """
+        The line in the source where this statement starts, or 0 if it is unknown.
+        """
 
     def take_next(self, ctx: Context):
         if self.next is not None:
@@ -60,6 +76,8 @@ class Statement:
 
 
 class StatementWrapper(Statement):
+    __slots__ = ("expression",)
+
     def __init__(self, expression: Expression):
         super().__init__()
         self.expression = expression
@@ -71,6 +89,8 @@ class StatementWrapper(Statement):
 # The way this is implemented makes it a statement and not a block.
 # It doesn't need the children functionality.
 class ConditionalStatement(Statement):
+    __slots__ = ("if_expression", "if_block", "elif_expressions", "elif_blocks", "else_block")
+
     def __init__(self, if_expression, if_block):
         super().__init__()
         self.if_expression = if_expression
@@ -104,22 +124,33 @@ class ConditionalStatement(Statement):
 
 
 class PassStatement(Statement):
+    __slots__ = ()
+
     def run(self, ctx: Context):
         pass
 
 
 class ReturnStatement(Statement):
+    __slots__ = ("expression",)
+
     def __init__(self, expression):
         super().__init__()
         self.expression = expression
 
     def walk(self, ctx: Context):
         return_block = self.find_parent(ReturnBlock)
-        return_block.returned = self.expression.evaluate(ctx)
+        ctx.returned[return_block] = self.expression.evaluate(ctx)
+        # The blocks we're returning from won't continue, so they need to be cleared
+        parent = self.parent
+        while parent is not return_block:
+            parent.clear(ctx)
+            parent = parent.parent
         return return_block
 
 
 class ContinueStatement(Statement):
+    __slots__ = ()
+
     def walk(self, ctx: Context):
         block = self.find_parent(WhileBlock)
         # We need to manually take the next item, since the while-condition is checked in there.
@@ -127,6 +158,8 @@ class ContinueStatement(Statement):
 
 
 class Block(Statement):
+    __slots__ = ("children",)
+
     def __init__(self):
         super().__init__()
         self.children = []
@@ -142,23 +175,23 @@ class Block(Statement):
 
 
 class ReturnBlock(Block):
-    def __init__(self):
-        super().__init__()
-        self.returned = None
+    __slots__ = ()
 
     def walk(self, ctx: Context):
         # The return block is a special block encapsulated by the function definition call.
         # We know the function definition call handles the returned value and clears the data,
         # so we won't be running any further statements.
         # This prevents multiple functions returning at once, but so be it.
-        return self.children[0] if len(self.children) > 0 and self.returned is None else self.take_next(ctx)
+        return self.children[0] if len(self.children) > 0 and self not in ctx.returned else self.take_next(ctx)
 
     def clear(self, ctx: Context):
         # Needs to be called by the function definition call!
-        self.returned = None
+        ctx.returned.pop(self, None)
 
 
 class WhileBlock(Block):
+    __slots__ = ("expression",)
+
     def __init__(self, expression):
         super().__init__()
         self.expression = expression
@@ -175,28 +208,28 @@ class WhileBlock(Block):
 
 
 class ForBlock(WhileBlock):
+    __slots__ = ("identifier",)
+
     def __init__(self, identifier: str, expression: Expression):
         super().__init__(expression)
-        self.evaluated: list | None = None
         self.identifier = identifier
 
     def take_next(self, ctx: Context):
-        if len(self.evaluated) > 0:
-            return self
-        elif self.next is not None:
-            return self.next
-        elif self.parent is not None:
-            return self.parent.take_next(ctx)
-        else:
-            return None
+        # Walking over this block again fetches the next element, or leaves the loop if there is none
+        return self
 
     def walk(self, ctx: Context):
-        if self.evaluated is None:
-            # For now, let's only supported Matrices
-            # TODO Support any iterable type
-            self.evaluated = self.expression.evaluate(ctx).vector()
+        evaluated = ctx.iterators.get(self)
+        if evaluated is None:
+            # Any iterable works, including lazy ones that don't have all their elements in memory
+            evaluated = ctx.iterators[self] = iter(self.expression.evaluate(ctx))
+
+        value = next(evaluated, _EXHAUSTED)
+        if value is _EXHAUSTED:
+            self.clear(ctx)
+            return Statement.take_next(self, ctx)
 
-        ctx.variables()[self.identifier] = self.evaluated.pop(0)
+        ctx.variables()[self.identifier] = value
         if len(self.children) > 0:
             return self.children[0]
         return self.take_next(ctx)
@@ -204,4 +237,4 @@ class ForBlock(WhileBlock):
     def clear(self, ctx: Context):
         # Needs to be called when moving to the next statement or when breaking!
         # TODO Remove reference to identifier in variable dictionary
-        self.evaluated = None
+        ctx.iterators.pop(self, None)
@@ -0,0 +1,159 @@
+"""
+Checks that the tree walker, the virtual machine and the flat program give the same results for
+the same programs: the same output, the same variables afterwards, and the same error if the
+program fails. The flat program is saved and loaded again first, so that is checked as well.
+
+    python equivalence.py
+    python equivalence.py resources/*.hk model.hk
+
+Without scripts, the examples in ``resources`` and the programs in ``CORPUS`` are checked.
+"""
+import argparse
+import glob
+import os
+import sys
+
+from elements.bytecode import compile_program, run_program
+from elements.flat import FlatProgram
+from elements.statements import run_statements
+from lexer import initiate_lexer
+from parser import builtins, initiate_context, initiate_parser
+from utils.output import BufferSink
+
+CORPUS = {
+    "control flow": "total = 0\n"
+                    "for i in [1, 2, 3, 4, 5, 6]:\n"
+                    "\tif i % 2 == 0:\n"
+                    "\t\tcontinue\n"
+                    "\ttotal += i\n"
+                    "n = 0\n"
+                    "while n < 10:\n"
+                    "\tn += 3\n"
+                    "print(total, n, 1 < n <= 12)\n",
+    "functions": "add = fn a, b: a + b\n"
+                 "increment = add(1)\n"
+                 "twice = fn f, x:\n"
+                 "\treturn f(f(x))\n"
+                 "square = memo fn x: x ^ 2\n"
+                 "print(increment(4), twice(increment, 1), square(3), square(3), memo_info(square))\n",
+    "assignments": "A = [1, 2; 3, 4]\n"
+                   "B = A\n"
+                   "B[0, 0] = 9\n"
+                   "C = A + 1\n"
+                   "C[0, 0] = 0\n"
+                   "D = transpose(A)\n"
+                   "D[0, 1] = 0\n"
+                   "x = y = 3\n"
+                   "x += 1\n"
+                   "print(A, B, C, D, x, y)\n",
+    "collections": "d = {\"a\": 1, \"b\": [1, 2]}\n"
+                   "s = {1, 2, 3}\n"
+                   "print(d, keys(d), 2 in s, len(s), s intersect {2, 3, 4})\n",
+    "matrices": "A = [4, 1; 1, 3]\n"
+                "b = [1; 2]\n"
+                "x = A \\ b\n"
+                "print(A * x - b, sum(A), sum(A, 0), mean(A, 1), cumsum([1, 2, 3]), A .* A, A ^ 2)\n"
+                "print(sparse(A) \\ b, A[A > 2], max(A, 0))\n",
+    "complex matrices": "A = [1 + 2i, 3i; 4, 5]\n"
+                        "print(sum(A), mean(A), prod(A), sum(A, 0), mean(A, 1), trace(A), dot(A, A))\n"
+                        "print(real(A), imag(A), conj(A))\n",
+    "errors": "x = 1\n"
+              "y = [1, 2] * [3, 4]\n",
+}
+"""
+Small programs that cover what the examples in ``resources`` don't, by name.
+"""
+
+
+def _parse(source: str):
+    # Every engine gets its own tree, since the tree walker keeps caches in the tree
+    lexer, tokens = initiate_lexer(None)
+    return initiate_parser(tokens).parse(source, lexer=lexer)
+
+
+def _run_tree(source: str, ctx):
+    run_statements(_parse(source), ctx)
+
+
+def _run_vm(source: str, ctx):
+    run_program(compile_program(_parse(source)), ctx)
+
+
+def _run_flat(source: str, ctx):
+    FlatProgram.from_bytes(FlatProgram.from_tree(_parse(source)).to_bytes()).run(ctx)
+
+
+ENGINES = {"tree": _run_tree, "vm": _run_vm, "flat": _run_flat}
+
+
+def run(engine: str, source: str) -> tuple[str, dict[str, str], str | None]:
+    """
+    Runs a program on an engine.
+    :param engine: the name of the engine, see ``ENGINES``
+    :param source: the source code of the program
+    :return: the output, the variables the program defined or changed (as text) and the error, if any
+    """
+    ctx = initiate_context()
+    ctx.output = BufferSink()
+    error = None
+    try:
+        ENGINES[engine](source, ctx)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        ctx.output.flush()
+    initial = builtins()
+    variables = {name: str(value) for name, value in ctx.variables().items()
+                 if name not in initial or value is not initial[name]}
+    return ctx.output.getvalue(), variables, error
+
+
+def compare(source: str) -> list[str]:
+    """
+    Runs a program on every engine and compares the results with those of the tree walker.
+    :param source: the source code of the program
+    :return: the differences, as readable lines
+    """
+    expected_output, expected_variables, expected_error = run("tree", source)
+    differences = []
+    for engine in ENGINES:
+        if engine == "tree":
+            continue
+        output, variables, error = run(engine, source)
+        if output != expected_output:
+            differences.append(f"{engine}: the output is {output!r} instead of {expected_output!r}")
+        for name in sorted(expected_variables.keys() | variables.keys()):
+            if variables.get(name) != expected_variables.get(name):
+                differences.append(f"{engine}: {name} is {variables.get(name)} instead of {expected_variables.get(name)}")
+        if error != expected_error:
+            differences.append(f"{engine}: the error is {error} instead of {expected_error}")
+    return differences
+
+
+def main(arguments: list[str] | None = None) -> int:
+    argument_parser = argparse.ArgumentParser(prog="huckle equivalence",
+                                              description="Checks that all engines give the same results.")
+    argument_parser.add_argument("scripts", nargs="*", help="the scripts to check, by default the examples and the corpus")
+    options = argument_parser.parse_args(arguments)
+
+    programs = {}
+    scripts = options.scripts or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "*.hk")))
+    for script in scripts:
+        with open(script, "r") as file:
+            programs[script] = file.read() + "\n"
+    if not options.scripts:
+        programs.update(CORPUS)
+
+    failed = 0
+    for name, source in programs.items():
+        differences = compare(source)
+        sys.stdout.write(f"{'ok' if not differences else 'DIFFERENT':<10}{name}\n")
+        for difference in differences:
+            sys.stdout.write(f"    {difference}\n")
+        failed += bool(differences)
+    sys.stdout.write(f"{len(programs) - failed} of {len(programs)} programs give the same results on all engines\n")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
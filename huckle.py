@@ -0,0 +1,335 @@
+"""
+Runs huckle programs from Python. A program is compiled once, after which it can be run any
+amount of times with different inputs:
+
+    program = huckle.compile("y = a * x + b")
+    program.run({"a": 2, "x": 3, "b": 1})["y"]  # 7
+
+Every run has its own variables, so runs never see each other's variables. Compiling and
+running can happen from several threads at the same time, and ``run_many`` runs a program for
+many inputs on a pool of threads. Inside an event loop, ``run_async`` runs a program without
+blocking the loop for more than a few milliseconds at a time.
+
+Running this module runs scripts in batch on all cores, printing a JSON line for each of them:
+
+    python huckle.py scripts/*.hk --jobs 8 --timeout 10
+    python huckle.py model.hk --grid rate=0.1,0.2,0.5 --grid steps=10,100
+"""
+import glob
+import itertools
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Iterable
+
+from elements.bytecode import CodeObject, compile_program, run_program
+from lexer import initiate_lexer
+from parser import builtins, initiate_parser
+from utils.cache import LRUCache
+from utils.lazy import is_imported, lazy_import
+from utils.output import BufferSink, OutputSink
+from utils.parser_utils import Context
+from utils.primitives import Matrix
+
+# Only imported once they are used, so programs without matrices start quickly
+np = lazy_import("numpy")
+_sparse = lazy_import("utils.sparse")
+
+_lock = threading.Lock()
+"""
+The lexer and parser keep the state of the source they're parsing, so only one thread can use them at a time.
+"""
+_lexer = None
+_parser = None
+
+
+def _parse(source: str):
+    global _lexer, _parser
+    with _lock:
+        if _parser is None:
+            _lexer, tokens = initiate_lexer(None)
+            _parser = initiate_parser(tokens)
+            _parser.errorfunc = _syntax_error
+        return _parser.parse(source, lexer=_lexer)
+
+
+def _syntax_error(token):
+    # The parser would otherwise skip the invalid part and compile the rest
+    if token is None:
+        raise RuntimeError("Syntax error at the end of the program")
+    raise RuntimeError(f"Syntax error at line {token.lineno}: unexpected {token.type}")
+
+
+class Program:
+    """
+    A compiled program, which can be run many times.
+    """
+    def __init__(self, statements, code: CodeObject):
+        """
+        :param statements: the first statement of the program, used to run it asynchronously
+        :param code: the compiled program
+        """
+        self.statements = statements
+        self.code = code
+
+    def run(self, inputs: dict | None = None, output: OutputSink | None = None) -> dict:
+        """
+        Runs the program with its own variables.
+        :param inputs: the variables to set before running, Numpy arrays are converted to matrices
+        :param output: where the output of the program goes, or ``None`` for the standard output
+        :return: the variables of the program after it ran, including the inputs but not the built-ins
+        """
+        ctx = self._context(inputs, output)
+        run_program(self.code, ctx)
+        return self._outputs(ctx)
+
+    async def run_async(self, inputs: dict | None = None, output: OutputSink | None = None,
+                        scheduler: 'Scheduler | None' = None, name: str | None = None) -> dict:
+        """
+        Runs the program in the event loop, letting other tasks run every few milliseconds.
+        Functions that return awaitables (see ``AwaitableFunction``) are awaited by the event
+        loop, and cancelling the run stops the program.
+        :param inputs: the variables to set before running, Numpy arrays are converted to matrices
+        :param output: where the output of the program goes, or ``None`` for the standard output
+        :param scheduler: the scheduler that keeps track of the program, or ``None`` for none
+        :param name: the name the scheduler reports the program with
+        :return: the variables of the program after it ran, including the inputs but not the built-ins
+        """
+        from utils.scheduling import Task
+        ctx = self._context(inputs, output)
+        if scheduler is None:
+            await Task(self.statements, ctx).run()
+        else:
+            await scheduler.start(name if name is not None else f"program {id(ctx):x}", self.statements, ctx)
+        return self._outputs(ctx)
+
+    @staticmethod
+    def _context(inputs: dict | None, output: OutputSink | None) -> Context:
+        ctx = Context(builtins().copy())
+        if output is not None:
+            ctx.output = output
+        if inputs is not None:
+            variables = ctx.variables()
+            for name, value in inputs.items():
+                variables[name] = Matrix.wrap(value) if _is_array(value) else value
+        return ctx
+
+    @staticmethod
+    def _outputs(ctx: Context) -> dict:
+        variables = ctx.variables()
+        # Built-ins that the program didn't bind again still have their version from the table
+        changed = variables.versions.items() - builtins().versions.items()
+        return {name: variables[name] for name, _ in changed if name in variables}
+
+    def run_many(self, inputs: Iterable[dict], workers: int | None = None) -> list[dict]:
+        """
+        Runs the program for each of the inputs on a pool of threads. The program itself is
+        never changed by running it, so all threads share it.
+        :param inputs: the inputs of each run
+        :param workers: the amount of threads, or ``None`` to let Python choose
+        :return: the variables of each run, in the same order as the inputs
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as executor:
+            return list(executor.map(self.run, inputs))
+
+
+def _is_array(value) -> bool:
+    # A Numpy array can only exist once Numpy has been imported, so it doesn't have to be imported to check
+    return "numpy" in sys.modules and isinstance(value, np.ndarray)
+
+
+def compile(source: str) -> Program:
+    """
+    Compiles a program, so it can be run without parsing it again.
+    :param source: the source code of the program
+    :return: the program
+    """
+    statements = _parse(source + "\n")
+    if statements is None:
+        raise RuntimeError("Cannot compile a program with syntax errors")
+    return Program(statements, compile_program(statements))
+
+
+# *************
+# BATCH RUNNING
+# *************
+_programs = LRUCache(64)
+"""
+The programs a worker compiled, by their source, so a script is only compiled once per worker.
+"""
+
+
+class JobTimeout(Exception):
+    pass
+
+
+def _warm_up():
+    """
+    Prepares a worker process, so the first job doesn't have to build the parser and built-ins,
+    or import Numpy.
+    """
+    _parse("x = 1\n")
+    builtins()
+    np.ndarray
+
+
+def _on_timeout(signum, frame):
+    raise JobTimeout()
+
+
+def _run_job(job: int, script: str, source: str, inputs: dict, timeout: float | None) -> dict:
+    """
+    Runs a script in a worker process.
+    :param job: the number of the job
+    :param script: the path of the script
+    :param source: the source code of the script
+    :param inputs: the variables to set before running
+    :param timeout: the maximum amount of seconds the script can run, or ``None`` for no maximum
+    :return: the result of the job, which can be written as JSON
+    """
+    result = {"job": job, "script": script, "inputs": inputs}
+    output = BufferSink()
+    start = time.perf_counter()
+    # The alarm signal interrupts the script, but only exists on Unix
+    use_alarm = timeout is not None and hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        program = _programs.get(source, None)
+        if program is None:
+            program = compile(source)
+            _programs.put(source, program)
+        variables = program.run(inputs, output)
+        result["status"] = "ok"
+        result["variables"] = {name: _json_value(value) for name, value in variables.items()
+                               if name not in inputs}
+    except JobTimeout:
+        result["status"] = "timeout"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    output.flush()
+    result["output"] = output.getvalue()
+    result["time"] = time.perf_counter() - start
+    return result
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if "numpy" in sys.modules and isinstance(value, np.generic):
+        return _json_value(value.item())
+    if isinstance(value, list):
+        return [_json_value(element) for element in value]
+    if isinstance(value, Matrix) and not (is_imported(_sparse) and isinstance(value, _sparse.SparseMatrix)):
+        return _json_value(value.array.tolist())
+    # Everything else, like functions and complex numbers, is written as it would be printed
+    return str(value)
+
+
+def _parse_grid(grid: list[str]) -> list[dict]:
+    """
+    Creates the inputs for every combination of the values in the grid.
+    :param grid: the values of each variable, like ``x=1,2,3``
+    :return: the inputs
+    """
+    names = []
+    values = []
+    for entry in grid:
+        name, _, options = entry.partition("=")
+        if not name or not options:
+            raise RuntimeError(f"Expected a grid entry like 'x=1,2,3', but found '{entry}'")
+        names.append(name)
+        values.append([_parse_value(option) for option in options.split(",")])
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def _parse_value(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+def _scripts(patterns: list[str]) -> list[str]:
+    scripts = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if not matches:
+            raise RuntimeError(f"No scripts found for '{pattern}'")
+        scripts += matches
+    return scripts
+
+
+def run_batch(jobs: Iterable[tuple[str, dict]], workers: int | None = None, timeout: float | None = None):
+    """
+    Runs scripts on a pool of processes, each of which has its parser and built-ins ready
+    before the first script arrives. Only a few jobs per process are sent at a time, so a
+    large parameter sweep doesn't have to fit in memory.
+    :param jobs: the path of the script and the inputs of each job
+    :param workers: the amount of processes, or ``None`` for one per core
+    :param timeout: the maximum amount of seconds a job can run, or ``None`` for no maximum
+    :return: the results of the jobs, in the order they finish
+    """
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    workers = workers if workers is not None else os.cpu_count() or 1
+    sources = {}
+    with ProcessPoolExecutor(workers, initializer=_warm_up) as executor:
+        pending = set()
+        for job, (script, inputs) in enumerate(jobs):
+            if script not in sources:
+                with open(script, "r") as file:
+                    sources[script] = file.read()
+            pending.add(executor.submit(_run_job, job, script, sources[script], inputs, timeout))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from (future.result() for future in done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from (future.result() for future in done)
+
+
+def main(arguments: list[str] | None = None) -> int:
+    """
+    Runs scripts from the command line, and writes the result of each of them as a line of JSON.
+    :param arguments: the command line arguments
+    :return: the exit code, which is 1 if any job didn't succeed
+    """
+    import argparse
+    argument_parser = argparse.ArgumentParser(prog="huckle", description="Runs huckle scripts on all cores.")
+    argument_parser.add_argument("scripts", nargs="+", help="the scripts to run, globs like 'scripts/*.hk' are allowed")
+    argument_parser.add_argument("--grid", action="append", default=[], metavar="NAME=VALUES",
+                                 help="runs the script for each of the comma-separated values of a variable, "
+                                      "can be repeated to run every combination")
+    argument_parser.add_argument("--jobs", "-j", type=int, default=None,
+                                 help="the amount of scripts to run at the same time, one per core by default")
+    argument_parser.add_argument("--timeout", type=float, default=None,
+                                 help="the maximum amount of seconds a script can run")
+    options = argument_parser.parse_args(arguments)
+
+    try:
+        scripts = _scripts(options.scripts)
+        grid = _parse_grid(options.grid)
+    except RuntimeError as e:
+        argument_parser.error(str(e))
+    if options.grid and len(scripts) != 1:
+        argument_parser.error("A grid can only be used with a single script")
+
+    succeeded = True
+    for result in run_batch(((script, inputs) for script in scripts for inputs in grid), options.jobs, options.timeout):
+        succeeded &= result["status"] == "ok"
+        sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
+    return 0 if succeeded else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,18 +13,19 @@ class IndentationToken(LexToken):
         self.lexpos = None
         self.lexer = None
 
-    def complete(self, lexer):
-        self.lineno = lexer.lineno
-        self.lexpos = lexer.lexpos
+    def complete(self, lexer, token: LexToken = None):
+        """
+        :param lexer: the lexer
+        :param token: the NL token this token was created for, which gives its position. By the time
+         it is read, the lexer has already counted the newlines in it
+        :return: this token
+        """
+        self.lineno = lexer.lineno if token is None else token.lineno
+        self.lexpos = lexer.lexpos if token is None else token.lexpos
         self.lexer = lexer
         return self
 
 
-indent = IndentationToken("IND")
-dedent = IndentationToken("DED")
-newline = IndentationToken("NL")
-
-
 class IndentLexer:
     """
     This wrapper class makes sure that indents are handled correctly, as the PLY lexing
@@ -41,9 +42,17 @@ class IndentLexer:
         # This is just in case the ply-generated lexer cannot be called again
         # after it returns None.
         self.eof_reached = False
+        # Whether a token other than a newline has been read yet
+        self.started = False
 
     def input(self, source: str):
+        # The lexer can be reused, so the state of the previous input is discarded
         self.lexer.input(source)
+        self.lexer.lineno = 1
+        self.indent_stack = [0]
+        self.token_queue.clear()
+        self.eof_reached = False
+        self.started = False
 
     def token(self):
         """
@@ -55,36 +64,36 @@ class IndentLexer:
         # Are we at the end of the file?
         if self.eof_reached:
             return None
-        # Fetch the token
+        # Fetch the token. Empty lines and comments before the first statement don't end a statement,
+        # so they are skipped
         t = self.lexer.token()
+        while not self.started and t is not None and t.type == "NL" and t.value == 0:
+            t = self.lexer.token()
+        self.started = True
         if t is None:
             # At end of input, we might need to send some dedents
             self.eof_reached = True
             if len(self.indent_stack) > 1:
-                t = dedent
                 for i in range(len(self.indent_stack) - 1):
-                    self.token_queue.append(dedent.complete(self.lexer))
+                    self.token_queue.append(IndentationToken("DED").complete(self.lexer))
                 self.indent_stack = [0]
         elif t.type == "NL":
-            # TODO Fix line numbering
-            self.lexer.lineno += 1
-
             # The NL token includes the amount of leading whitespace.
             # Fabricate indent or dedents as/if necessary and queue them.
             if t.value > self.indent_stack[-1]:
                 self.indent_stack.append(t.value)
-                self.token_queue.append(indent.complete(self.lexer))
+                self.token_queue.append(IndentationToken("IND").complete(self.lexer, t))
                 return self.token_queue.popleft()
             else:
                 while t.value < self.indent_stack[-1]:
                     self.indent_stack.pop()
-                    self.token_queue.append(dedent.complete(self.lexer))
+                    self.token_queue.append(IndentationToken("DED").complete(self.lexer, t))
                 if t.value != self.indent_stack[-1]:
                     # TODO Create an error class for this
                     raise Exception("Indentation error")
                 # Each statement must end with a newline, or multiple ones. Adding this ensures
                 # that the user does not need an empty line after a dedent.
-                self.token_queue.append(newline.complete(self.lexer))
+                self.token_queue.append(IndentationToken("NL").complete(self.lexer, t))
                 return self.token_queue.popleft()
         else:
             return t
@@ -108,6 +117,7 @@ def initiate_lexer(to_parse):
         "fn": "FUN",
         "return": "RETURN",
         "infix": "INFIX",
+        "memo": "MEMO",
         # "expand": "EXPAND",
         "=": "ASSIGN",
         "+=": "PLUSASSIGN",
@@ -119,6 +129,7 @@ def initiate_lexer(to_parse):
         "*": "TIMES",
         ".*": "ELTIMES",
         "/": "DIV",
+        "\\": "LDIV",
         "%": "MOD",
         "^": "POW",
         ".^": "ELPOW",
@@ -133,6 +144,8 @@ def initiate_lexer(to_parse):
         ")": "RPAREN",
         "[": "LBRACKET",
         "]": "RBRACKET",
+        "{": "LBRACE",
+        "}": "RBRACE",
         ",": "COMMA",
         ";": "SEMICOLON",
         ":": "COLON",
@@ -153,6 +166,7 @@ def initiate_lexer(to_parse):
 
     def t_STRING(t):
         r"\"[^\"]*\""
+        t.lexer.lineno += t.value.count("\n")
         t.value = t.value[1:-1]
         return t
 
@@ -189,6 +203,8 @@ def initiate_lexer(to_parse):
     def t_NL(t):
         # Takes comments ('#') into account!
         r'\n(?:\t*(?:[#].*)?\n)*\t*'
+        # Empty lines and comments are part of the token, so each of them has to be counted
+        t.lexer.lineno += t.value.count('\n')
         t.value = len(t.value) - 1 - t.value.rfind('\n')
         return t
 
@@ -1,7 +1,11 @@
+import argparse
+import sys
+
 from elements.statements import run_statements
 from lexer import initiate_lexer
 from parser import initiate_parser, initiate_context
 from utils.primitives import Complex
+from utils.profiling import Profiler
 
 # TODO Add tuples (up for debate)
 # TODO Element-wise division, multiplication
@@ -18,30 +22,37 @@ from utils.primitives import Complex
 # TODO Decorator for parser functions
 # TODO Rewrite the parser rules by hand
 
-# File to be parsed
-source = open("resources/test.hk", "r").read() + "\n"
-
-# Build the parser and lexer
-lexer, tokens = initiate_lexer(source)
-parser = initiate_parser(tokens)
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(prog="huckle", description="Runs a huckle script.")
+    argument_parser.add_argument("script", nargs="?", default="resources/test.hk", help="the script to run")
+    argument_parser.add_argument("--profile", action="store_true",
+                                 help="measures the time and memory of each line and function, and reports them at the end")
+    argument_parser.add_argument("--collapsed", default=None, metavar="PATH",
+                                 help="writes the profiled stacks to a file, which flame graph tools can draw")
+    argument_parser.add_argument("--limit", type=int, default=20, help="the amount of lines and functions to report")
+    options = argument_parser.parse_args()
 
-program = parser.parse(source, lexer=lexer, debug=False)
-run_statements(program, initiate_context(), debug=False)
+    # File to be parsed
+    source = open(options.script, "r").read() + "\n"
 
+    # Build the parser and lexer
+    lexer, tokens = initiate_lexer(source)
+    parser = initiate_parser(tokens)
 
-# Explanation mode
-# for block in source.split("# "):
-#     lines = block.split("\n")
-#     if len(lines) >= 1:
-#         print()
-#         print(lines[0])
-#         first_printed = False
-#         for line in lines[1:]:
-#             if first_printed:
-#                 print()
-#             first_printed = True
-#             print(line)
-#             if line.startswith(">> "):
-#                 execute_program(line[len(">> "):], lexer, parser, expression_only=True)
-#             else:
-#                 execute_program(line, lexer, parser)
+    program = parser.parse(source, lexer=lexer, debug=False)
+    context = initiate_context()
+    profiler = Profiler(source, options.script) if options.profile or options.collapsed is not None else None
+    try:
+        if profiler is None:
+            run_statements(program, context, debug=False)
+        else:
+            profiler.run(program, context)
+    finally:
+        # The output is buffered, so what is left must be written at the end
+        context.output.flush()
+        if profiler is not None:
+            if options.profile:
+                sys.stderr.write(profiler.report(options.limit) + "\n")
+            if options.collapsed is not None:
+                with open(options.collapsed, "w") as file:
+                    file.write(profiler.collapsed() + "\n")
@@ -1,10 +1,14 @@
-import cmath
+import functools
+import importlib
 import math
-import operator
+import os
+from types import SimpleNamespace
 
 from ply import yacc
 
 from utils.builtins import *
+from utils.cache import LRUCache
+from utils.parser_utils import Context, Variables
 from utils.primitives import *
 from elements.expressions import *
 from elements.statements import *
@@ -28,7 +32,7 @@ def initiate_parser(tokens):
         ("nonassoc", "IN"),
         ("left", "EQ", "NEQ", "GT", "GTE", "LT", "LTE"),
         ("left", "PLUS", "MIN"),
-        ("left", "TIMES", "ELTIMES", "DIV", "MOD"),
+        ("left", "TIMES", "ELTIMES", "DIV", "LDIV", "MOD"),
         ("left", "POW", "ELPOW"),
         ("right", "UMINUS", "QUOTE"),
         # Needed for expression calling?
@@ -159,9 +163,7 @@ def initiate_parser(tokens):
         expression : expression ID expression
                    | expression ID DOT expression
         """
-        p[0] = FunctionCall(VariableAccess(p[2], lambda x: x.infix, "This function is not an infix function"),
-                            [p[1], p[:][-1]],
-                            spread=len(p) == 5)
+        p[0] = FunctionCall(InfixAccess(p[2]), [p[1], p[:][-1]], spread=len(p) == 5)
 
     def p_list_access(p):
         """
@@ -178,7 +180,7 @@ def initiate_parser(tokens):
         # The first argument needs to be defined separately, otherwise it clashes with another rule:
         # - expression : ID
         """
-        expression : INFIX function_definition
+        expression : function_modifiers function_definition
                    | function_definition
         function_definition : FUN parameter_declaration COLON IND block DED
                             | FUN COLON IND block DED
@@ -187,9 +189,11 @@ def initiate_parser(tokens):
         parameter_declaration : ID
                               | parameter_declaration COMMA ID
         """
-        if len(p) == 3 and p[1] == "infix":
+        if len(p) == 3 and isinstance(p[1], list):
             function = p[2]
-            function.infix = True
+            function.infix = "infix" in p[1]
+            if "memo" in p[1]:
+                function.memo = LRUCache()
             p[0] = Primitive(function)
         elif len(p) == 2:
             if isinstance(p[1], str):
@@ -204,6 +208,7 @@ def initiate_parser(tokens):
             elif len(p) == 5:
                 # Inline function with arguments provided
                 return_block.set_children([ReturnStatement(p[4])])
+                return_block.children[0].lineno = p.lineno(1)
             elif len(p) == 6:
                 # Function block with no arguments
                 return_block.set_children([p[4]])
@@ -213,6 +218,7 @@ def initiate_parser(tokens):
                 # Inline function with no arguments
                 assert len(p) == 4
                 return_block.set_children([ReturnStatement(p[3])])
+                return_block.children[0].lineno = p.lineno(1)
                 p[0] = Function([], return_block)
                 return
 
@@ -222,6 +228,18 @@ def initiate_parser(tokens):
             parameter_declaration.append(p[3])
             p[0] = parameter_declaration
 
+    def p_function_modifiers(p):
+        """
+        function_modifiers : INFIX
+                           | MEMO
+                           | function_modifiers INFIX
+                           | function_modifiers MEMO
+        """
+        if len(p) == 2:
+            p[0] = [p[1]]
+        else:
+            p[0] = p[1] + [p[2]]
+
     def p_matrix(p):
         """
         expression : LBRACKET matrix RBRACKET
@@ -239,6 +257,33 @@ def initiate_parser(tokens):
         else:
             p[0] = MatrixOperation(p[1], p[2], p[3])
 
+    def p_dictionary(p):
+        """
+        expression : LBRACE dictionary RBRACE
+                   | LBRACE RBRACE
+        dictionary : expression COLON expression
+                   | dictionary COMMA expression COLON expression
+        """
+        if p[1] == "{":
+            p[0] = DictionaryExpression(*p[2]) if len(p) == 4 else DictionaryExpression([], [])
+        elif len(p) == 4:
+            p[0] = ([p[1]], [p[3]])
+        else:
+            p[0] = (p[1][0] + [p[3]], p[1][1] + [p[5]])
+
+    def p_set(p):
+        """
+        expression : LBRACE set_elements RBRACE
+        set_elements : expression
+                     | set_elements COMMA expression
+        """
+        if p[1] == "{":
+            p[0] = SetExpression(p[2])
+        elif len(p) == 2:
+            p[0] = [p[1]]
+        else:
+            p[0] = p[1] + [p[3]]
+
     def p_change_variable(p):
         """
         expression : expression ASSIGN expression
@@ -279,6 +324,7 @@ def initiate_parser(tokens):
                    | expression TIMES expression
                    | expression ELTIMES expression
                    | expression DIV expression
+                   | expression LDIV expression
                    | expression MOD expression
                    | expression POW expression
                    | expression ELPOW expression
@@ -287,7 +333,7 @@ def initiate_parser(tokens):
                    | expression IF expression
                    | expression IN expression
         """
-        p[0] = BinaryOperator(p[1], p[2], p[3], p[2] not in ("%", "if", "in"))
+        p[0] = BinaryOperator(p[1], p[2], p[3], p[2] not in ("\\", "%", "if", "in"))
 
     def p_id_and_coefficient(p):
         """
@@ -360,71 +406,191 @@ def initiate_parser(tokens):
     def p_error(p):
         print("Syntax error in input:", p)
 
-    return yacc.yacc(outputdir="output")
+    # Every rule stores where its node starts in the source
+    rules = {name: _positioned(value) if name.startswith("p_") and name != "p_error" else value
+             for name, value in locals().items()}
+
+    # The tables are stored next to this file and imported from there, so they are only generated
+    # once, wherever the parser is used from
+    output = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
+    os.makedirs(output, exist_ok=True)
+    return yacc.yacc(module=SimpleNamespace(__module__=__name__, **rules), outputdir=output, tabmodule="output.parsetab")
+
+
+def _positioned(rule):
+    """
+    Wraps a grammar rule, so the statement, expression or function it creates knows the line it starts at.
+    Nodes that are passed on by the rule, like a block that gets another statement, keep the line
+    they already had.
+    :param rule: the grammar rule
+    :return: the wrapped rule
+    """
+    @functools.wraps(rule)
+    def wrapper(p):
+        rule(p)
+        node = p[0]
+        if isinstance(node, (Statement, Expression, Function)) and not getattr(node, "lineno", 0):
+            for i in range(1, len(p)):
+                # Tokens know their line, the nodes of other rules were given theirs already
+                lineno = p.lineno(i) or getattr(p[i], "lineno", 0)
+                if lineno:
+                    node.lineno = lineno
+                    break
+    # The rules are ordered by where they are defined, and the first one is the start of the grammar
+    wrapper.co_firstlineno = rule.__code__.co_firstlineno
+    return wrapper
+
+
+_builtins: Variables | None = None
+
+
+def builtins() -> Variables:
+    """
+    :return: the built-in functions and variables, which are only created once
+    """
+    global _builtins
+    if _builtins is None:
+        _builtins = _create_builtins()
+    return _builtins
 
 
 def initiate_context():
-    ctx = Context()
-
-    ctx.variable_states[-1] = {
+    """
+    :return: a new context with its own copy of the built-ins
+    """
+    return Context(builtins().copy())
+
+
+def _builtin(module: str, name: str, kind=PythonFunction, infix=False) -> LazyFunction:
+    """
+    Registers a built-in function without importing it yet. Its module is imported once the
+    function is first called, so a program only pays for the modules it actually uses.
+    :param module: the name of the module that defines the function
+    :param name: the name of the function in that module, which can be an attribute of a class
+    :param kind: the type of function to wrap the Python function with
+    :param infix: whether the function can be used as an infix operator
+    :return: the function
+    """
+    def create():
+        value = importlib.import_module(module)
+        for part in name.split("."):
+            value = getattr(value, part)
+        return kind(value, infix=infix) if infix else kind(value)
+    return LazyFunction(create, infix)
+
+
+def _create_builtins() -> Variables:
+    return Variables({
         # Python functions, later on these will be built-in
-        "len": PythonFunction(len),
-        "slice": PythonFunction(Slice),
-        "str": PythonFunction(str),
+        "len": _builtin("builtins", "len"),
+        "slice": _builtin("utils.primitives", "Slice"),
+        "str": _builtin("builtins", "str"),
+
+        # Function utilities
+        "memoize": _builtin("utils.builtins", "memoize"),
+        "memo_info": _builtin("utils.builtins", "memo_info", ContextFunction),
 
         # Built-in functions
-        "print": ContextFunction(pretty_print),
+        "flush": _builtin("utils.builtins", "flush", ContextFunction),
+        "print": _builtin("utils.builtins", "pretty_print", ContextFunction),
+        "sleep": _builtin("asyncio", "sleep", AwaitableFunction),
+
+        # Collection functions
+        "intersect": _builtin("utils.builtins", "intersect", infix=True),
+        "keys": _builtin("utils.builtins", "keys"),
+        "set": _builtin("utils.builtins", "to_set"),
+        "values": _builtin("utils.builtins", "values"),
 
         # Logic functions
-        "eq": PythonFunction(operator.eq, infix=True),
+        "eq": _builtin("operator", "eq", infix=True),
+
+        # File functions
+        "load": _builtin("utils.files", "load"),
+        "load_raw": _builtin("utils.files", "load_raw"),
+        "read_csv": _builtin("utils.files", "read_csv"),
+        "save": _builtin("utils.files", "save"),
 
         # Matrix functions
-        "cross": PythonFunction(cross, infix=True),
-        "det": PythonFunction(determinant),
-        "diagonal": PythonFunction(diagonal),
-        "dot": PythonFunction(dot, infix=True),
-        "eye": PythonFunction(eye),
-        "inv": PythonFunction(inverse),
-        "max": PythonFunction(maximum),
-        "min": PythonFunction(minimum),
-        "norm": PythonFunction(norm),
-        "ones": PythonFunction(ones),
-        "rank": PythonFunction(rank),
-        "reshape": PythonFunction(reshape, infix=True),
-        "trace": PythonFunction(trace),
-        "transpose": PythonFunction(transpose),
-        "zeros": PythonFunction(zeros),
+        "chol": _builtin("utils.linalg", "chol"),
+        "cross": _builtin("utils.builtins", "cross", infix=True),
+        "det": _builtin("utils.builtins", "determinant"),
+        "diagonal": _builtin("utils.builtins", "diagonal"),
+        "disk": _builtin("utils.disk", "disk"),
+        "dot": _builtin("utils.builtins", "dot", infix=True),
+        "eig": _builtin("utils.linalg", "eig"),
+        "eye": _builtin("utils.builtins", "eye"),
+        "find": _builtin("utils.builtins", "find"),
+        "inv": _builtin("utils.builtins", "inverse"),
+        "lu": _builtin("utils.linalg", "lu"),
+        "max": _builtin("utils.builtins", "maximum"),
+        "min": _builtin("utils.builtins", "minimum"),
+        "norm": _builtin("utils.builtins", "norm"),
+        "ones": _builtin("utils.builtins", "ones"),
+        "qr": _builtin("utils.linalg", "qr"),
+        "rank": _builtin("utils.builtins", "rank"),
+        "reshape": _builtin("utils.builtins", "reshape", infix=True),
+        "share": _builtin("utils.shared", "share"),
+        "solve": _builtin("utils.linalg", "solve"),
+        "svd": _builtin("utils.linalg", "svd"),
+        "trace": _builtin("utils.builtins", "trace"),
+        "transpose": _builtin("utils.builtins", "transpose"),
+        "where": _builtin("utils.builtins", "where"),
+        "zeros": _builtin("utils.builtins", "zeros"),
+
+        # Random functions
+        "rand": _builtin("utils.builtins", "rand", ContextFunction),
+        "randi": _builtin("utils.builtins", "randi", ContextFunction),
+        "randn": _builtin("utils.builtins", "randn", ContextFunction),
+        "seed": _builtin("utils.builtins", "seed", ContextFunction),
+        "shuffle": _builtin("utils.builtins", "shuffle", ContextFunction),
+
+        # Reduction functions
+        "all": _builtin("utils.builtins", "all_true"),
+        "any": _builtin("utils.builtins", "any_true"),
+        "cumsum": _builtin("utils.builtins", "cumulative_sum"),
+        "mean": _builtin("utils.builtins", "mean"),
+        "prod": _builtin("utils.builtins", "product"),
+        "std": _builtin("utils.builtins", "standard_deviation"),
+        "sum": _builtin("utils.builtins", "summation"),
+
+        # Sparse matrix functions
+        "bicgstab": _builtin("utils.sparse", "bicgstab"),
+        "cg": _builtin("utils.sparse", "cg"),
+        "full": _builtin("utils.sparse", "full"),
+        "nnz": _builtin("utils.sparse", "nnz"),
+        "spdiagonal": _builtin("utils.sparse", "spdiagonal"),
+        "sparse": _builtin("utils.sparse", "sparse"),
+        "speye": _builtin("utils.sparse", "speye"),
 
         # Imaginary number functions
-        "conj": PythonFunction(Complex.conjugate),
-        "imag": PythonFunction(imag),
-        "phase": PythonFunction(cmath.phase),
-        "polar": PythonFunction(polar),
-        "real": PythonFunction(real),
+        "conj": _builtin("utils.builtins", "conjugate"),
+        "imag": _builtin("utils.builtins", "imag"),
+        "phase": _builtin("cmath", "phase"),
+        "polar": _builtin("utils.builtins", "polar"),
+        "real": _builtin("utils.builtins", "real"),
 
         # Basic math functions
-        "abs": PythonFunction(abs),
-        "acos": PythonFunction(math.acos),
-        "acosh": PythonFunction(math.acosh),
-        "asin": PythonFunction(math.asin),
-        "asinh": PythonFunction(math.asinh),
-        "atan": PythonFunction(math.atan),
-        "atanh": PythonFunction(math.atanh),
-        "cos": PythonFunction(math.cos),
-        "cosh": PythonFunction(math.cosh),
-        "exp": PythonFunction(math.exp),
-        "log": PythonFunction(math.log),
-        "sin": PythonFunction(math.sin),
-        "sinh": PythonFunction(math.sinh),
-        "sqrt": PythonFunction(sqrt),
-        "tan": PythonFunction(math.tan),
-        "tanh": PythonFunction(math.tanh),
+        "abs": _builtin("builtins", "abs"),
+        "acos": _builtin("math", "acos"),
+        "acosh": _builtin("math", "acosh"),
+        "asin": _builtin("math", "asin"),
+        "asinh": _builtin("math", "asinh"),
+        "atan": _builtin("math", "atan"),
+        "atanh": _builtin("math", "atanh"),
+        "cos": _builtin("math", "cos"),
+        "cosh": _builtin("math", "cosh"),
+        "exp": _builtin("math", "exp"),
+        "log": _builtin("math", "log"),
+        "sin": _builtin("math", "sin"),
+        "sinh": _builtin("math", "sinh"),
+        "sqrt": _builtin("utils.builtins", "sqrt"),
+        "tan": _builtin("math", "tan"),
+        "tanh": _builtin("math", "tanh"),
 
         # Built-in variables
         "e": math.e,
         "i": Complex(0, 1),
         "pi": math.pi,
-        "pretty_print": True
-    }
-
-    return ctx
+        "pretty_print": True,
+        "print_threshold": 1000
+    })
@@ -0,0 +1,160 @@
+"""
+Runs huckle interactively. Every statement runs as soon as it is entered, and the value of an
+expression is printed:
+
+    python repl.py
+    python repl.py data.hk
+
+The scripts that are given run first, so their variables can be explored afterwards. The lexer,
+parser and variables are kept for the whole session: only the statement that was just entered is
+parsed, and earlier statements never run again. A line ending with a colon starts a block, which
+ends at the first empty line.
+"""
+import argparse
+import sys
+
+from elements.expressions import VariableChange
+from elements.statements import StatementWrapper, run_statements
+from lexer import initiate_lexer
+from parser import initiate_context, initiate_parser
+from utils.builtins import pretty_print
+from utils.parser_utils import Context
+
+PROMPT = ">> "
+CONTINUATION = ".. "
+
+
+class Repl:
+    """
+    A session that runs fragments of a program one after the other, in the same context.
+    """
+    def __init__(self, ctx: Context | None = None):
+        """
+        :param ctx: the context to run in, or ``None`` for a new one
+        """
+        self.lexer, tokens = initiate_lexer(None)
+        self.parser = initiate_parser(tokens)
+        self.parser.errorfunc = self._syntax_error
+        self.ctx = ctx if ctx is not None else initiate_context()
+
+    @staticmethod
+    def _syntax_error(token):
+        # The parser would otherwise skip the invalid part and run the rest
+        if token is None:
+            raise RuntimeError("Syntax error at the end of the input")
+        raise RuntimeError(f"Syntax error at line {token.lineno}: unexpected {token.type}")
+
+    def is_complete(self, source: str) -> bool:
+        """
+        Checks whether a fragment can run, or whether more lines are needed first. That is the
+        case when a block was started and not ended with an empty line yet.
+        :param source: the lines entered so far
+        :return: whether the fragment is complete
+        """
+        last = None
+        self.lexer.input(source + "\n")
+        while (token := self.lexer.token()) is not None:
+            # A block starts with a colon at the end of a line, and its lines are indented
+            if token.type == "IND" or token.type == "NL" and last == "COLON":
+                return source.endswith("\n")
+            last = token.type
+        return last != "COLON"
+
+    def is_empty(self, source: str) -> bool:
+        """
+        :param source: the lines entered so far
+        :return: whether the fragment only contains empty lines and comments
+        """
+        self.lexer.input(source + "\n")
+        return all(token.type == "NL" for token in iter(self.lexer.token, None))
+
+    def execute(self, source: str, echo=True):
+        """
+        Parses a fragment and runs it.
+        :param source: the fragment
+        :param echo: whether to print the value of each expression
+        """
+        program = self.parser.parse(source.rstrip("\n") + "\n", lexer=self.lexer)
+        if program is None:
+            return
+        try:
+            for statement in program.children:
+                if echo and isinstance(statement, StatementWrapper) and not isinstance(statement.expression, VariableChange):
+                    value = statement.expression.evaluate(self.ctx)
+                    if value is not None:
+                        pretty_print(self.ctx, [value])
+                else:
+                    # Only this statement runs, not the ones after it
+                    following = statement.next
+                    run_statements(statement, self.ctx, lambda x: x is not None and x is not following)
+        except BaseException:
+            # A statement that failed halfway may have left loops or functions behind
+            self.ctx.returned.clear()
+            self.ctx.iterators.clear()
+            raise
+        finally:
+            self.ctx.output.flush()
+
+    def read(self) -> str:
+        """
+        Reads lines until they form a complete fragment, raising ``EOFError`` at the end of the input.
+        :return: the fragment
+        """
+        source = input(PROMPT)
+        while not self.is_complete(source):
+            try:
+                line = input(CONTINUATION)
+            except EOFError:
+                line = ""
+            source += "\n" + line
+        return source
+
+    def loop(self):
+        """
+        Reads and runs fragments until the end of the input.
+        """
+        while True:
+            try:
+                source = self.read()
+            except EOFError:
+                sys.stdout.write("\n")
+                return
+            except KeyboardInterrupt:
+                sys.stdout.write("\nKeyboardInterrupt\n")
+                continue
+            if self.is_empty(source):
+                continue
+            try:
+                self.execute(source)
+            except KeyboardInterrupt:
+                sys.stderr.write("KeyboardInterrupt\n")
+            except Exception as e:
+                sys.stderr.write(f"Error: {e}\n")
+
+
+def main(arguments: list[str] | None = None) -> int:
+    argument_parser = argparse.ArgumentParser(prog="huckle repl", description="Runs huckle interactively.")
+    argument_parser.add_argument("scripts", nargs="*", help="the scripts to run before the session starts")
+    options = argument_parser.parse_args(arguments)
+
+    try:
+        # Only used to edit lines and recall earlier ones, which isn't available everywhere
+        import readline
+    except ImportError:
+        pass
+
+    repl = Repl()
+    for script in options.scripts:
+        with open(script, "r") as file:
+            source = file.read()
+        try:
+            repl.execute(source, echo=False)
+        except Exception as e:
+            sys.stderr.write(f"Error in {script}: {e}\n")
+            return 1
+    repl.loop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
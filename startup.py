@@ -0,0 +1,90 @@
+"""
+Measures how long it takes to start huckle and run a script that doesn't use matrices, using
+the import times Python reports with ``-X importtime``:
+
+    python startup.py
+    python startup.py --budget 150 --script script.hk
+
+The script fails when a module that should only be imported on demand, like Numpy, is imported
+anyway, or when importing takes longer than the budget. This keeps the startup from slowly
+getting worse as built-ins are added.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+FORBIDDEN = ["numpy", "asyncio", "multiprocessing", "concurrent.futures", "utils.disk", "utils.files",
+             "utils.linalg", "utils.scheduling", "utils.shared", "utils.sparse"]
+"""
+The modules that a script without matrices, files or asynchronous functions must not import.
+"""
+DEFAULT_SCRIPT = "x = 3\ny = x * 2 + sin(x)\nprint(y)\n"
+
+
+def measure(source: str) -> tuple[dict[str, int], list[str]]:
+    """
+    Runs a script in a new interpreter.
+    :param source: the source code of the script
+    :return: the cumulative import time of each top-level import in microseconds, and all imported modules
+    """
+    code = "import huckle, sys; huckle.compile(sys.stdin.read()).run(output=huckle.BufferSink())"
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], input=source, text=True,
+                             capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if process.returncode != 0:
+        raise RuntimeError(f"The script failed:\n{process.stderr}")
+    times = {}
+    modules = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append(name.strip())
+        # Nested imports are indented, and already part of the time of the module importing them
+        if not name[1:].startswith(" "):
+            times[name.strip()] = int(cumulative)
+    return times, modules
+
+
+def main(arguments: list[str] | None = None) -> int:
+    argument_parser = argparse.ArgumentParser(prog="huckle startup", description="Measures the startup time of huckle.")
+    argument_parser.add_argument("--script", default=None, help="the script to run, which must not use matrices")
+    argument_parser.add_argument("--runs", type=int, default=5, help="the amount of runs, of which the fastest is reported")
+    argument_parser.add_argument("--budget", type=float, default=None, help="the maximum amount of milliseconds importing can take")
+    argument_parser.add_argument("--top", type=int, default=10, help="the amount of slowest imports to show")
+    options = argument_parser.parse_args(arguments)
+
+    if options.script is not None:
+        with open(options.script, "r") as file:
+            source = file.read()
+    else:
+        source = DEFAULT_SCRIPT
+
+    # The first run may still have to build the parse tables
+    measure(source)
+    best, modules = None, []
+    for _ in range(options.runs):
+        times, modules = measure(source)
+        if best is None or sum(times.values()) < sum(best.values()):
+            best = times
+    total = sum(best.values()) / 1000
+
+    sys.stdout.write(f"{'import':<40}{'cumulative (ms)':>16}\n")
+    for name, time in sorted(best.items(), key=lambda item: -item[1])[:options.top]:
+        sys.stdout.write(f"{name:<40}{time / 1000:>16.3f}\n")
+    sys.stdout.write(f"{'total':<40}{total:>16.3f}\n")
+
+    succeeded = True
+    # A package imported while another module is being imported may only show up with its submodules
+    imported = [name for name in FORBIDDEN if any(module == name or module.startswith(name + ".") for module in modules)]
+    if imported:
+        sys.stderr.write(f"Imported modules that should only be imported when used: {', '.join(imported)}\n")
+        succeeded = False
+    if options.budget is not None and total > options.budget:
+        sys.stderr.write(f"Importing took {total:.3f} ms, which is more than the budget of {options.budget} ms\n")
+        succeeded = False
+    return 0 if succeeded else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
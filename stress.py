@@ -0,0 +1,145 @@
+"""
+Runs the same programs from many threads at once and checks every result, to find state that is
+shared between runs by accident:
+
+    python stress.py
+    python stress.py --threads 32 --runs 10000
+
+A compiled program runs on a pool of threads, programs are compiled from several threads at
+the same time, and a parsed tree and a flat program are each run by all threads at once. Threads
+switch as often as possible while this runs, so races show up quickly. The script fails if any
+run gives a wrong result.
+"""
+import argparse
+import random
+import sys
+import threading
+
+import huckle
+from elements.flat import FlatProgram
+from elements.statements import run_statements
+from lexer import initiate_lexer
+from parser import initiate_context, initiate_parser
+from utils.output import BufferSink
+
+SOURCE = """f = fn n:
+\ttotal = 0
+\tfor k in [1, 2, 3, 4, 5]:
+\t\ttotal += k * n
+\treturn total
+g = memo fn n: n * scale
+y = f(a) + g(a % 7)
+s = 0
+for j in [1, 2, 3]:
+\ts += f(j)
+print(y)
+"""
+"""
+The program that is run, with the inputs ``a`` and ``scale``. It uses loops, functions and a memoized
+function, whose results depend on an input.
+"""
+
+
+def expected(a: int, scale: int) -> dict:
+    """
+    :return: the variables the program should end with for the given inputs
+    """
+    return {"y": 15 * a + (a % 7) * scale, "s": 90}
+
+
+def _check(errors: list, engine: str, inputs: dict, variables: dict, output: str | None = None):
+    wanted = expected(inputs["a"], inputs["scale"])
+    if any(variables.get(name) != value for name, value in wanted.items()) \
+            or output is not None and output != f"{wanted['y']}\n":
+        errors.append(f"{engine}: {inputs} gave y = {variables.get('y')}, s = {variables.get('s')} instead of {wanted}")
+
+
+def stress_compiled(threads: int, runs: int, errors: list):
+    """
+    Runs a compiled program for many inputs on a pool of threads.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    program = huckle.compile(SOURCE)
+
+    def run(inputs: dict):
+        output = BufferSink()
+        variables = program.run(inputs, output)
+        output.flush()
+        _check(errors, "vm", inputs, variables, output.getvalue())
+
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(run, [{"a": i, "scale": i % 5} for i in range(runs)]))
+
+
+def stress_compiling(threads: int, errors: list):
+    """
+    Compiles programs from several threads at once, which share the parser.
+    """
+    programs = [None] * threads
+
+    def compile_program(i: int):
+        programs[i] = huckle.compile(f"z = {i} + 1\n" + SOURCE)
+
+    workers = [threading.Thread(target=compile_program, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    for i, program in enumerate(programs):
+        variables = program.run({"a": 1, "scale": 1}, BufferSink())
+        if variables["z"] != i + 1:
+            errors.append(f"compile: program {i} gave z = {variables['z']} instead of {i + 1}")
+
+
+def stress_shared(threads: int, runs: int, errors: list):
+    """
+    Runs the same tree and the same flat program from all threads at once.
+    """
+    lexer, tokens = initiate_lexer(None)
+    tree = initiate_parser(tokens).parse(SOURCE, lexer=lexer)
+    flat = FlatProgram.from_tree(tree)
+
+    def work(seed: int):
+        generator = random.Random(seed)
+        for _ in range(runs // threads):
+            inputs = {"a": generator.randint(0, 1000), "scale": generator.randint(0, 10)}
+            for engine, run in (("tree", lambda ctx: run_statements(tree, ctx)), ("flat", flat.run)):
+                ctx = initiate_context()
+                ctx.output = BufferSink()
+                ctx.variables().update(inputs)
+                run(ctx)
+                ctx.output.flush()
+                _check(errors, engine, inputs, ctx.variables(), ctx.output.getvalue())
+
+    workers = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def main(arguments: list[str] | None = None) -> int:
+    argument_parser = argparse.ArgumentParser(prog="huckle stress", description="Runs programs from many threads at once.")
+    argument_parser.add_argument("--threads", type=int, default=16, help="the amount of threads")
+    argument_parser.add_argument("--runs", type=int, default=4000, help="the amount of runs of each engine")
+    options = argument_parser.parse_args(arguments)
+
+    errors = []
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        stress_compiled(options.threads, options.runs, errors)
+        stress_compiling(options.threads, errors)
+        stress_shared(options.threads, options.runs, errors)
+    finally:
+        sys.setswitchinterval(interval)
+
+    for error in errors[:20]:
+        sys.stderr.write(f"{error}\n")
+    sys.stdout.write(f"{len(errors)} wrong results\n")
+    return 0 if not errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,51 +1,298 @@
 import cmath
 import math
+import numbers
+from copy import copy
 
+from utils.cache import LRUCache
+from utils.lazy import is_imported, lazy_import
 from utils.primitives import *
 
+# Only matrices stored on disk or sparse matrices need these, which can't exist before they are imported
+_disk = lazy_import("utils.disk")
+_sparse = lazy_import("utils.sparse")
+
+
+def _is_disk(value) -> bool:
+    return is_imported(_disk) and isinstance(value, _disk.DiskMatrix)
+
+
+def _is_sparse(value) -> bool:
+    return is_imported(_sparse) and isinstance(value, _sparse.SparseMatrix)
+
 
 # General functions
+EDGE_ITEMS = 3
+"""
+The amount of rows and columns at the start and the end of a matrix that are shown when it
+is too large to print completely.
+"""
+
+
 def pretty_print(ctx: Context, args, end="\n"):
     """
     If the ``pretty_print`` variable is set to true, this will attempt to output arguments
     nicely. For example, it makes matrices more readable. Otherwise, it has normal Python
-    behavior.
+    behavior. Matrices with more elements than the ``print_threshold`` variable are summarized.
+    The output is written to the output sink of the context.
     :param ctx: the context
     :param args: the arguments
     :param end: the string to append to the end of the printed arguments
     """
     if len(args) > 1 or len(args) == 0 or not ctx.variables()["pretty_print"]:
-        print(*args, end=end)
+        text = " ".join(map(str, args))
+    elif _is_sparse(args[0]):
+        # Only the nonzero elements are shown, since the full matrix can be huge
+        text = str(args[0]) + "".join(["\n  " + line for line in _sparse_lines(args[0], _print_threshold(ctx))])
     elif isinstance(args[0], Matrix):
-        elements = sum(args[0].rows(), [])
-        column_size = args[0].shape()[1]
-        largest_strings = [max([len(str(element)) for element in column]) for column in args[0].columns()]
-
-        print("[ ", end="")
-        current = 1
-        for element in elements:
-            if current > column_size:
-                current -= column_size
-                print()
-                print("  ", end="")
-            print(str(element) + (1 + largest_strings[current - 1] - len(str(element))) * " ", end="")
-            current += 1
-        print("]")
+        text = format_matrix(args[0].array, _print_threshold(ctx))
     else:
-        print(*args, end=end)
+        text = str(args[0])
+    ctx.output.write(text + end)
 
 
-# Number functions
-def minimum(value: Matrix):
+def flush(ctx: Context, args):
+    """
+    Writes all output printed so far, since the output is only written in large blocks.
+    :param ctx: the context
+    :param args: no arguments
+    """
+    # TODO Add preconditions
+    ctx.output.flush()
+
+
+def format_matrix(array: 'np.ndarray', threshold=None) -> str:
+    """
+    Formats a matrix with its elements aligned in columns. If the matrix has more elements
+    than the threshold, only the first and last rows and columns are included, and the
+    others are replaced by an ellipsis.
+    :param array: the array of the matrix
+    :param threshold: the maximum amount of elements to show completely, or ``None`` for no maximum
+    :return: the formatted matrix
+    """
+    summarize = threshold is not None and array.size > threshold
+    split_rows = summarize and array.shape[0] > 2 * EDGE_ITEMS
+    split_columns = summarize and array.shape[1] > 2 * EDGE_ITEMS
+    # Only the elements that are shown are converted, which matters for large matrices on disk
+    if split_rows:
+        array = np.concatenate((array[:EDGE_ITEMS], array[-EDGE_ITEMS:]))
+    if split_columns:
+        array = np.concatenate((array[:, :EDGE_ITEMS], array[:, -EDGE_ITEMS:]), axis=1)
+
+    strings = [list(map(str, row)) for row in array.tolist()]
+    if split_columns:
+        for row in strings:
+            row.insert(EDGE_ITEMS, "...")
+    if len(strings) == 0:
+        return "[ ]"
+    widths = np.array([list(map(len, row)) for row in strings]).max(axis=0).tolist() if len(strings[0]) > 0 else []
+
+    lines = ["".join([string.ljust(width + 1) for string, width in zip(row, widths)]) for row in strings]
+    if split_rows:
+        lines.insert(EDGE_ITEMS, "...")
+    return "[ " + "\n  ".join(lines) + "]"
+
+
+def _sparse_lines(matrix: '_sparse.SparseMatrix', threshold=None) -> list[str]:
+    if threshold is None or matrix.nonzeros() <= threshold:
+        return matrix.elements()
+    return [*matrix.elements(slice(None, EDGE_ITEMS)), "...", *matrix.elements(slice(-EDGE_ITEMS, None))]
+
+
+def _print_threshold(ctx: Context):
+    return ctx.variables().get("print_threshold")
+
+
+# Random functions
+def rand(ctx: Context, args):
+    """
+    Generates uniformly distributed random numbers between 0 and 1. Without arguments, this
+    returns a single number. With a size ``n``, this returns an n×n matrix, and with two
+    sizes ``m`` and ``n`` an m×n matrix.
+    :param ctx: the context
+    :param args: the sizes
+    :return: the random number or matrix
+    """
+    return _random(ctx.random_generator().random, _random_shape(args))
+
+
+def randn(ctx: Context, args):
+    """
+    Generates normally distributed random numbers with mean 0 and standard deviation 1. The
+    sizes work like those of ``rand``.
+    :param ctx: the context
+    :param args: the sizes
+    :return: the random number or matrix
+    """
+    return _random(ctx.random_generator().standard_normal, _random_shape(args))
+
+
+def randi(ctx: Context, args):
+    """
+    Generates random integers between a lowest and highest value, both inclusive. The sizes
+    after those values work like those of ``rand``.
+    :param ctx: the context
+    :param args: the lowest value, the highest value and the sizes
+    :return: the random integer or matrix
+    """
+    if len(args) < 2:
+        raise RuntimeError(f"Expected the lowest and highest value, but found {len(args)} arguments")
+    low, high = args[0], args[1]
+    if not _is_integer(low) or not _is_integer(high):
+        raise RuntimeError(f"The lowest and highest value must be whole numbers, but found {low} and {high}")
+    if low > high:
+        raise RuntimeError(f"The lowest value {low} is higher than the highest value {high}")
+    low, high = int(low), int(high)
+    return _random(lambda shape=None: ctx.random_generator().integers(low, high, shape, endpoint=True),
+                   _random_shape(args[2:]))
+
+
+def shuffle(ctx: Context, args):
+    """
+    Shuffles the elements of a row or column vector, or the rows of any other matrix.
+    :param ctx: the context
+    :param args: the matrix
+    :return: the shuffled copy of the matrix
+    """
+    # TODO Add preconditions
+    matrix = args[0]
+    return Matrix.wrap(ctx.random_generator().permutation(matrix.array, axis=1 if matrix.shape()[0] == 1 else 0))
+
+
+def seed(ctx: Context, args):
+    """
+    Seeds the random number generator, so the random functions give the same results each run.
+    A second argument selects an independent stream of random numbers for the same seed, so
+    parallel workers can each use their own stream.
+    :param ctx: the context
+    :param args: the seed, and optionally the stream
+    """
+    # TODO Add preconditions
+    ctx.seed(*args)
+
+
+def _random_shape(sizes) -> tuple[int, int] | None:
+    if len(sizes) > 2:
+        raise RuntimeError(f"Too many sizes: expected 2 or lower sizes, but found {len(sizes)}")
+    for size in sizes:
+        if not _is_integer(size) or size < 0:
+            raise RuntimeError(f"The sizes must be whole numbers of at least 0, but found {size}")
+    sizes = [int(size) for size in sizes]
+    if len(sizes) == 0:
+        return None
+    if len(sizes) == 1:
+        return sizes[0], sizes[0]
+    return sizes[0], sizes[1]
+
+
+def _is_integer(value) -> bool:
+    # Booleans are numbers as well, but not a size or a bound
+    return isinstance(value, numbers.Real) and not isinstance(value, bool) \
+        and (isinstance(value, numbers.Integral) or float(value).is_integer())
+
+
+def _random(generate, shape):
+    # Without a shape, a single value is generated
+    return np.asarray(generate()).item() if shape is None else Matrix.wrap(generate(shape))
+
+
+# Function utilities
+def memoize(function: Function, size=128):
+    """
+    Creates a copy of the function that caches its results, using a least recently used cache.
+    This only makes sense for functions that always return the same value for the same arguments.
+    :param function: the function
+    :param size: the maximum amount of cached results
+    :return: the memoized function
+    """
+    # TODO Add preconditions
+    if isinstance(function, LazyFunction):
+        function = function.resolve()
+    if isinstance(function, Partial):
+        # The curried arguments are passed to the original function, which needs to do the caching
+        return Partial(memoize(function.function, size), function.curried)
+    memoized = copy(function)
+    memoized.memo = LRUCache(size)
+    return memoized
+
+
+def memo_info(ctx: Context, args):
+    """
+    Returns the statistics of the cache of a memoized function in this run, as a row vector
+    containing the hits, the misses, the amount of cached results and the maximum size.
+    :param ctx: the context
+    :param args: the memoized function
+    :return: the statistics
+    """
+    if len(args) != 1 or not isinstance(args[0], Function):
+        raise RuntimeError("memo_info needs exactly one function")
+    function = args[0]
+    if isinstance(function, LazyFunction):
+        function = function.resolve()
+    if isinstance(function, Partial):
+        function = function.function
+    if function.memo is None:
+        raise RuntimeError("This function is not memoized")
+    cache = function.cache(ctx)
+    return Matrix([cache.hits, cache.misses, len(cache), cache.size])
+
+
+# Collection functions
+def keys(dictionary: Dictionary):
     # TODO Add preconditions
-    # TODO Add row/column-specific extremes
-    return min(value.vector())
+    return dictionary.keys()
 
 
-def maximum(value: Matrix):
+def values(dictionary: Dictionary):
     # TODO Add preconditions
-    # TODO Add row/column-specific extremes
-    return max(value.vector())
+    return dictionary.values()
+
+
+def to_set(collection):
+    """
+    Creates a set with the elements of a matrix, the keys of a dictionary or the elements of
+    any other collection.
+    :param collection: the collection
+    :return: the set
+    """
+    # TODO Add preconditions
+    result = Set()
+    for element in collection:
+        result.add(element)
+    return result
+
+
+def intersect(left: Set, right: Set):
+    # TODO Add preconditions
+    return Set(left.elements & right.elements)
+
+
+# Number functions
+def minimum(value: Matrix, axis=None):
+    """
+    Returns the smallest element of a matrix, or the smallest element of each column (``axis``
+    is 0) or row (``axis`` is 1).
+    :param value: the matrix
+    :param axis: the dimension to reduce, or ``None`` for all elements
+    :return: the smallest element, or a row or column vector of them
+    """
+    value, axis = _reduction_arguments(value, axis)
+    if axis is None and (_is_disk(value) or _is_sparse(value)):
+        return value.minimum()
+    return _reduce(np.min, value, axis)
+
+
+def maximum(value: Matrix, axis=None):
+    """
+    Returns the largest element of a matrix, or the largest element of each column (``axis``
+    is 0) or row (``axis`` is 1).
+    :param value: the matrix
+    :param axis: the dimension to reduce, or ``None`` for all elements
+    :return: the largest element, or a row or column vector of them
+    """
+    value, axis = _reduction_arguments(value, axis)
+    if axis is None and (_is_disk(value) or _is_sparse(value)):
+        return value.maximum()
+    return _reduce(np.max, value, axis)
 
 
 def sqrt(number):
@@ -55,9 +302,115 @@ def sqrt(number):
     return Complex(0, cmath.sqrt(number).imag) if number < 0 else math.sqrt(number)
 
 
+# Reduction functions
+def summation(matrix: Matrix, axis=None):
+    """
+    Adds up all elements of a matrix, or the elements of each column (``axis`` is 0) or
+    row (``axis`` is 1).
+    :param matrix: the matrix
+    :param axis: the dimension to reduce, or ``None`` for all elements
+    :return: the sum, or a row or column vector of sums
+    """
+    matrix, axis = _reduction_arguments(matrix, axis)
+    if _is_sparse(matrix):
+        result = matrix.sum(axis)
+        return result if axis is None else Matrix.wrap(result)
+    return _reduce(np.sum, matrix, axis)
+
+
+def mean(matrix: Matrix, axis=None):
+    matrix, axis = _reduction_arguments(matrix, axis)
+    if _is_sparse(matrix):
+        count = len(matrix) if axis is None else matrix.shape()[axis]
+        return summation(matrix, axis) / count
+    return _reduce(np.mean, matrix, axis)
+
+
+def product(matrix: Matrix, axis=None):
+    return _reduce(np.prod, *_reduction_arguments(matrix, axis))
+
+
+def standard_deviation(matrix: Matrix, axis=None):
+    """
+    Calculates the sample standard deviation of the elements of a matrix, which divides by
+    the amount of elements minus one, like MATLAB.
+    :param matrix: the matrix
+    :param axis: the dimension to reduce, or ``None`` for all elements
+    :return: the standard deviation, or a row or column vector of them
+    """
+    return _reduce(lambda array, **kwargs: np.std(array, ddof=1, **kwargs), *_reduction_arguments(matrix, axis))
+
+
+def any_true(matrix: Matrix, axis=None):
+    return _reduce(np.any, *_reduction_arguments(matrix, axis))
+
+
+def all_true(matrix: Matrix, axis=None):
+    return _reduce(np.all, *_reduction_arguments(matrix, axis))
+
+
+def cumulative_sum(matrix: Matrix, axis=None):
+    """
+    Calculates the running totals of a matrix along its columns (``axis`` is 0) or rows
+    (``axis`` is 1). By default, row vectors are added up along their row and all other
+    matrices along their columns.
+    :param matrix: the matrix
+    :param axis: the dimension to add up along
+    :return: the matrix of running totals
+    """
+    matrix, axis = _reduction_arguments(matrix, axis)
+    if axis is None:
+        axis = 1 if matrix.shape()[0] == 1 else 0
+    return Matrix.wrap(np.asarray(np.cumsum(matrix.array, axis=axis)))
+
+
+def _reduce(reduction, matrix: Matrix, axis=None):
+    """
+    Applies a Numpy reduction directly on the array of a matrix.
+    :param reduction: the reduction, which must accept the ``axis`` and ``keepdims`` arguments
+    :param matrix: the matrix
+    :param axis: the dimension to reduce, or ``None`` for all elements
+    :return: a single value, or a row (``axis`` is 0) or column (``axis`` is 1) vector
+    """
+    if axis is None:
+        return _scalar(reduction(matrix.array))
+    # Reductions of memory-mapped arrays are memory-mapped arrays without a file
+    return Matrix.wrap(np.asarray(reduction(matrix.array, axis=axis, keepdims=True)))
+
+
+def _scalar(value):
+    """
+    Converts the result of a Numpy calculation to a Python value. Matrices of objects, like
+    complex numbers, result in the object itself instead of a Numpy scalar.
+    :param value: the result
+    :return: the Python value, with complex numbers as ``Complex``
+    """
+    value = value.item() if isinstance(value, np.generic) else value
+    return Complex(value) if type(value) is complex else value
+
+
+def _reduction_arguments(value, axis) -> tuple[Matrix, int | None]:
+    """
+    Checks the arguments of a reduction. A single number is treated as a matrix with one element.
+    :param value: the matrix
+    :param axis: the dimension to reduce, or ``None`` for all elements
+    :return: the matrix, and the axis as an integer or ``None``
+    """
+    if isinstance(value, numbers.Number):
+        value = Matrix(value)
+    elif not isinstance(value, Matrix):
+        raise RuntimeError(f"Only matrices and numbers can be reduced, but found {type(value).__name__}")
+    # Booleans are numbers as well, but not a dimension
+    if axis is not None and (isinstance(axis, bool) or not isinstance(axis, numbers.Real) or axis not in (0, 1)):
+        raise RuntimeError(f"The axis must be 0 for columns or 1 for rows, but found {axis}")
+    return value, None if axis is None else int(axis)
+
+
 # Matrix functions
 def transpose(matrix: Matrix):
     # TODO Add preconditions
+    if _is_disk(matrix) or _is_sparse(matrix):
+        return matrix.transpose()
     return Matrix(matrix.array.transpose())
 
 
@@ -69,13 +422,17 @@ def determinant(matrix: Matrix):
 
 def inverse(matrix: Matrix):
     # TODO Add preconditions
+    if _is_sparse(matrix):
+        # The inverse of a sparse matrix is dense in general
+        raise RuntimeError("Cannot invert sparse matrices, solve the system with \\ instead")
     return matrix ** -1
 
 
 def trace(matrix: Matrix):
     # TODO Add preconditions
-    # Trace function gives an array back
-    return matrix.array.trace()[0, 0]
+    if _is_sparse(matrix):
+        return matrix.diagonal().sum().item()
+    return _scalar(np.trace(matrix.array))
 
 
 def diagonal(vector: Matrix):
@@ -104,19 +461,53 @@ def ones(size):
     return Matrix(np.ones((size, size), int))
 
 
+def find(matrix: Matrix):
+    """
+    Finds the positions of the nonzero (or true) elements of a matrix. For a row or column
+    vector, these are the indices of the elements, in a vector of the same orientation. For
+    other matrices, these are the row and column of each element, in a matrix with a row
+    for each element.
+    :param matrix: the matrix
+    :return: the positions
+    """
+    # TODO Add preconditions
+    if matrix.array.shape[0] == 1:
+        return Matrix.wrap(np.flatnonzero(matrix.array))
+    if matrix.array.shape[1] == 1:
+        return Matrix.wrap(np.flatnonzero(matrix.array).reshape(-1, 1))
+    return Matrix.wrap(np.argwhere(matrix.array))
+
+
+def where(condition: Matrix, left, right):
+    """
+    Chooses element by element between two matrices or values, depending on a condition.
+    :param condition: the matrix of conditions
+    :param left: the matrix or value to use where the condition is true
+    :param right: the matrix or value to use where the condition is false
+    :return: the matrix of chosen elements
+    """
+    # TODO Add preconditions
+    return Matrix.wrap(np.where(condition.array,
+                                left.array if isinstance(left, Matrix) else left,
+                                right.array if isinstance(right, Matrix) else right))
+
+
 def dot(left: Matrix, right: Matrix):
     # TODO Add preconditions
-    return np.dot(left.vector(), right.vector())
+    return _scalar(np.dot(left.array.ravel(), right.array.ravel()))
 
 
 def cross(left: Matrix, right: Matrix):
     # TODO Add preconditions
-    return np.cross(left.vector(), right.vector())
+    # The result has the same orientation as the left vector
+    return Matrix.wrap(np.cross(left.array.ravel(), right.array.ravel()).reshape(left.array.shape))
 
 
 def norm(matrix: Matrix):
     # TODO Add preconditions
-    return np.linalg.norm(matrix.vector())
+    if _is_disk(matrix) or _is_sparse(matrix):
+        return matrix.norm()
+    return np.linalg.norm(matrix.array).item()
 
 
 def rank(matrix: Matrix):
@@ -132,14 +523,30 @@ def reshape(matrix: Matrix, shape: Matrix):
 # Complex number functions
 def real(number: Complex):
     # TODO Add preconditions
+    if isinstance(number, Matrix):
+        return Matrix.wrap(np.real(_complex_array(number)))
     return number.real
 
 
 def imag(number: Complex):
     # TODO Add preconditions
+    if isinstance(number, Matrix):
+        return Matrix.wrap(np.imag(_complex_array(number)))
     return number.imag
 
 
+def _complex_array(matrix: Matrix) -> 'np.ndarray':
+    # Matrices of complex numbers keep them as objects, which Numpy can't take apart
+    return matrix.array.astype(complex) if matrix.array.dtype == object else matrix.array
+
+
+def conjugate(number: Complex):
+    # TODO Add preconditions
+    if isinstance(number, Matrix):
+        return Matrix.wrap(np.conjugate(number.array))
+    return Complex(number).conjugate()
+
+
 def polar(length, angle):
     # TODO Add preconditions
     result = cmath.rect(length, angle)
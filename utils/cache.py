@@ -0,0 +1,84 @@
+import threading
+from collections import OrderedDict
+
+MISSING = object()
+"""
+Returned by ``LRUCache.get`` when no default is given and the key is not present.
+This makes it possible to cache ``None`` values.
+"""
+
+
+class LRUCache:
+    """
+    A mapping with a limited size. When it is full, the least recently used entry is
+    discarded. It also keeps track of the amount of hits and misses, which is useful
+    to find out whether caching a function is worth it. The cache can be used by several
+    threads at once.
+    """
+    def __init__(self, size=128):
+        """
+        :param size: the maximum amount of entries, or ``None`` for an unbounded cache
+        """
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        """
+        Fetches the value stored for the given key and marks it as the most recently used.
+        :param key: the key
+        :param default: the value to return if the key is not present
+        :return: the value, or ``default`` if the key is not present
+        """
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Stores a value for the given key, discarding the least recently used entry if the
+        cache is full.
+        :param key: the key
+        :param value: the value
+        """
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if self.size is not None and len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Locks can't be pickled, so a copy gets its own lock
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return f"cache(hits={self.hits}, misses={self.misses}, size={len(self)}/{self.size})"
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,201 @@
+import math
+import numbers
+import os
+import tempfile
+import weakref
+
+import numpy as np
+
+from utils.primitives import Matrix
+
+MEMORY_BUDGET = 64 * 1024 * 1024
+"""
+The default amount of bytes a disk matrix may load into memory at once while calculating.
+"""
+
+DIRECTORY = None
+"""
+The directory where the files of calculated disk matrices are stored, or ``None`` for the
+default temporary directory.
+"""
+
+
+class DiskMatrix(Matrix):
+    """
+    A matrix whose elements are stored in a memory-mapped file instead of memory, so it can
+    be larger than the available memory. Operators process the matrix in blocks of rows that
+    fit in the memory budget, and store their result in a new disk matrix. The files of those
+    results are removed when the matrix is not used anymore.
+    """
+    def __init__(self, array: np.memmap, budget=MEMORY_BUDGET):
+        """
+        :param array: the memory-mapped array, which must be 2-dimensional
+        :param budget: the maximum amount of bytes to load into memory at once
+        """
+        self.array = array
+        self.budget = budget
+
+    @classmethod
+    def create(cls, shape, dtype, budget=MEMORY_BUDGET) -> 'DiskMatrix':
+        """
+        Creates a disk matrix with a new temporary file, filled with zeros.
+        :param shape: the amount of rows and columns
+        :param dtype: the data type of the elements
+        :param budget: the maximum amount of bytes to load into memory at once
+        :return: the disk matrix
+        """
+        descriptor, path = tempfile.mkstemp(suffix=".huckle", dir=DIRECTORY)
+        os.close(descriptor)
+        matrix = cls(np.memmap(path, dtype=dtype, mode="w+", shape=tuple(shape)), budget)
+        weakref.finalize(matrix, _remove, path)
+        return matrix
+
+    @classmethod
+    def from_matrix(cls, matrix: Matrix, budget=MEMORY_BUDGET) -> 'DiskMatrix':
+        """
+        Creates a disk matrix with the contents of a matrix. If the matrix is already
+        memory-mapped, its file is used directly.
+        :param matrix: the matrix
+        :param budget: the maximum amount of bytes to load into memory at once
+        :return: the disk matrix
+        """
+        if isinstance(matrix.array, np.memmap):
+            return cls(matrix.array, budget)
+        result = cls.create(matrix.shape(), matrix.array.dtype, budget)
+        for rows in result._row_blocks():
+            result.array[rows] = matrix.array[rows]
+        return result
+
+    def _row_blocks(self, columns=None, itemsize=None, operands=1):
+        """
+        Splits the rows of this matrix in blocks that fit in the memory budget.
+        :param columns: the amount of columns of each row, by default those of this matrix
+        :param itemsize: the size of each element, by default that of this matrix
+        :param operands: the amount of blocks of this size that are in memory at the same time
+        :return: the slices of the blocks of rows
+        """
+        columns = self.array.shape[1] if columns is None else columns
+        itemsize = self.array.itemsize if itemsize is None else itemsize
+        step = max(1, int(self.budget // max(1, columns * itemsize * operands)))
+        return [slice(start, min(start + step, self.array.shape[0]))
+                for start in range(0, self.array.shape[0], step)]
+
+    def _elementwise(self, other, operation, reflected=False) -> 'DiskMatrix':
+        if not isinstance(other, numbers.Number) and self.array.shape != other.array.shape:
+            raise RuntimeError("Cannot apply an element-wise operation on matrices with different dimensions")
+        # Applying the operation on no rows at all gives us the data type of the result, for example
+        # dividing integers results in floats
+        sample = other if isinstance(other, numbers.Number) else other.array[:0]
+        dtype = (operation(sample, self.array[:0]) if reflected else operation(self.array[:0], sample)).dtype
+
+        result = DiskMatrix.create(self.array.shape, dtype, self.budget)
+        for rows in self._row_blocks(itemsize=dtype.itemsize, operands=3):
+            right = other if isinstance(other, numbers.Number) else other.array[rows]
+            if reflected:
+                result.array[rows] = operation(right, self.array[rows])
+            else:
+                result.array[rows] = operation(self.array[rows], right)
+        return result
+
+    def _matmul(self, left, right) -> 'DiskMatrix':
+        """
+        Multiplies two arrays, of which at least one is memory-mapped, by multiplying blocks of
+        rows of the left array with blocks of rows of the right array.
+        """
+        if left.shape[1] != right.shape[0]:
+            raise RuntimeError("Cannot multiply matrices with incompatible dimensions")
+        dtype = np.result_type(left, right)
+        result = DiskMatrix.create((left.shape[0], right.shape[1]), dtype, self.budget)
+
+        # A third of the budget for the block of the right array, the rest for the left array and the result
+        inner_step = max(1, self.budget // (3 * max(1, right.shape[1]) * dtype.itemsize))
+        inner = [slice(start, min(start + inner_step, right.shape[0])) for start in range(0, right.shape[0], inner_step)]
+        for rows in result._row_blocks(columns=inner_step + right.shape[1], itemsize=dtype.itemsize, operands=1.5):
+            block = np.zeros((rows.stop - rows.start, right.shape[1]), dtype)
+            for columns in inner:
+                block += left[rows, columns] @ right[columns]
+            result.array[rows] = block
+        return result
+
+    def transpose(self) -> 'DiskMatrix':
+        result = DiskMatrix.create(self.array.shape[::-1], self.array.dtype, self.budget)
+        for rows in self._row_blocks(operands=2):
+            result.array[:, rows] = self.array[rows].transpose()
+        return result
+
+    def norm(self):
+        # The sum of the squares is calculated incrementally, block by block
+        total = 0
+        for rows in self._row_blocks(operands=2):
+            total += np.sum(np.abs(self.array[rows]) ** 2)
+        return math.sqrt(total)
+
+    def maximum(self):
+        return max(np.max(self.array[rows]) for rows in self._row_blocks()).item()
+
+    def minimum(self):
+        return min(np.min(self.array[rows]) for rows in self._row_blocks()).item()
+
+    def __add__(self, other):
+        return self._elementwise(other, np.add)
+
+    def __radd__(self, other):
+        return self._elementwise(other, np.add, reflected=True)
+
+    def __sub__(self, other):
+        return self._elementwise(other, np.subtract)
+
+    def __rsub__(self, other):
+        return self._elementwise(other, np.subtract, reflected=True)
+
+    def __mul__(self, other):
+        # Scalar multiplication
+        if isinstance(other, numbers.Number):
+            return self._elementwise(other, np.multiply)
+
+        # Matrix multiplication
+        return self._matmul(self.array, other.array)
+
+    def __rmul__(self, other):
+        # Scalar multiplication
+        if isinstance(other, numbers.Number):
+            return self._elementwise(other, np.multiply, reflected=True)
+
+        # Matrix multiplication
+        return self._matmul(other.array, self.array)
+
+    def __elmul__(self, other):
+        return self._elementwise(other, np.multiply)
+
+    def __truediv__(self, other):
+        # Scalar division only
+        return self._elementwise(other, np.true_divide)
+
+    def __copy__(self):
+        # A copy needs its own file, otherwise changing the copy would change the original
+        result = DiskMatrix.create(self.array.shape, self.array.dtype, self.budget)
+        for rows in self._row_blocks():
+            result.array[rows] = self.array[rows]
+        return result
+
+    def __str__(self):
+        return f"disk matrix ({self.array.shape[0]}x{self.array.shape[1]}, {self.array.dtype}, {self.array.filename})"
+
+
+def disk(matrix: Matrix, budget=MEMORY_BUDGET):
+    """
+    Moves a matrix to disk, so operations on it are calculated in blocks that fit in memory.
+    Matrices that are memory-mapped, like large files opened with ``load``, are used directly.
+    :param matrix: the matrix
+    :param budget: the maximum amount of bytes to load into memory at once
+    :return: the disk matrix
+    """
+    # TODO Add preconditions
+    return DiskMatrix.from_matrix(matrix, budget)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,118 @@
+import os
+from itertools import islice
+
+import numpy as np
+
+from utils.primitives import Matrix
+
+MMAP_THRESHOLD = 64 * 1024 * 1024
+"""
+Files larger than this amount of bytes are memory-mapped instead of read into memory.
+"""
+
+
+def load(path: str, key=None):
+    """
+    Loads a matrix from a ``.npy`` or ``.npz`` file. Large ``.npy`` files are memory-mapped,
+    so only the parts that are used are read from disk. Changing the matrix does not change
+    the file.
+    :param path: the path of the file
+    :param key: the name of the array in a ``.npz`` file, by default the first one
+    :return: the matrix
+    """
+    # TODO Add preconditions
+    if path.endswith(".npz"):
+        # Compressed archives cannot be memory-mapped
+        with np.load(path) as archive:
+            return Matrix.wrap(archive[key if key is not None else archive.files[0]])
+    return Matrix.wrap(np.load(path, mmap_mode=_mmap_mode(path)))
+
+
+def load_raw(path: str, dtype: str, shape: Matrix = None):
+    """
+    Loads a matrix from a file containing the raw elements, without a header. Large files are
+    memory-mapped.
+    :param path: the path of the file
+    :param dtype: the Numpy data type of the elements, like ``"float64"`` or ``"int32"``
+    :param shape: the amount of rows and columns, by default all elements are put in one row
+    :return: the matrix
+    """
+    # TODO Add preconditions
+    shape = tuple(int(size) for size in shape.vector()) if shape is not None else None
+    if _mmap_mode(path) is not None:
+        return Matrix.wrap(np.memmap(path, dtype=np.dtype(dtype), mode="c", shape=shape))
+    array = np.fromfile(path, dtype=np.dtype(dtype))
+    return Matrix.wrap(array.reshape(shape) if shape is not None else array)
+
+
+def save(matrix: Matrix, path: str):
+    """
+    Saves a matrix to a file. The format depends on the extension of the path: ``.npy`` and
+    ``.npz`` files can be loaded with ``load``, any other file contains the raw elements and
+    can be loaded with ``load_raw``.
+    :param matrix: the matrix
+    :param path: the path of the file
+    """
+    # TODO Add preconditions
+    if path.endswith(".npy"):
+        np.save(path, matrix.array)
+    elif path.endswith(".npz"):
+        np.savez(path, matrix.array)
+    else:
+        np.ascontiguousarray(matrix.array).tofile(path)
+
+
+def _mmap_mode(path: str):
+    # Copy-on-write, so the matrix can be changed without changing the file
+    return "c" if os.path.getsize(path) > MMAP_THRESHOLD else None
+
+
+class CsvReader:
+    """
+    Reads a CSV file lazily, in chunks of rows. Only one chunk is kept in memory at a time,
+    so files larger than the memory can be processed. Each time the reader is iterated over,
+    the file is read from the start.
+    """
+    def __init__(self, path: str, chunk=1000, delimiter=",", skip=0):
+        """
+        :param path: the path of the file
+        :param chunk: the maximum amount of rows in each chunk
+        :param delimiter: the string separating the values of a row
+        :param skip: the amount of lines to skip at the start of the file, like a header
+        """
+        self.path = path
+        self.chunk = chunk
+        self.delimiter = delimiter
+        self.skip = skip
+
+    def __iter__(self):
+        with open(self.path, "r") as file:
+            for _ in islice(file, self.skip):
+                pass
+            while True:
+                lines = list(islice(file, self.chunk))
+                if not lines:
+                    return
+                lines = [line for line in lines if line.strip()]
+                if lines:
+                    yield Matrix.wrap(np.loadtxt(lines, delimiter=self.delimiter, ndmin=2))
+
+    def __str__(self):
+        return f"read_csv({self.path}, {self.chunk})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def read_csv(path: str, chunk=1000, delimiter=",", skip=0):
+    """
+    Creates a reader that lazily reads a CSV file as matrices of at most ``chunk`` rows.
+    The values are parsed in bulk by Numpy.
+    :param path: the path of the file
+    :param chunk: the maximum amount of rows in each chunk
+    :param delimiter: the string separating the values of a row
+    :param skip: the amount of lines to skip at the start of the file, like a header
+    :return: the reader, which can be used in a for-loop
+    """
+    # TODO Add preconditions
+    return CsvReader(path, chunk, delimiter, skip)
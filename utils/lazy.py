@@ -0,0 +1,44 @@
+import importlib
+import sys
+import threading
+import types
+
+_modules: dict[str, 'LazyModule'] = {}
+_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module that is only imported once one of its attributes is used. Programs
+    that never use matrices then don't have to wait for Numpy to be imported, which takes longer
+    than the rest of the interpreter together.
+
+    Attributes can't be used at import time, which includes annotations: those have to be written
+    as strings, like ``'np.ndarray'``.
+    """
+    def __getattr__(self, name: str):
+        # This is only called for attributes that weren't copied from the module yet
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+
+def lazy_import(name: str) -> LazyModule:
+    """
+    :param name: the name of the module
+    :return: a module that imports the actual module once one of its attributes is used
+    """
+    with _lock:
+        if name not in _modules:
+            _modules[name] = LazyModule(name)
+        return _modules[name]
+
+
+def is_imported(module: LazyModule) -> bool:
+    """
+    Tells whether a lazily imported module has been imported, without importing it. Instances of
+    its classes can't exist before that, so checking the type of a value doesn't have to import it.
+    :param module: the lazily imported module
+    :return: whether the module has been imported
+    """
+    return module.__name__ in sys.modules
@@ -0,0 +1,328 @@
+import numbers
+
+import numpy as np
+
+from utils.primitives import Matrix
+from utils.sparse import ConvergenceError, SparseMatrix, bicgstab, cg
+
+DIRECT_LIMIT = 1_000_000
+"""
+The maximum amount of elements of a sparse matrix whose systems may be solved with a dense
+factorization, when the iterative methods cannot solve them.
+"""
+
+BLOCK_SIZE = 64
+"""
+The amount of rows and columns that are processed at once by the factorizations and the
+triangular solves, so most of the work is done by matrix products.
+"""
+
+
+class Factorization:
+    """
+    A factorization of a matrix, which can solve systems with that matrix for any right-hand
+    side without factorizing it again. Solving is done with the left division operator, like
+    ``F \\ b``, or with ``solve(F, b)``. The factors can be accessed like the elements of a
+    list, in the order MATLAB returns them.
+    """
+    name = "factorization"
+
+    def __init__(self, shape, factors: list[Matrix]):
+        self.dimensions = shape
+        self.factors = factors
+
+    def solve(self, right: np.ndarray) -> np.ndarray:
+        raise RuntimeError(f"Cannot solve a system with an {self.name}")
+
+    def __ldiv__(self, other):
+        right = _right_hand_side(other, self.dimensions[0])
+        return Matrix.wrap(self.solve(right))
+
+    def __getitem__(self, item):
+        # TODO Add preconditions
+        return self.factors[item[0]]
+
+    def __len__(self):
+        return len(self.factors)
+
+    def __iter__(self):
+        return iter(self.factors)
+
+    def __str__(self):
+        return f"{self.name} ({self.dimensions[0]}x{self.dimensions[1]})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class LUFactorization(Factorization):
+    """
+    The factorization ``P * A = L * U``, with ``L`` lower triangular with ones on the diagonal,
+    ``U`` upper triangular and ``P`` a permutation matrix.
+    """
+    name = "LU factorization"
+
+    def __init__(self, matrix: np.ndarray):
+        if matrix.shape[0] != matrix.shape[1]:
+            raise RuntimeError("Only square matrices have an LU factorization")
+        self.packed, self.permutation = _lu(matrix)
+        size = matrix.shape[0]
+        lower = np.tril(self.packed, -1) + np.identity(size, self.packed.dtype)
+        upper = np.triu(self.packed)
+        permutation = np.zeros((size, size), int)
+        permutation[np.arange(size), self.permutation] = 1
+        super().__init__(matrix.shape, [Matrix.wrap(lower), Matrix.wrap(upper), Matrix.wrap(permutation)])
+
+    def solve(self, right: np.ndarray) -> np.ndarray:
+        if np.any(np.diagonal(self.packed) == 0):
+            raise RuntimeError("Cannot solve a system with a singular matrix")
+        result = _triangular_solve(self.packed, right[self.permutation], lower=True, unit=True)
+        return _triangular_solve(self.packed, result, lower=False)
+
+
+class CholeskyFactorization(Factorization):
+    """
+    The factorization ``A = L * L'`` of a symmetric positive definite matrix, with ``L`` lower
+    triangular. Solving with it takes half the work of an LU factorization.
+    """
+    name = "Cholesky factorization"
+
+    def __init__(self, matrix: np.ndarray):
+        try:
+            self.lower = np.linalg.cholesky(matrix)
+        except np.linalg.LinAlgError:
+            raise RuntimeError("Only symmetric positive definite matrices have a Cholesky factorization")
+        super().__init__(matrix.shape, [Matrix.wrap(self.lower)])
+
+    def solve(self, right: np.ndarray) -> np.ndarray:
+        result = _triangular_solve(self.lower, right, lower=True)
+        return _triangular_solve(self.lower.conj().transpose(), result, lower=False)
+
+
+class QRFactorization(Factorization):
+    """
+    The factorization ``A = Q * R``, with ``Q`` orthogonal and ``R`` upper triangular. Solving
+    with it gives the least squares solution when there are more equations than unknowns.
+    """
+    name = "QR factorization"
+
+    def __init__(self, matrix: np.ndarray):
+        if matrix.shape[0] < matrix.shape[1]:
+            raise RuntimeError("Cannot factorize a matrix with more columns than rows")
+        self.orthogonal, self.upper = np.linalg.qr(matrix)
+        super().__init__(matrix.shape, [Matrix.wrap(self.orthogonal), Matrix.wrap(self.upper)])
+
+    def solve(self, right: np.ndarray) -> np.ndarray:
+        if np.any(np.diagonal(self.upper) == 0):
+            raise RuntimeError("Cannot solve a system with a rank-deficient matrix")
+        return _triangular_solve(self.upper, self.orthogonal.conj().transpose() @ right, lower=False)
+
+
+class SVDFactorization(Factorization):
+    """
+    The factorization ``A = U * S * V'``, with ``U`` and ``V`` orthogonal and ``S`` diagonal.
+    Solving with it gives the minimum norm least squares solution, ignoring singular values
+    that are negligible compared to the largest one.
+    """
+    name = "singular value decomposition"
+
+    def __init__(self, matrix: np.ndarray):
+        self.left, self.values, self.right = np.linalg.svd(matrix, full_matrices=False)
+        super().__init__(matrix.shape, [Matrix.wrap(self.left),
+                                        Matrix.wrap(np.diag(self.values)),
+                                        Matrix.wrap(self.right.conj().transpose())])
+
+    def solve(self, right: np.ndarray) -> np.ndarray:
+        cutoff = np.finfo(self.values.dtype).eps * max(self.dimensions) * (self.values[0] if len(self.values) > 0 else 0)
+        inverse = np.divide(1, self.values, out=np.zeros_like(self.values), where=self.values > cutoff)
+        return self.right.conj().transpose() @ (inverse[:, None] * (self.left.conj().transpose() @ right))
+
+
+class EigenDecomposition(Factorization):
+    """
+    The eigenvectors ``V`` and the diagonal matrix of eigenvalues ``D``, such that ``A * V = V * D``.
+    """
+    name = "eigendecomposition"
+
+    def __init__(self, matrix: np.ndarray):
+        if matrix.shape[0] != matrix.shape[1]:
+            raise RuntimeError("Only square matrices have eigenvalues")
+        values, vectors = np.linalg.eig(matrix)
+        super().__init__(matrix.shape, [Matrix.wrap(vectors), Matrix.wrap(np.diag(values))])
+
+
+def _lu(matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates the LU factorization with partial pivoting, a block of columns at a time. The
+    columns of a block are factorized one by one, after which the rest of the matrix is updated
+    with a single matrix product.
+    :param matrix: the square matrix
+    :return: both factors packed in one array (the ones on the diagonal of ``L`` are left out),
+             and the original row of every row
+    """
+    packed = matrix.astype(np.result_type(matrix.dtype, float), copy=True)
+    size = packed.shape[0]
+    permutation = np.arange(size)
+    for start in range(0, size, BLOCK_SIZE):
+        stop = min(start + BLOCK_SIZE, size)
+        for column in range(start, stop):
+            pivot = column + int(np.argmax(np.abs(packed[column:, column])))
+            if pivot != column:
+                packed[[column, pivot]] = packed[[pivot, column]]
+                permutation[[column, pivot]] = permutation[[pivot, column]]
+            if packed[column, column] == 0:
+                # The matrix is singular, which is reported when solving
+                continue
+            packed[column + 1:, column] /= packed[column, column]
+            packed[column + 1:, column + 1:stop] -= np.outer(packed[column + 1:, column], packed[column, column + 1:stop])
+        if stop < size:
+            packed[start:stop, stop:] = _triangular_solve(packed[start:stop, start:stop], packed[start:stop, stop:],
+                                                          lower=True, unit=True)
+            packed[stop:, stop:] -= packed[stop:, start:stop] @ packed[start:stop, stop:]
+    return packed, permutation
+
+
+def _triangular_solve(triangle: np.ndarray, right: np.ndarray, lower: bool, unit=False) -> np.ndarray:
+    """
+    Solves a system with a triangular matrix by substitution, a block of rows at a time.
+    :param triangle: the matrix, of which only the lower or upper triangle is used
+    :param right: the right-hand side, with a column for each system
+    :param lower: whether to use the lower triangle, or otherwise the upper triangle
+    :param unit: whether the diagonal consists of ones that aren't stored
+    :return: the solution
+    """
+    size = triangle.shape[0]
+    result = np.zeros(right.shape, np.result_type(triangle.dtype, right.dtype, float))
+    blocks = [(start, min(start + BLOCK_SIZE, size)) for start in range(0, size, BLOCK_SIZE)]
+    for start, stop in (blocks if lower else reversed(blocks)):
+        if lower:
+            block = np.tril(triangle[start:stop, start:stop], -1 if unit else 0)
+            remaining = right[start:stop] - triangle[start:stop, :start] @ result[:start]
+        else:
+            block = np.triu(triangle[start:stop, start:stop], 1 if unit else 0)
+            remaining = right[start:stop] - triangle[start:stop, stop:] @ result[stop:]
+        if unit:
+            block += np.identity(stop - start, block.dtype)
+        result[start:stop] = np.linalg.solve(block, remaining)
+    return result
+
+
+def _right_hand_side(value, rows: int) -> np.ndarray:
+    if isinstance(value, SparseMatrix):
+        value = value.array
+    elif isinstance(value, Matrix):
+        value = value.array
+    else:
+        value = np.array([[value]])
+    if value.shape[0] != rows:
+        # Row vectors are accepted as well, as long as their length matches
+        value = value.reshape(rows, -1) if value.size == rows else value
+    if value.shape[0] != rows:
+        raise RuntimeError("The right-hand side must have as many rows as the matrix")
+    return value
+
+
+def left_divide(left, right):
+    """
+    Solves the system ``left * x = right``, which is more accurate and faster than multiplying
+    with the inverse. Systems with more equations than unknowns are solved in the least squares
+    sense. Sparse matrices are solved with the conjugate gradient method if they are symmetric
+    and positive definite, with the biconjugate gradient method if they are too large to solve
+    directly, and directly otherwise.
+    :param left: the matrix, or a factorization of it
+    :param right: the right-hand side, with a column for each system
+    :return: the solution
+    """
+    if isinstance(left, numbers.Number):
+        return right / left
+    if isinstance(left, Factorization):
+        return left.__ldiv__(right)
+    if isinstance(left, SparseMatrix):
+        rows, columns = left.shape()
+        right = _right_hand_side(right, rows)
+        if rows == columns:
+            # Only large systems that aren't symmetric use the slower biconjugate gradient method,
+            # the others are solved directly if the conjugate gradient method cannot solve them
+            methods = [cg] if (left - left.transpose()).nonzeros() == 0 else []
+            if rows * columns > DIRECT_LIMIT:
+                methods.append(bicgstab)
+            for method in methods:
+                try:
+                    return Matrix.wrap(np.hstack([method(left, Matrix.wrap(column[:, None])).array
+                                                  for column in right.transpose()]))
+                except ConvergenceError:
+                    pass
+            if rows * columns > DIRECT_LIMIT:
+                raise RuntimeError(f"Cannot solve this system with a sparse matrix ({rows}x{columns}): "
+                                   f"it is too large to solve directly, and the iterative methods did not converge")
+        left = Matrix.wrap(left.array)
+
+    right = _right_hand_side(right, left.shape()[0])
+    if left.shape()[0] == left.shape()[1]:
+        try:
+            return Matrix.wrap(np.linalg.solve(left.array, right))
+        except np.linalg.LinAlgError:
+            raise RuntimeError("Cannot solve a system with a singular matrix")
+    return Matrix.wrap(np.linalg.lstsq(left.array, right, rcond=None)[0])
+
+
+def solve(left, right):
+    """
+    Solves the system ``left * x = right``, just like ``left \\ right``.
+    :param left: the matrix, or a factorization of it
+    :param right: the right-hand side, with a column for each system
+    :return: the solution
+    """
+    # TODO Add preconditions
+    return left_divide(left, right)
+
+
+def lu(matrix: Matrix):
+    """
+    Factorizes a square matrix as ``P * A = L * U``. The factors are ``L``, ``U`` and ``P``.
+    :param matrix: the matrix
+    :return: the factorization
+    """
+    # TODO Add preconditions
+    return LUFactorization(matrix.array)
+
+
+def qr(matrix: Matrix):
+    """
+    Factorizes a matrix as ``A = Q * R``. The factors are ``Q`` and ``R``.
+    :param matrix: the matrix
+    :return: the factorization
+    """
+    # TODO Add preconditions
+    return QRFactorization(matrix.array)
+
+
+def chol(matrix: Matrix):
+    """
+    Factorizes a symmetric positive definite matrix as ``A = L * L'``. The only factor is ``L``.
+    :param matrix: the matrix
+    :return: the factorization
+    """
+    # TODO Add preconditions
+    return CholeskyFactorization(matrix.array)
+
+
+def svd(matrix: Matrix):
+    """
+    Factorizes a matrix as ``A = U * S * V'``. The factors are ``U``, ``S`` and ``V``.
+    :param matrix: the matrix
+    :return: the factorization
+    """
+    # TODO Add preconditions
+    return SVDFactorization(matrix.array)
+
+
+def eig(matrix: Matrix):
+    """
+    Calculates the eigenvectors and eigenvalues of a square matrix. The factors are the matrix
+    ``V`` with the eigenvectors as columns, and the diagonal matrix ``D`` of the eigenvalues.
+    :param matrix: the matrix
+    :return: the decomposition
+    """
+    # TODO Add preconditions
+    return EigenDecomposition(matrix.array)
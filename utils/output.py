@@ -0,0 +1,91 @@
+import io
+import sys
+from typing import TextIO
+
+BUFFER_SIZE = 64 * 1024
+"""
+The amount of characters a stream sink collects before it writes them to its stream.
+"""
+
+
+class OutputSink:
+    """
+    Where the output of a program goes, like the text printed by ``print``. Output functions
+    write to the sink of the context instead of to the standard output, so the output of a
+    program can be redirected without changing the standard output of the whole process.
+    """
+    def write(self, text: str):
+        raise NotImplementedError("This method should be implemented")
+
+    def flush(self):
+        """
+        Makes sure all output written so far has arrived at its destination.
+        """
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class StreamSink(OutputSink):
+    """
+    Writes output to a text stream in large blocks, instead of a separate write for every printed
+    value. Nothing arrives at the stream until the sink is flushed or the block is full.
+    """
+    def __init__(self, stream: TextIO | None = None, buffer_size=BUFFER_SIZE):
+        """
+        :param stream: the stream, or ``None`` for whatever the standard output is when flushing
+        :param buffer_size: the amount of characters to collect before writing them
+        """
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer: list[str] = []
+        self.buffered = 0
+
+    def write(self, text: str):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        stream = sys.stdout if self.stream is None else self.stream
+        if self.buffer:
+            stream.write("".join(self.buffer))
+            self.buffer.clear()
+            self.buffered = 0
+        stream.flush()
+
+
+class FileSink(StreamSink):
+    """
+    Writes output to a file, which is closed when the sink is closed.
+    """
+    def __init__(self, path: str, append=False, buffer_size=BUFFER_SIZE):
+        super().__init__(open(path, "a" if append else "w", encoding="utf-8"), buffer_size)
+
+    def close(self):
+        self.flush()
+        self.stream.close()
+
+
+class BufferSink(OutputSink):
+    """
+    Keeps all output in memory, for example to return the output of a program run by a service.
+    """
+    def __init__(self):
+        self.buffer = io.StringIO()
+
+    def write(self, text: str):
+        self.buffer.write(text)
+
+    def getvalue(self) -> str:
+        return self.buffer.getvalue()
+
+
+class NullSink(OutputSink):
+    """
+    Discards all output, which is useful to measure the speed of a program without its output.
+    """
+    def write(self, text: str):
+        pass
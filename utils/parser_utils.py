@@ -1,14 +1,127 @@
-from typing import Any
+from itertools import count
+from typing import Any, Iterator
 
+from utils.lazy import lazy_import
+from utils.output import OutputSink, StreamSink
 
-class Context:
-    variable_states: list[dict[str, Any]] = []
+np = lazy_import("numpy")
+
+_versions = count(1)
+
+
+class Variables(dict):
+    """
+    A dictionary of variables that keeps a version for every name. Each time a name is bound,
+    rebound or deleted, it receives a new version. Versions are unique over all instances,
+    so an expression can remember what a name resolved to and only look it up again when
+    the version of that name has changed.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.versions: dict[str, int] = {}
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.versions[key] = next(_versions)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.versions[key] = next(_versions)
+
+    def pop(self, key, *default):
+        self.versions[key] = next(_versions)
+        return super().pop(key, *default)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self.versions[key] = next(_versions)
+        return key, value
 
-    def __init__(self):
-        self.variable_states.append(dict())
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in self:
+            self.versions[key] = next(_versions)
+        super().clear()
+
+    def copy(self) -> 'Variables':
+        """
+        Copies the variables. The copy keeps the same versions, since its names are bound to
+        the same values, so expressions that remembered a name can still use it.
+        :return: the copy
+        """
+        variables = Variables()
+        dict.update(variables, self)
+        variables.versions = self.versions.copy()
+        return variables
+
+
+class Context:
+    def __init__(self, variables: Variables | None = None):
+        """
+        :param variables: the variables to start with, which are not copied
+        """
+        self.variable_states: list[Variables] = [Variables() if variables is None else variables]
+        self.random: np.random.Generator | None = None
+        """
+        The random number generator used by the random functions, created when it is first needed.
+        """
+        self.output: OutputSink = StreamSink()
+        """
+        Where the output functions write to. It is buffered, so it must be flushed when the program ends.
+        """
+        # The state of the statements that are running is kept here instead of in the statements
+        # themselves, so the same program can run in several contexts at once
+        self.returned: dict[Any, Any] = {}
+        """
+        The values returned by the functions that are running, by the return block of their body.
+        """
+        self.iterators: dict[Any, Iterator] = {}
+        """
+        The iterators of the for loops that are running, by their block.
+        """
+        self.task = None
+        """
+        The task running the program if it runs asynchronously, see ``utils.scheduling.Task``.
+        """
+        self.profiler = None
+        """
+        The profiler measuring the program while it runs, see ``utils.profiling.Profiler``.
+        """
+        self.memos: dict[Any, Any] = {}
+        """
+        The results cached by the memoized functions in this run, see ``Function.cache``.
+        """
         
     def variables(self):
         return self.variable_states[-1]
+
+    def random_generator(self) -> 'np.random.Generator':
+        """
+        :return: the random number generator, which is seeded by the operating system if no seed was set
+        """
+        if self.random is None:
+            self.random = np.random.default_rng()
+        return self.random
+
+    def seed(self, seed: int, stream: int | None = None):
+        """
+        Resets the random number generator, so the same random numbers are generated each run.
+        Generators with the same seed but a different stream are independent of each other,
+        which is useful to give parallel workers their own random numbers.
+        :param seed: the seed
+        :param stream: the number of the stream, or ``None`` for the main stream
+        """
+        spawn_key = () if stream is None else (stream,)
+        self.random = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=spawn_key))
     
     # def branch(self):
     #     self.variable_states.append(dict(self.variables()))
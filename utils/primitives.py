@@ -1,14 +1,23 @@
+import hashlib
+import inspect
 import numbers
-from typing import Literal, Any
-
-import numpy as np
+from copy import copy
+from typing import Literal, Any, Callable
 
+from utils.cache import LRUCache, MISSING
 from utils.decorators import encapsulate_parent
+from utils.lazy import lazy_import
 from utils.parser_utils import Context
 
+np = lazy_import("numpy")
+
 
 class Matrix:
-    array: np.ndarray
+    array: 'np.ndarray'
+    # The array the hash index was made for and the index itself, see __contains__
+    _index: 'tuple[np.ndarray, frozenset | bool | None] | None' = None
+    # The profiler that new matrices report their size to, see utils.profiling
+    profiler = None
 
     def __init__(self, matrix=None):
         """
@@ -48,6 +57,32 @@ class Matrix:
         else:
             # Matrix is a single value
             self.array = np.array([[matrix]], dtype=type(matrix))
+        if Matrix.profiler is not None:
+            Matrix.profiler.allocate(self.array.nbytes)
+
+    @classmethod
+    def wrap(cls, array: 'np.ndarray') -> 'Matrix':
+        """
+        Creates a matrix that uses the given Numpy array itself instead of a copy, which is
+        needed for memory-mapped arrays. Arrays that are not 2-dimensional are reshaped,
+        which does not copy them either if they are contiguous:
+
+        - a one-dimensional array becomes a row matrix, and
+        - an array with more dimensions keeps its first dimension as rows.
+        :param array: the Numpy array
+        :return: the matrix
+        """
+        matrix = cls.__new__(cls)
+        if array.ndim == 2:
+            matrix.array = array
+        elif array.ndim < 2:
+            matrix.array = array.reshape(1, -1)
+        else:
+            matrix.array = array.reshape(array.shape[0], -1)
+        # Arrays that use the memory of another array or of a file were not allocated for this matrix
+        if Matrix.profiler is not None and array.flags.owndata:
+            Matrix.profiler.allocate(array.nbytes)
+        return matrix
 
     def execute(self, ctx, args, spread=False):
         # TODO Add preconditions
@@ -85,6 +120,18 @@ class Matrix:
         """
         return [item for sublist in self.array.tolist() for item in sublist]
 
+    def digest(self):
+        """
+        Returns a hashable value that only depends on the shape, data type and contents of
+        this matrix, so two equal matrices have the same digest.
+        :return: the digest of this matrix
+        """
+        if self.array.dtype == object:
+            # The raw bytes of an object array are pointers, so we need to use the elements themselves
+            return self.array.shape, tuple(self.vector())
+        content = hashlib.blake2b(np.ascontiguousarray(self.array).tobytes(), digest_size=16).digest()
+        return self.array.shape, self.array.dtype.str, content
+
     def concat(self, other, dimension: Literal[0, 1] = 0):
         """
         Adds the vectors to this matrix, either as rows (``dimension`` is 0) or as columns (``dimension``
@@ -94,6 +141,7 @@ class Matrix:
         :param dimension: whether to add the vectors as rows (0, default) or as columns (1)
         """
         # TODO Add preconditions
+        self._index = None
         if not isinstance(other, list):
             other = [[other]]
 
@@ -107,6 +155,7 @@ class Matrix:
 
     def __delitem__(self, key):
         # TODO Add preconditions
+        self._index = None
         key = self._transform_keys(key)
 
         # Deleting the values
@@ -127,6 +176,12 @@ class Matrix:
             raise RuntimeError(f"Too many arguments: expected 2 or lower arguments, but found {len(key)}")
 
     def __getitem__(self, item):
+        mask = self._mask(item)
+        if mask is not None:
+            # The elements where the mask is true, in a row vector
+            result = self.array[mask]
+            return Matrix(result) if len(result) != 1 else result[0]
+
         args = self._transform_keys(list(item))
 
         # Fetching the values
@@ -156,6 +211,13 @@ class Matrix:
     def __setitem__(self, key, value):
         # TODO Add preconditions
         # TODO When manipulating arrays, use only arrays and not lists, singular values and arrays inconsistently
+        self._index = None
+        mask = self._mask(key)
+        if mask is not None:
+            # Changes the elements where the mask is true, either to the same value or to the elements of a matrix
+            self.array[mask] = value.array.ravel() if isinstance(value, Matrix) else value
+            return
+
         key = self._transform_keys(key)
 
         # Setting the values
@@ -222,6 +284,10 @@ class Matrix:
     def __elmul__(self, other):
         # Elementwise matrix multiplication only
         # TODO Add preconditions
+        if isinstance(other, Matrix) and type(other).__elmul__ is not Matrix.__elmul__:
+            # Like Python does for the other operators, matrices of a subclass with their own way to
+            # multiply, like disk matrices, calculate the result, which is the same in both orders
+            return other.__elmul__(self)
         return Matrix(np.multiply(self.array, other.array))
 
     def __truediv__(self, other):
@@ -236,10 +302,84 @@ class Matrix:
     def __elpow__(self, other):
         return Matrix(np.power(self.array, other.array))
 
+    def _compare(self, other, comparison):
+        """
+        Compares this matrix element-wise with a matrix of the same dimensions or with a single value.
+        :param other: the matrix or value
+        :param comparison: the Numpy comparison
+        :return: a matrix of booleans
+        """
+        if isinstance(other, Matrix):
+            if self.array.shape != other.array.shape:
+                raise RuntimeError("Cannot compare matrices with different dimensions")
+            other = other.array
+        return Matrix.wrap(comparison(self.array, other))
+
+    def __eq__(self, other):
+        if isinstance(other, Matrix) and self.array.shape != other.array.shape:
+            # Matrices with different dimensions are never equal
+            return False
+        return self._compare(other, np.equal)
+
+    def __ne__(self, other):
+        if isinstance(other, Matrix) and self.array.shape != other.array.shape:
+            return True
+        return self._compare(other, np.not_equal)
+
+    def __lt__(self, other):
+        return self._compare(other, np.less)
+
+    def __le__(self, other):
+        return self._compare(other, np.less_equal)
+
+    def __gt__(self, other):
+        return self._compare(other, np.greater)
+
+    def __ge__(self, other):
+        return self._compare(other, np.greater_equal)
+
+    def __and__(self, other):
+        # Element-wise logical and, used to combine the results of comparisons
+        return self._compare(other, np.logical_and)
+
+    def __rand__(self, other):
+        return self._compare(other, np.logical_and)
+
+    # Matrices are changed in place and compared element-wise, so they can't be hashed
+    __hash__ = None
+
+    def __bool__(self):
+        # Like a condition in MATLAB, a matrix is only true if it has elements and all of them are true
+        return self.array.size > 0 and bool(np.all(self.array))
+
     def __contains__(self, item):
         # TODO Add preconditions
         # TODO Add support for row/column vectors
-        return item in self.vector()
+        if isinstance(item, Matrix) or self.array.dtype == object:
+            return item in self.vector()
+
+        # A matrix that is searched more than once is probably used as a lookup table, so it gets
+        # a hash index, until it is changed. Other kinds of matrices can be changed elsewhere.
+        if self._index is not None and self._index[0] is self.array and type(self) is Matrix:
+            if self._index[1] is None:
+                self._index = (self.array, self._build_index())
+            if self._index[1] is not False:
+                try:
+                    return item in self._index[1]
+                except TypeError:
+                    return False
+        else:
+            self._index = (self.array, None)
+        return bool(np.any(self.array == item))
+
+    def _build_index(self) -> frozenset | bool:
+        """
+        :return: the set of elements of this matrix, or ``False`` if they can't be hashed
+        """
+        try:
+            return frozenset(self.array.ravel().tolist())
+        except TypeError:
+            return False
 
     def __len__(self):
         # TODO Add support for dimensions
@@ -252,12 +392,37 @@ class Matrix:
     def __copy__(self):
         return Matrix(self)
 
+    def buffers(self) -> tuple['np.ndarray', ...]:
+        """
+        :return: the Numpy arrays that hold the elements of the matrix
+        """
+        return self.array,
+
+    def shares_memory(self, other: 'Matrix') -> bool:
+        """
+        :param other: another matrix
+        :return: whether changing one of the matrices could change the other one
+        """
+        return any(np.may_share_memory(mine, theirs) for mine in self.buffers() for theirs in other.buffers())
+
     def __str__(self):
         return "[" + "; ".join([", ".join([str(element) for element in row]) for row in self.array.tolist()]) + "]"
 
     def __repr__(self):
         return self.__str__()
 
+    def _mask(self, keys) -> 'np.ndarray | None':
+        """
+        Returns the boolean mask if the keys consist of a single matrix of booleans with the same
+        dimensions as this matrix, like the result of comparing this matrix with a value.
+        :param keys: the keys
+        :return: the mask, or ``None`` if the keys aren't a mask
+        """
+        if len(keys) != 1 or not isinstance(keys[0], Matrix):
+            return None
+        mask = keys[0].array
+        return mask if mask.dtype == bool and mask.shape == self.array.shape else None
+
     @staticmethod
     def _transform_keys(keys) -> list:
         """
@@ -272,7 +437,8 @@ class Matrix:
                 result.append(key.slice())
             elif isinstance(key, Matrix):
                 # TODO Add preconditions (only vectors allowed)
-                result.append(key.vector())
+                # Vectors of booleans select the rows or columns where they are true
+                result.append(key.array.ravel() if key.array.dtype == bool else key.vector())
             else:
                 result.append(key)
         return result
@@ -340,29 +506,158 @@ class Complex(complex):
         return self.__str__()
 
 
+def _hashable(value):
+    """
+    Makes sure a value can be used as a key of a dictionary or an element of a set.
+    :param value: the value
+    :return: the value
+    """
+    try:
+        hash(value)
+    except TypeError:
+        raise RuntimeError(f"A {type(value).__name__.lower()} cannot be used as a key or set element")
+    return value
+
+
+class Dictionary:
+    """
+    A hash map from keys to values. Values are looked up with list access, which returns ``None``
+    for keys that aren't in the dictionary. Using more than one key, like ``prices["apple", 3]``,
+    uses them together as a single key. Looping over a dictionary goes over its keys.
+    """
+    def __init__(self, entries: dict | None = None):
+        self.entries = {} if entries is None else entries
+
+    @staticmethod
+    def _key(keys):
+        if len(keys) == 0:
+            raise RuntimeError("A key is needed to access a dictionary")
+        return _hashable(keys[0] if len(keys) == 1 else tuple(keys))
+
+    def keys(self) -> Matrix:
+        return Matrix(list(self.entries.keys()))
+
+    def values(self) -> Matrix:
+        return Matrix(list(self.entries.values()))
+
+    def __getitem__(self, item):
+        return self.entries.get(self._key(item))
+
+    def __setitem__(self, key, value):
+        self.entries[self._key(key)] = value
+
+    def __delitem__(self, key):
+        self.entries.pop(self._key(key), None)
+
+    def __contains__(self, item):
+        try:
+            return item in self.entries
+        except TypeError:
+            return False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __eq__(self, other):
+        return isinstance(other, Dictionary) and self.entries == other.entries
+
+    __hash__ = None
+
+    def __copy__(self):
+        return Dictionary({key: copy(value) for key, value in self.entries.items()})
+
+    def __str__(self):
+        return "{" + ", ".join([f"{key}: {value}" for key, value in self.entries.items()]) + "}"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class Set:
+    """
+    An unordered collection of distinct elements. Adding sets gives their union and subtracting
+    them gives their difference.
+    """
+    def __init__(self, elements: set | None = None):
+        self.elements = set() if elements is None else elements
+
+    def add(self, element):
+        self.elements.add(_hashable(element))
+
+    def __add__(self, other):
+        # TODO Add preconditions
+        return Set(self.elements | other.elements)
+
+    def __sub__(self, other):
+        # TODO Add preconditions
+        return Set(self.elements - other.elements)
+
+    def __contains__(self, item):
+        try:
+            return item in self.elements
+        except TypeError:
+            return False
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __iter__(self):
+        return iter(list(self.elements))
+
+    def __eq__(self, other):
+        return isinstance(other, Set) and self.elements == other.elements
+
+    __hash__ = None
+
+    def __copy__(self):
+        return Set(set(self.elements))
+
+    def __str__(self):
+        return "{" + ", ".join([str(element) for element in self.elements]) + "}"
+
+    def __repr__(self):
+        return self.__str__()
+
+
 class Function:
-    def __init__(self, parameters: list[str] | None, block, curried=None, infix=False):
+    def __init__(self, parameters: list[str] | None, block, infix=False, memo: LRUCache | None = None):
         self.parameters = parameters
         """
         The parameters of this function, or None if the amount of parameters does not matter,
         which is the case for built-in Python functions.
         """
         self.block = block
-        self.curried = [] if curried is None else curried
+        self.curried = ()
         self.infix = infix
+        self.memo = memo
+        """
+        The cache of this function if it is memoized, or None otherwise. Functions are shared by all
+        runs of a program, so the results are not stored in this cache itself, but in a cache of the
+        same size in the context, see ``cache``.
+        """
+        self.lineno = 0
+        """
+        The line in the source where this function is defined, or 0 for built-in functions.
+        """
 
     def execute(self, ctx: Context, args, spread=False):
-        if self.parameters is not None and len(self.parameters) < len(self.curried) + len(args):
+        if self.parameters is not None and len(self.parameters) < len(args):
+            raise RuntimeError(
+                f"Too many arguments: expected {len(self.parameters)} arguments, but found {len(args)}")
+        if len(args) < self.arguments_needed():
             raise RuntimeError(
-                f"Too many arguments: expected {len(self.parameters)} arguments, but found {len(self.curried) + len(args)}")
+                f"Not enough arguments: expected {self.arguments_needed()} arguments, but found {len(args)}")
 
         # We need to perform the len() operation on all arguments if they are spread, hence why we put them in a list
         # TODO Find a better way to do this
-        args = [[value] if spread and not hasattr(value, "__len__") else value for value in self.curried + args]
+        args = [[value] if spread and not hasattr(value, "__len__") else value for value in args]
 
         # Stores the shape of the first matrix that was found in the arguments
         # This is needed when spreading functions
-        matrices = list(filter(lambda x: isinstance(x, Matrix), self.curried + args))
+        matrices = list(filter(lambda x: isinstance(x, Matrix), args))
         if matrices:
             result_shape = matrices[0].shape()
 
@@ -377,8 +672,8 @@ class Function:
         if spread:
             # Loops over the elements of each separate argument
             # Since all arguments are assumed to have the same length or length 1,
-            # we can just pick the first to check the length
-            for i in range(len(args[0])):
+            # the longest argument determines the amount of iterations
+            for i in range(max(len(value) for value in args)):
                 # We must separate the map to easily support the spread system for built-in functions,
                 # which need to know all the arguments
                 parameter_map = dict()
@@ -392,10 +687,10 @@ class Function:
                     # Because spread arguments can always have length 1, we need to check manually for each iteration
                     parameter_map[parameter] = list(args[j])[i if len(args[j]) > 1 else 0]
 
-                result.append(self._get_return_value(ctx, parameter_map))
+                result.append(self._call(ctx, parameter_map))
         else:
             parameters = self.parameters if self.parameters is not None else list(range(len(args)))
-            result.append(self._get_return_value(ctx, {key: value for key, value in zip(parameters, args)}))
+            result.append(self._call(ctx, {key: value for key, value in zip(parameters, args)}))
 
         # TODO Make this prettier and support non-matrix types
         # TODO Make the data type solutions less hacky...
@@ -404,7 +699,65 @@ class Function:
         return result[0] if len(result) == 1 else Matrix(np.array(result, dtype=data_type).reshape(result_shape))
 
     def arguments_needed(self):
-        return len(self.parameters) - len(self.curried)
+        return len(self.parameters)
+
+    def partial(self, args) -> 'Partial':
+        """
+        Returns this function with the given arguments already supplied, which is used
+        when calling a function with less arguments than it needs (currying). Calls without any
+        arguments are never curried, so they fail instead of silently returning the function.
+        :param args: the curried arguments
+        :return: the partially applied function
+        """
+        return Partial(self, args)
+
+    def cache(self, ctx: Context) -> LRUCache:
+        """
+        Returns the cache with the results of earlier calls of this memoized function in a context.
+        Copies of the function share it, since they have the same ``memo``.
+        :param ctx: the context
+        :return: the cache, which is created the first time it is needed
+        """
+        cache = ctx.memos.get(self.memo)
+        if cache is None:
+            cache = ctx.memos.setdefault(self.memo, LRUCache(self.memo.size))
+        return cache
+
+    def _call(self, ctx: Context, parameters: dict[str, Any]):
+        if self.memo is None:
+            return self._get_return_value(ctx, parameters)
+        key = self._memo_key(parameters.values())
+        if key is None:
+            # Some arguments cannot be hashed, so we can't cache this call
+            return self._get_return_value(ctx, parameters)
+
+        cache = self.cache(ctx)
+        result = cache.get(key)
+        if result is MISSING:
+            result = self._get_return_value(ctx, parameters)
+            cache.put(key, result)
+        # Matrices can be changed in place, which would alter the cached result as well
+        return copy(result) if isinstance(result, Matrix) else result
+
+    @staticmethod
+    def _memo_key(values):
+        """
+        Creates the key under which the result of a call is cached. The type is part of
+        the key, so that ``1`` and ``True`` are cached separately. Matrices are keyed
+        by their contents.
+        :param values: the argument values
+        :return: the key, or ``None`` if one of the values cannot be hashed
+        """
+        key = []
+        for value in values:
+            if isinstance(value, Matrix):
+                value = value.digest()
+            try:
+                hash(value)
+            except TypeError:
+                return None
+            key.append((type(value), value))
+        return tuple(key)
 
     def _get_return_value(self, ctx: Context, parameters: dict[str, Any]):
         # TODO Remove variables afterwards
@@ -412,13 +765,13 @@ class Function:
 
         from elements.statements import run_statements
         run_statements(self.block, ctx)
-        result = self.block.returned
+        result = ctx.returned.get(self.block)
         self.block.clear(ctx)
 
         return result
 
     def __str__(self):
-        result = "infix" * self.infix + "fn("
+        result = "memo " * (self.memo is not None) + "infix" * self.infix + "fn("
         for i in range(len(self.parameters)):
             if i > 0:
                 result += ", "
@@ -431,14 +784,56 @@ class Function:
         return self.__str__()
 
 
+class Partial(Function):
+    """
+    A function with some of its arguments already supplied. Partial functions never change
+    after creation, so the same instance can safely be shared and called multiple times.
+    """
+    def __init__(self, function: Function, args):
+        super().__init__(function.parameters, function.block)
+        self.function = function
+        self.curried = tuple(args)
+
+    def execute(self, ctx: Context, args, spread=False):
+        return self.function.execute(ctx, [*self.curried, *args], spread=spread)
+
+    def arguments_needed(self):
+        return self.function.arguments_needed() - len(self.curried)
+
+    def partial(self, args) -> 'Partial':
+        # Curry the original function directly, so calling never passes through multiple partials
+        return Partial(self.function, self.curried + tuple(args))
+
+    def __str__(self):
+        if self.parameters is None:
+            return "built-in fn(" + ", ".join([str(value) for value in self.curried]) + ", ...)"
+        return super().__str__()
+
+
 class PythonFunction(Function):
     def __init__(self, python_function, infix=False):
         super().__init__(None, None, infix=infix)
         self.python_function = python_function
+        self.required = self._required_arguments(python_function)
 
     def arguments_needed(self):
-        # We don't want to enable currying for built-in Python functions!
-        return 0
+        return self.required
+
+    @staticmethod
+    def _required_arguments(python_function):
+        """
+        Counts the positional arguments without a default value that the Python function needs,
+        so it can be curried. If the signature cannot be determined, currying is disabled.
+        :param python_function: the Python function
+        :return: the amount of required arguments
+        """
+        try:
+            signature = inspect.signature(python_function)
+        except (TypeError, ValueError):
+            return 0
+        return len([parameter for parameter in signature.parameters.values()
+                    if parameter.default is parameter.empty
+                    and parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)])
 
     def _get_return_value(self, ctx: Context, parameters: dict[str, Any]):
         return self.python_function(*parameters.values())
@@ -447,6 +842,56 @@ class PythonFunction(Function):
         return f'built-in fn()'
 
 
+class AwaitableFunction(PythonFunction):
+    """
+    A built-in Python function that returns an awaitable, like an ``async`` function that loads
+    data. Programs that run asynchronously wait for the event loop to await it, so other tasks
+    can run in the meantime. Other programs await it on an event loop of their own.
+    """
+    def _get_return_value(self, ctx: Context, parameters: dict[str, Any]):
+        awaitable = self.python_function(*parameters.values())
+        if ctx.task is not None:
+            return ctx.task.wait(awaitable)
+        import asyncio
+        return asyncio.run(self._await(awaitable))
+
+    @staticmethod
+    async def _await(awaitable):
+        return await awaitable
+
+
+class LazyFunction(Function):
+    """
+    A built-in function that is only created the first time it is used, so the module defining
+    it isn't imported by programs that never use it.
+    """
+    def __init__(self, create: Callable[[], Function], infix=False):
+        """
+        :param create: creates the function
+        :param infix: whether the function is infix, which must be known before it is created
+        """
+        super().__init__(None, None, infix=infix)
+        self.create = create
+        self.function: Function | None = None
+
+    def resolve(self) -> Function:
+        """
+        :return: the function, which is created if this is the first time it is used
+        """
+        if self.function is None:
+            self.function = self.create()
+        return self.function
+
+    def execute(self, ctx, args, spread=False):
+        return self.resolve().execute(ctx, args, spread)
+
+    def arguments_needed(self):
+        return self.resolve().arguments_needed()
+
+    def __str__(self):
+        return str(self.resolve())
+
+
 class ContextFunction(Function):
     def __init__(self, context_function):
         super().__init__([], None)
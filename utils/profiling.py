@@ -0,0 +1,195 @@
+import time
+
+from elements.expressions import FunctionCall, VariableAccess
+from elements.statements import Block, ReturnBlock, run_statements
+from utils.parser_utils import Context
+from utils.primitives import Function, Matrix
+
+
+class Stats:
+    """
+    What was measured for a line or a function.
+    """
+    __slots__ = ("calls", "total_time", "self_time", "allocated", "running")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        """
+        The amount of seconds spent running it, including everything it called. Recursive calls
+        are only counted once.
+        """
+        self.self_time = 0.0
+        """
+        The amount of seconds spent running it, without the other lines or functions it called.
+        """
+        self.allocated = 0
+        """
+        The amount of bytes of the matrices it created itself.
+        """
+        self.running = 0
+
+
+class Profiler:
+    """
+    Measures how often each line and function of a program runs, how long that takes, and how
+    much memory the matrices it creates use. Lines are measured with every statement the tree
+    walker runs, so the time of a line includes the functions it calls, but not the statements in
+    its block: those are lines of their own. Functions are measured with every call.
+
+    Matrices report their size to the profiler that is running, so only one program can be
+    profiled at a time.
+    """
+    def __init__(self, source: str | None = None, name="<main>"):
+        """
+        :param source: the source code of the program, to show the lines in the report
+        :param name: the name of the program in the stacks
+        """
+        self.source_lines = source.splitlines() if source is not None else []
+        self.name = name
+        self.lines: dict[int, Stats] = {}
+        self.functions: dict[str, Stats] = {}
+        self.stacks: dict[str, float] = {}
+        """
+        The amount of seconds spent in each line, by the functions that were running at the time.
+        """
+        # The lines and functions that are running, each with the time spent in the ones they called
+        self._statements: list[list] = []
+        self._functions: list[list] = []
+
+    def run(self, statements, ctx: Context):
+        """
+        Runs a program while profiling it.
+        :param statements: the first statement of the program
+        :param ctx: the context
+        """
+        ctx.profiler = self
+        Matrix.profiler = self
+        try:
+            run_statements(statements, ctx)
+        finally:
+            ctx.profiler = None
+            Matrix.profiler = None
+
+    def walk(self, statement, ctx: Context):
+        """
+        Walks over a statement, see ``Statement.walk``, and measures it.
+        :param statement: the statement
+        :param ctx: the context
+        :return: the statement to run next
+        """
+        if type(statement) is Block or type(statement) is ReturnBlock:
+            # These only point to their first statement
+            return statement.walk(ctx)
+        stats = self.lines.get(statement.lineno)
+        if stats is None:
+            stats = self.lines[statement.lineno] = Stats()
+        frame = [statement.lineno, 0.0]
+        self._statements.append(frame)
+        stats.calls += 1
+        stats.running += 1
+        start = time.perf_counter()
+        try:
+            return statement.walk(ctx)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._statements.pop()
+            own = self._finish(stats, frame, elapsed, self._statements)
+            stack = ";".join([self.name] + [function[0] for function in self._functions] + [f"line {statement.lineno}"])
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + own
+
+    def call(self, call: FunctionCall, function: Function, ctx: Context, args: list):
+        """
+        Calls a function, see ``Function.execute``, and measures it.
+        :param call: the expression calling the function
+        :param function: the function
+        :param ctx: the context
+        :param args: the arguments
+        :return: the result of the function
+        """
+        name = self._function_name(call, function)
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = Stats()
+        frame = [name, 0.0]
+        self._functions.append(frame)
+        stats.calls += 1
+        stats.running += 1
+        start = time.perf_counter()
+        try:
+            return function.execute(ctx, args, spread=call.spread)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._functions.pop()
+            self._finish(stats, frame, elapsed, self._functions)
+
+    def allocate(self, size: int):
+        """
+        Called when a matrix is created, which is counted for the line and function running.
+        :param size: the amount of bytes of the matrix
+        """
+        if self._statements:
+            self.lines[self._statements[-1][0]].allocated += size
+        if self._functions:
+            self.functions[self._functions[-1][0]].allocated += size
+
+    @staticmethod
+    def _finish(stats: Stats, frame: list, elapsed: float, running: list) -> float:
+        """
+        Adds the time of a line or function that finished running.
+        :param stats: what was measured for it so far
+        :param frame: the line or function, with the time spent in the ones it called
+        :param elapsed: the amount of seconds it ran
+        :param running: the lines or functions still running, of which the last one called it
+        :return: the amount of seconds spent in itself
+        """
+        stats.running -= 1
+        if stats.running == 0:
+            stats.total_time += elapsed
+        own = elapsed - frame[1]
+        stats.self_time += own
+        if running:
+            running[-1][1] += elapsed
+        return own
+
+    @staticmethod
+    def _function_name(call: FunctionCall, function: Function) -> str:
+        if isinstance(call.expression, VariableAccess):
+            return call.expression.identifier
+        if function.lineno:
+            return f"fn at line {function.lineno}"
+        return str(function)
+
+    def report(self, limit: int | None = 20) -> str:
+        """
+        :param limit: the maximum amount of functions and lines to show, or ``None`` for all of them
+        :return: a table of the functions and one of the lines, those taking the most time first
+        """
+        result = ["Functions", self._header("calls") + "function"]
+        for name, stats in self._sorted(self.functions, limit):
+            result.append(self._row(stats) + name)
+        result += ["", "Lines", self._header("hits") + "line"]
+        for lineno, stats in self._sorted(self.lines, limit):
+            text = self.source_lines[lineno - 1].strip() if 0 < lineno <= len(self.source_lines) else ""
+            result.append(self._row(stats) + f"{lineno:<6}{text}")
+        return "\n".join(result)
+
+    def collapsed(self) -> str:
+        """
+        :return: the stacks in the collapsed format of flame graph tools, with the time in microseconds
+        """
+        return "\n".join(f"{stack} {round(seconds * 1e6)}" for stack, seconds in sorted(self.stacks.items())
+                         if round(seconds * 1e6) > 0)
+
+    @staticmethod
+    def _sorted(measured: dict, limit: int | None) -> list:
+        items = sorted(measured.items(), key=lambda item: -item[1].self_time)
+        return items if limit is None else items[:limit]
+
+    @staticmethod
+    def _header(count: str) -> str:
+        return f"{count:>10}{'total (ms)':>14}{'self (ms)':>14}{'allocated':>14}  "
+
+    @staticmethod
+    def _row(stats: Stats) -> str:
+        return f"{stats.calls:>10}{stats.total_time * 1000:>14.3f}{stats.self_time * 1000:>14.3f}{stats.allocated:>14}  "
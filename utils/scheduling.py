@@ -0,0 +1,216 @@
+import asyncio
+import threading
+import time
+from typing import Awaitable
+
+from utils.parser_utils import Context
+
+SLICE_STATEMENTS = 1000
+"""
+The maximum amount of statements a program runs before it lets the event loop continue.
+"""
+SLICE_TIME = 0.005
+"""
+The maximum amount of seconds a program runs before it lets the event loop continue.
+"""
+
+_YIELD = 0
+_AWAIT = 1
+_DONE = 2
+
+
+class Task:
+    """
+    A program that runs in an event loop without blocking it. The program runs in slices: after
+    a number of statements or a few milliseconds it stops, so the event loop can run other tasks,
+    and it continues the next time the event loop gets to it.
+
+    The statements run on a thread of their own, so they can stop anywhere, even in the middle of
+    a function call. That thread is never running at the same time as the event loop: the event
+    loop waits while a slice runs, and the program waits while the event loop runs. This makes it
+    possible to await functions from within the program as well, see ``wait``.
+    """
+    def __init__(self, statements, ctx: Context, slice_statements=SLICE_STATEMENTS, slice_time=SLICE_TIME):
+        """
+        :param statements: the first statement of the program
+        :param ctx: the context to run the program in
+        :param slice_statements: the maximum amount of statements in a slice
+        :param slice_time: the maximum amount of seconds in a slice
+        """
+        self.statements = statements
+        self.ctx = ctx
+        self.slice_statements = slice_statements
+        self.slice_time = slice_time
+        self.cpu_time = 0.0
+        """
+        The amount of seconds the program has used the processor, without the time spent waiting.
+        """
+        self.slices = 0
+        self.state = "waiting"
+        """
+        Whether the program is ``waiting`` to start, ``running``, ``done``, ``failed`` or ``cancelled``.
+        """
+
+        self._resume = threading.Semaphore(0)
+        self._stopped = threading.Semaphore(0)
+        self._request = None
+        self._reply = None
+        self._remaining = 0
+        self._deadline = 0.0
+        self._started = 0.0
+
+    async def run(self):
+        """
+        Runs the program to the end. Cancelling this coroutine stops the program at the
+        statement it is running.
+        """
+        self.ctx.task = self
+        self.state = "running"
+        threading.Thread(target=self._main, name="huckle task", daemon=True).start()
+        reply = None
+        while True:
+            try:
+                kind, value = self._slice(reply)
+                if kind == _DONE:
+                    succeeded, result = value
+                    if not succeeded:
+                        raise result
+                    return
+                if kind == _AWAIT:
+                    try:
+                        reply = (True, await value)
+                    except Exception as e:
+                        # The program receives the error, just like when a normal function fails
+                        reply = (False, e)
+                else:
+                    await asyncio.sleep(0)
+                    reply = None
+            except asyncio.CancelledError as e:
+                if self.state != "running":
+                    raise
+                # The program is stopped by raising the error inside of it, after which it must
+                # run once more to finish, for example to flush its output
+                reply = (False, e)
+
+    def _slice(self, reply):
+        """
+        Lets the program run until it stops again.
+        :param reply: what the program receives, see ``_stop``
+        :return: why the program stopped, and with what
+        """
+        self._reply = reply
+        self._resume.release()
+        self._stopped.acquire()
+        return self._request
+
+    def _main(self):
+        from elements.statements import run_statements
+        self._resume.acquire()
+        self._start()
+        try:
+            run_statements(self.statements, self.ctx)
+            result = (True, None)
+            self.state = "done"
+        except BaseException as e:
+            result = (False, e)
+            self.state = "cancelled" if isinstance(e, asyncio.CancelledError) else "failed"
+        finally:
+            self.ctx.output.flush()
+        self.cpu_time += time.thread_time() - self._started
+        self._request = (_DONE, result)
+        self._stopped.release()
+
+    def _start(self):
+        self.slices += 1
+        self._remaining = self.slice_statements
+        self._deadline = time.perf_counter() + self.slice_time
+        self._started = time.thread_time()
+
+    def _stop(self, kind: int, value=None):
+        """
+        Lets the event loop continue, and waits until it lets the program run again.
+        :param kind: why the program stops
+        :param value: the awaitable to await, if the program is waiting for it
+        :return: the result of the awaitable
+        """
+        self.cpu_time += time.thread_time() - self._started
+        self._request = (kind, value)
+        self._stopped.release()
+        self._resume.acquire()
+        self._start()
+        if self._reply is not None:
+            succeeded, result = self._reply
+            if not succeeded:
+                raise result
+            return result
+
+    def checkpoint(self):
+        """
+        Called before every statement, stopping the program when its slice is over.
+        """
+        self._remaining -= 1
+        if self._remaining <= 0 or time.perf_counter() >= self._deadline:
+            self._stop(_YIELD)
+
+    def wait(self, awaitable: Awaitable):
+        """
+        Waits until the event loop has awaited something. The program doesn't use the processor
+        in the meantime, so other tasks can run.
+        :param awaitable: the awaitable
+        :return: its result
+        """
+        return self._stop(_AWAIT, awaitable)
+
+
+class Scheduler:
+    """
+    Runs programs as tasks in the event loop, and keeps track of the processor time each of them
+    used, so it can be reported which programs are the most expensive.
+    """
+    def __init__(self, slice_statements=SLICE_STATEMENTS, slice_time=SLICE_TIME):
+        """
+        :param slice_statements: the maximum amount of statements in a slice
+        :param slice_time: the maximum amount of seconds in a slice
+        """
+        self.slice_statements = slice_statements
+        self.slice_time = slice_time
+        self.tasks: dict[str, Task] = {}
+        self.running: dict[str, asyncio.Task] = {}
+
+    def start(self, name: str, statements, ctx: Context) -> asyncio.Task:
+        """
+        Starts running a program in the current event loop.
+        :param name: the name to report the program with, which must be unique
+        :param statements: the first statement of the program
+        :param ctx: the context to run the program in
+        :return: the asyncio task, which can be awaited or cancelled
+        """
+        if name in self.running:
+            raise RuntimeError(f"A program named '{name}' is already running")
+        task = self.tasks[name] = Task(statements, ctx, self.slice_statements, self.slice_time)
+        running = self.running[name] = asyncio.get_running_loop().create_task(task.run(), name=name)
+        running.add_done_callback(lambda _: self.running.pop(name, None))
+        return running
+
+    def cancel(self, name: str):
+        """
+        Stops a running program.
+        :param name: the name of the program
+        """
+        if name in self.running:
+            self.running[name].cancel()
+
+    def cpu_times(self) -> dict[str, float]:
+        """
+        :return: the amount of seconds each program has used the processor
+        """
+        return {name: task.cpu_time for name, task in self.tasks.items()}
+
+    def report(self) -> str:
+        """
+        :return: a table of all programs, the most expensive first
+        """
+        lines = [f"{'program':<24}{'cpu time (ms)':>16}{'slices':>10}  state"]
+        for name, task in sorted(self.tasks.items(), key=lambda item: -item[1].cpu_time):
+            lines.append(f"{name:<24}{task.cpu_time * 1000:>16.3f}{task.slices:>10}  {task.state}")
+        return "\n".join(lines)
@@ -0,0 +1,144 @@
+import secrets
+import threading
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from utils.primitives import Matrix
+
+_segments: dict[str, list] = {}
+"""
+The shared memory segments used by this process, with the amount of matrices using them and
+whether this process created them.
+"""
+_lock = threading.Lock()
+
+
+def _acquire(name: str, size: int = None) -> shared_memory.SharedMemory:
+    """
+    Adds a reference to a shared memory segment, creating or attaching to it if this process
+    does not use it yet.
+    :param name: the name of the segment
+    :param size: the size of the segment to create, or ``None`` to attach to an existing one
+    :return: the segment
+    """
+    with _lock:
+        if name not in _segments:
+            if size is not None:
+                _segments[name] = [shared_memory.SharedMemory(name, create=True, size=max(1, size)), 0, True]
+            else:
+                _segments[name] = [_attach(name), 0, False]
+        _segments[name][1] += 1
+        return _segments[name][0]
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        # Python 3.13+ can be told that this process doesn't own the segment
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    # Older versions always register the segment to be removed when this process exits, which
+    # would remove it for the process that created it as well, so it is unregistered right away
+    memory = shared_memory.SharedMemory(name)
+    resource_tracker.unregister(memory._name, "shared_memory")
+    return memory
+
+
+def _release(name: str):
+    """
+    Removes a reference to a shared memory segment. When there are no references left, the
+    segment is closed, and removed if this process created it.
+    :param name: the name of the segment
+    """
+    with _lock:
+        segment = _segments[name]
+        segment[1] -= 1
+        if segment[1] > 0:
+            return
+        del _segments[name]
+    memory, _, owner = segment
+    try:
+        memory.close()
+    except BufferError:
+        # Some Numpy arrays still use the memory, it will be unmapped once they're gone
+        pass
+    if owner:
+        memory.unlink()
+
+
+class SharedMatrix(Matrix):
+    """
+    A matrix whose elements are stored in shared memory, so other processes can use it without
+    copying it. Sending a shared matrix to another process, for example as the argument of a
+    worker, only sends its name, shape and data type. The worker then maps the same memory.
+
+    Every shared matrix holds a reference to the memory, which it releases when it is garbage
+    collected. The memory is removed once the process that created it releases its last
+    reference, so that process must keep a shared matrix while the workers use it.
+
+    Read-only shared matrices can't be changed, which also means copying them can share the
+    same memory.
+    """
+    def __init__(self, name: str, shape, dtype, readonly=True):
+        """
+        Creates a matrix using an existing shared memory segment.
+        :param name: the name of the segment
+        :param shape: the amount of rows and columns
+        :param dtype: the data type of the elements
+        :param readonly: whether the matrix can't be changed
+        """
+        memory = _acquire(name)
+        self.array = np.ndarray(shape, dtype, buffer=memory.buf)
+        if readonly:
+            self.array.flags.writeable = False
+        self.name = name
+        self.readonly = readonly
+        weakref.finalize(self, _release, name)
+
+    @classmethod
+    def create(cls, matrix: Matrix, readonly=True) -> 'SharedMatrix':
+        """
+        Copies a matrix into a new shared memory segment.
+        :param matrix: the matrix
+        :param readonly: whether the shared matrix can't be changed
+        :return: the shared matrix
+        """
+        if matrix.array.dtype == object:
+            raise RuntimeError("Only matrices of numbers can be shared")
+        name = "huckle_" + secrets.token_hex(8)
+        memory = _acquire(name, matrix.array.nbytes)
+        np.ndarray(matrix.shape(), matrix.array.dtype, buffer=memory.buf)[...] = matrix.array
+        shared = cls(name, matrix.shape(), matrix.array.dtype, readonly)
+        # The shared matrix holds its own reference now
+        _release(name)
+        return shared
+
+    def view(self, readonly=True) -> 'SharedMatrix':
+        """
+        :param readonly: whether the view can't be changed
+        :return: another matrix using the same shared memory
+        """
+        return SharedMatrix(self.name, self.array.shape, self.array.dtype, readonly or self.readonly)
+
+    def __reduce__(self):
+        return SharedMatrix, (self.name, self.array.shape, self.array.dtype.str, self.readonly)
+
+    def __copy__(self):
+        if self.readonly:
+            return self.view()
+        return Matrix(self)
+
+
+def share(matrix: Matrix):
+    """
+    Moves a matrix to shared memory, so it can be used by other processes without copying it.
+    The shared matrix can't be changed.
+    :param matrix: the matrix
+    :return: the shared matrix
+    """
+    # TODO Add preconditions
+    if isinstance(matrix, SharedMatrix) and matrix.readonly:
+        return matrix
+    return SharedMatrix.create(matrix)
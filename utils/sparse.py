@@ -0,0 +1,517 @@
+import hashlib
+import numbers
+
+import numpy as np
+
+from utils.primitives import Matrix, Slice
+
+DENSE_LIMIT = 10_000_000
+"""
+The maximum amount of elements of a sparse matrix that may be converted to a dense matrix
+implicitly, for operations that don't have a sparse implementation.
+"""
+
+
+class ConvergenceError(RuntimeError):
+    """
+    Raised when an iterative method cannot solve a system, because it broke down or did not
+    converge within its iterations.
+    """
+
+
+class SparseMatrix(Matrix):
+    """
+    A matrix that only stores its nonzero elements, in the compressed sparse row format. For each
+    row, ``indptr[row]`` up to ``indptr[row + 1]`` are the positions of its elements in ``data``
+    and their columns in ``indices``. The columns are sorted within each row.
+
+    Operators between sparse matrices and multiplying with a scalar keep the result sparse.
+    Operations that would make it dense, like adding a dense matrix, give a dense matrix.
+    Everything without a sparse implementation uses the dense ``array``, which is only allowed
+    for matrices with at most ``DENSE_LIMIT`` elements.
+    """
+    def __init__(self, data: np.ndarray, indices: np.ndarray, indptr: np.ndarray, shape):
+        """
+        :param data: the nonzero elements
+        :param indices: the column of each element
+        :param indptr: where the elements of each row start, followed by the amount of elements
+        :param shape: the amount of rows and columns
+        """
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.dimensions = (int(shape[0]), int(shape[1]))
+
+    @classmethod
+    def from_coordinates(cls, rows, columns, values, shape) -> 'SparseMatrix':
+        """
+        Creates a sparse matrix from the positions and values of its elements. Elements with
+        the same position are added up, and zeros are left out.
+        :param rows: the row of each element
+        :param columns: the column of each element
+        :param values: the value of each element
+        :param shape: the amount of rows and columns
+        :return: the sparse matrix
+        """
+        rows = np.asarray(rows, np.int64)
+        columns = np.asarray(columns, np.int64)
+        values = np.asarray(values)
+
+        # Sorting by row and then by column puts duplicates next to each other
+        order = np.lexsort((columns, rows))
+        rows, columns, values = rows[order], columns[order], values[order]
+        if len(rows) > 0:
+            first = np.empty(len(rows), bool)
+            first[0] = True
+            first[1:] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+            starts = np.flatnonzero(first)
+            values = np.add.reduceat(values, starts) if len(starts) < len(values) else values
+            rows, columns = rows[starts], columns[starts]
+
+            nonzero = values != 0
+            rows, columns, values = rows[nonzero], columns[nonzero], values[nonzero]
+
+        indptr = np.zeros(shape[0] + 1, np.int64)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return cls(values, columns, indptr, shape)
+
+    @classmethod
+    def from_dense(cls, array: np.ndarray) -> 'SparseMatrix':
+        rows, columns = np.nonzero(array)
+        return cls.from_coordinates(rows, columns, array[rows, columns], array.shape)
+
+    @classmethod
+    def identity(cls, size: int, dtype=int) -> 'SparseMatrix':
+        return cls(np.ones(size, dtype), np.arange(size, dtype=np.int64), np.arange(size + 1, dtype=np.int64), (size, size))
+
+    @classmethod
+    def from_diagonal(cls, values: np.ndarray) -> 'SparseMatrix':
+        indices = np.arange(len(values), dtype=np.int64)
+        return cls.from_coordinates(indices, indices, values, (len(values), len(values)))
+
+    @property
+    def array(self) -> np.ndarray:
+        """
+        The dense version of this matrix. Changing it does not change the sparse matrix.
+        """
+        if self.dimensions[0] * self.dimensions[1] > DENSE_LIMIT:
+            raise RuntimeError(f"This operation is not supported for sparse matrices of this size "
+                               f"({self.dimensions[0]}x{self.dimensions[1]})")
+        result = np.zeros(self.dimensions, self.data.dtype)
+        result[self.row_indices(), self.indices] = self.data
+        return result
+
+    def row_indices(self) -> np.ndarray:
+        """
+        :return: the row of each stored element
+        """
+        return np.repeat(np.arange(self.dimensions[0]), np.diff(self.indptr))
+
+    def nonzeros(self) -> int:
+        return len(self.data)
+
+    def shape(self):
+        return self.dimensions
+
+    def rows(self):
+        return self.array.tolist()
+
+    def columns(self):
+        return self.array.transpose().tolist()
+
+    def vector(self) -> list:
+        return self.array.ravel().tolist()
+
+    def digest(self):
+        content = hashlib.blake2b(digest_size=16)
+        for part in (self.data, self.indices, self.indptr):
+            content.update(np.ascontiguousarray(part).tobytes())
+        return "sparse", self.dimensions, self.data.dtype.str, content.digest()
+
+    def transpose(self) -> 'SparseMatrix':
+        return SparseMatrix.from_coordinates(self.indices, self.row_indices(), self.data, self.dimensions[::-1])
+
+    def diagonal(self) -> np.ndarray:
+        rows = self.row_indices()
+        on_diagonal = rows == self.indices
+        result = np.zeros(min(self.dimensions), self.data.dtype)
+        result[rows[on_diagonal]] = self.data[on_diagonal]
+        return result
+
+    def sum(self, axis=None):
+        """
+        :param axis: 0 to add up each column, 1 to add up each row, or ``None`` for all elements
+        :return: the sum, or a dense row or column vector of sums
+        """
+        if axis is None:
+            return self.data.sum().item()
+        if axis == 0:
+            return np.bincount(self.indices, self.data, self.dimensions[1]).astype(self.data.dtype).reshape(1, -1)
+        return np.bincount(self.row_indices(), self.data, self.dimensions[0]).astype(self.data.dtype).reshape(-1, 1)
+
+    def norm(self):
+        return float(np.sqrt(np.sum(np.abs(self.data) ** 2)))
+
+    def maximum(self):
+        largest = self.data.max() if len(self.data) > 0 else 0
+        # Any element that isn't stored is zero
+        return (np.maximum(largest, 0) if len(self.data) < self.dimensions[0] * self.dimensions[1] else largest).item()
+
+    def minimum(self):
+        smallest = self.data.min() if len(self.data) > 0 else 0
+        return (np.minimum(smallest, 0) if len(self.data) < self.dimensions[0] * self.dimensions[1] else smallest).item()
+
+    def dot_dense(self, other: np.ndarray) -> np.ndarray:
+        """
+        Multiplies this matrix with a dense array, only using the stored elements.
+        :param other: the dense array
+        :return: the dense result
+        """
+        if self.dimensions[1] != other.shape[0]:
+            raise RuntimeError("Cannot multiply matrices with incompatible dimensions")
+        result = np.zeros((self.dimensions[0], other.shape[1]), np.result_type(self.data, other))
+        np.add.at(result, self.row_indices(), self.data[:, None] * other[self.indices])
+        return result
+
+    def dot_sparse(self, other: 'SparseMatrix') -> 'SparseMatrix':
+        if self.dimensions[1] != other.dimensions[0]:
+            raise RuntimeError("Cannot multiply matrices with incompatible dimensions")
+        # Every stored element (i, k) of this matrix is multiplied with every stored element of row k
+        # of the other matrix, and the products with the same position are added up afterwards
+        lengths = np.diff(other.indptr)[self.indices]
+        total = int(lengths.sum())
+        offsets = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(other.indptr[self.indices], lengths) + offsets
+        return SparseMatrix.from_coordinates(np.repeat(self.row_indices(), lengths),
+                                             other.indices[positions],
+                                             np.repeat(self.data, lengths) * other.data[positions],
+                                             (self.dimensions[0], other.dimensions[1]))
+
+    def _combine(self, other, sign):
+        if isinstance(other, numbers.Number):
+            # Adding a scalar to every element makes the matrix dense
+            return Matrix(self.array + sign * other) if other != 0 else self.__copy__()
+        if self.dimensions != other.shape():
+            raise RuntimeError("Cannot add matrices with different dimensions")
+        if isinstance(other, SparseMatrix):
+            return SparseMatrix.from_coordinates(np.concatenate((self.row_indices(), other.row_indices())),
+                                                 np.concatenate((self.indices, other.indices)),
+                                                 np.concatenate((self.data, sign * other.data)),
+                                                 self.dimensions)
+        result = sign * other.array
+        result[self.row_indices(), self.indices] += self.data
+        return Matrix.wrap(result)
+
+    def __add__(self, other):
+        return self._combine(other, 1)
+
+    def __radd__(self, other):
+        return self._combine(other, 1)
+
+    def __sub__(self, other):
+        return self._combine(other, -1)
+
+    def __rsub__(self, other):
+        return -1 * self._combine(other, -1)
+
+    def __mul__(self, other):
+        # Scalar multiplication
+        if isinstance(other, numbers.Number):
+            return SparseMatrix.from_coordinates(self.row_indices(), self.indices, self.data * other, self.dimensions)
+
+        # Matrix multiplication
+        if isinstance(other, SparseMatrix):
+            return self.dot_sparse(other)
+        return Matrix.wrap(self.dot_dense(other.array))
+
+    def __rmul__(self, other):
+        # Scalar multiplication
+        if isinstance(other, numbers.Number):
+            return self * other
+
+        # Matrix multiplication, using (AB)ᵀ = BᵀAᵀ
+        return Matrix.wrap(self.transpose().dot_dense(other.array.transpose()).transpose())
+
+    def __elmul__(self, other):
+        # Elementwise multiplication keeps the zeros of this matrix, so the result is sparse as well
+        if self.dimensions != other.shape():
+            raise RuntimeError("Cannot multiply matrices with different dimensions")
+        if isinstance(other, SparseMatrix):
+            # Only the positions stored in both matrices can be nonzero
+            width = self.dimensions[1]
+            _, mine, theirs = np.intersect1d(self.row_indices() * width + self.indices,
+                                             other.row_indices() * width + other.indices,
+                                             assume_unique=True, return_indices=True)
+            return SparseMatrix.from_coordinates(self.row_indices()[mine], self.indices[mine],
+                                                 self.data[mine] * other.data[theirs], self.dimensions)
+        values = other.array[self.row_indices(), self.indices]
+        return SparseMatrix.from_coordinates(self.row_indices(), self.indices, self.data * values, self.dimensions)
+
+    def __truediv__(self, other):
+        # Scalar division only
+        return SparseMatrix.from_coordinates(self.row_indices(), self.indices, self.data / other, self.dimensions)
+
+    def __pow__(self, power, modulo=None):
+        if not isinstance(power, int) or power < 0:
+            raise RuntimeError("Sparse matrices can only be raised to natural powers, solve a system instead of inverting")
+        if self.dimensions[0] != self.dimensions[1]:
+            raise RuntimeError("Only square matrices can be raised to a power")
+        result = SparseMatrix.identity(self.dimensions[0], self.data.dtype)
+        base = self
+        while power > 0:
+            if power & 1:
+                result = result.dot_sparse(base)
+            base = base.dot_sparse(base)
+            power >>= 1
+        return result
+
+    def _select(self, keys) -> tuple[np.ndarray, np.ndarray, bool]:
+        """
+        Turns the keys of a query into the rows and columns it selects, following the same rules as
+        dense matrices: one key selects an element of a vector, or a full row otherwise.
+        :param keys: the keys
+        :return: the selected rows, the selected columns and whether a single element is selected
+        """
+        keys = self._transform_keys(keys)
+        if len(keys) == 1:
+            if self.dimensions[0] == 1:
+                keys = [0, keys[0]]
+            elif self.dimensions[1] == 1:
+                keys = [keys[0], 0]
+            else:
+                keys = [keys[0], slice(None)]
+        elif len(keys) != 2:
+            raise RuntimeError(f"Too many arguments: expected 2 or lower arguments, but found {len(keys)}")
+
+        single = all(isinstance(key, numbers.Integral) for key in keys)
+        selected = [np.atleast_1d(np.arange(size)[key]) for key, size in zip(keys, self.dimensions)]
+        return selected[0], selected[1], single
+
+    def _positions(self, rows: np.ndarray, columns: np.ndarray):
+        """
+        :return: which stored elements are in the given rows and columns, and their position in the selection
+        """
+        row_map = np.full(self.dimensions[0], -1, np.int64)
+        row_map[rows] = np.arange(len(rows))
+        column_map = np.full(self.dimensions[1], -1, np.int64)
+        column_map[columns] = np.arange(len(columns))
+        new_rows, new_columns = row_map[self.row_indices()], column_map[self.indices]
+        inside = (new_rows >= 0) & (new_columns >= 0)
+        return inside, new_rows, new_columns
+
+    def __getitem__(self, item):
+        rows, columns, single = self._select(list(item))
+        if single:
+            row, column = rows[0], columns[0]
+            start, stop = self.indptr[row], self.indptr[row + 1]
+            position = start + np.searchsorted(self.indices[start:stop], column)
+            if position < stop and self.indices[position] == column:
+                return self.data[position].item()
+            return self.data.dtype.type(0).item()
+
+        inside, new_rows, new_columns = self._positions(rows, columns)
+        return SparseMatrix.from_coordinates(new_rows[inside], new_columns[inside], self.data[inside],
+                                             (len(rows), len(columns)))
+
+    def __setitem__(self, key, value):
+        rows, columns, _ = self._select(key)
+        if isinstance(value, Slice):
+            value = Matrix(value)
+        if isinstance(value, SparseMatrix):
+            value = value.array
+        elif isinstance(value, Matrix):
+            value = value.array
+        values = np.broadcast_to(np.asarray(value).reshape(-1, len(columns)) if np.ndim(value) > 0 else value,
+                                 (len(rows), len(columns)))
+
+        # The old elements in the selection are replaced by the new nonzero ones
+        inside, _, _ = self._positions(rows, columns)
+        new_rows, new_columns = np.nonzero(values)
+        self._update(SparseMatrix.from_coordinates(
+            np.concatenate((self.row_indices()[~inside], rows[new_rows])),
+            np.concatenate((self.indices[~inside], columns[new_columns])),
+            np.concatenate((self.data[~inside], values[new_rows, new_columns])),
+            self.dimensions))
+
+    def __delitem__(self, key):
+        raise RuntimeError("Cannot delete rows or columns of sparse matrices")
+
+    def _update(self, other: 'SparseMatrix'):
+        self.data, self.indices, self.indptr = other.data, other.indices, other.indptr
+
+    def concat(self, other, dimension=0):
+        raise RuntimeError("Cannot add rows or columns to sparse matrices")
+
+    def __contains__(self, item):
+        if item == 0:
+            return len(self.data) < self.dimensions[0] * self.dimensions[1]
+        return item in self.data
+
+    def __len__(self):
+        return self.dimensions[0] * self.dimensions[1]
+
+    def __copy__(self):
+        return SparseMatrix(self.data.copy(), self.indices.copy(), self.indptr.copy(), self.dimensions)
+
+    def buffers(self) -> tuple[np.ndarray, ...]:
+        # The dense array is created each time, so it never shares memory
+        return self.data, self.indices, self.indptr
+
+    def __str__(self):
+        return f"sparse matrix ({self.dimensions[0]}x{self.dimensions[1]}, {len(self.data)} nonzero elements)"
+
+    def elements(self, selection=slice(None)) -> list[str]:
+        """
+        :param selection: which of the stored elements to describe, by default all of them
+        :return: a line for each stored element, with its position and value
+        """
+        rows, columns, values = self.row_indices()[selection], self.indices[selection], self.data[selection]
+        positions = [f"({row}, {column})" for row, column in zip(rows.tolist(), columns.tolist())]
+        width = max((len(position) for position in positions), default=0)
+        return [position.ljust(width + 2) + str(value) for position, value in zip(positions, values.tolist())]
+
+
+def sparse(matrix: Matrix):
+    """
+    Converts a matrix to a sparse matrix, which only stores its nonzero elements.
+    :param matrix: the matrix
+    :return: the sparse matrix
+    """
+    # TODO Add preconditions
+    if isinstance(matrix, SparseMatrix):
+        return matrix
+    return SparseMatrix.from_dense(matrix.array)
+
+
+def full(matrix: Matrix):
+    """
+    Converts a sparse matrix to a normal matrix, storing all its elements.
+    :param matrix: the sparse matrix
+    :return: the dense matrix
+    """
+    # TODO Add preconditions
+    return Matrix.wrap(matrix.array) if isinstance(matrix, SparseMatrix) else matrix
+
+
+def speye(size):
+    # TODO Add preconditions
+    return SparseMatrix.identity(size)
+
+
+def spdiagonal(vector: Matrix):
+    """
+    Constructs a sparse matrix with the elements of this row or column vector on the diagonal.
+    :param vector: the row or column vector
+    :return: a sparse diagonal matrix
+    """
+    # TODO Add preconditions
+    return SparseMatrix.from_diagonal(vector.array.ravel())
+
+
+def nnz(matrix: Matrix):
+    # TODO Add preconditions
+    if isinstance(matrix, SparseMatrix):
+        return matrix.nonzeros()
+    return int(np.count_nonzero(matrix.array))
+
+
+def _iterative_system(matrix: Matrix, right: Matrix, iterations):
+    """
+    Checks a system for an iterative method.
+    :param matrix: the matrix of the system
+    :param right: the right-hand side, as a column vector
+    :param iterations: the maximum amount of iterations, or ``None`` for the default
+    :return: the function multiplying the matrix with a column vector, the right-hand side as a
+     column array and the maximum amount of iterations
+    """
+    rows, columns = matrix.shape()
+    if rows != columns:
+        raise RuntimeError("Iterative methods can only solve systems with a square matrix")
+    b = right.array.reshape(-1, 1).astype(float)
+    if len(b) != rows:
+        raise RuntimeError("The right-hand side must have as many rows as the matrix")
+    multiply = matrix.dot_dense if isinstance(matrix, SparseMatrix) else matrix.array.__matmul__
+    return multiply, b, len(b) if iterations is None else int(iterations)
+
+
+def cg(matrix: Matrix, right: Matrix, tolerance=1e-10, iterations=None):
+    """
+    Solves the system ``matrix * x = right`` with the conjugate gradient method, which only needs
+    products of the matrix with vectors. That makes it the alternative to inverting large sparse
+    matrices, but the matrix needs to be symmetric and positive definite.
+    :param matrix: the matrix of the system
+    :param right: the right-hand side, as a column vector
+    :param tolerance: the relative norm of the residual to stop at
+    :param iterations: the maximum amount of iterations, by default the size of the system
+    :return: the solution, as a column vector
+    """
+    multiply, b, iterations = _iterative_system(matrix, right, iterations)
+
+    x = np.zeros_like(b)
+    residual = b.copy()
+    direction = residual.copy()
+    squared = float(np.vdot(residual, residual))
+    limit = (tolerance * np.linalg.norm(b)) ** 2
+    for _ in range(iterations):
+        if squared <= limit:
+            break
+        product = multiply(direction)
+        curvature = float(np.vdot(direction, product))
+        # Written this way to catch NaN as well
+        if not curvature > 0:
+            raise ConvergenceError("The conjugate gradient method needs a positive definite matrix")
+        step = squared / curvature
+        x += step * direction
+        residual -= step * product
+        previous, squared = squared, float(np.vdot(residual, residual))
+        direction = residual + (squared / previous) * direction
+    if not squared <= limit:
+        raise ConvergenceError(f"The conjugate gradient method did not converge in {iterations} iterations")
+    return Matrix.wrap(x)
+
+
+def bicgstab(matrix: Matrix, right: Matrix, tolerance=1e-10, iterations=None):
+    """
+    Solves the system ``matrix * x = right`` with the stabilized biconjugate gradient method.
+    Just like the conjugate gradient method it only needs products of the matrix with vectors,
+    but the matrix doesn't have to be symmetric or positive definite.
+    :param matrix: the matrix of the system
+    :param right: the right-hand side, as a column vector
+    :param tolerance: the relative norm of the residual to stop at
+    :param iterations: the maximum amount of iterations, by default the size of the system
+    :return: the solution, as a column vector
+    """
+    multiply, b, iterations = _iterative_system(matrix, right, iterations)
+
+    x = np.zeros_like(b)
+    residual = b.copy()
+    shadow = residual.copy()
+    direction = np.zeros_like(b)
+    product = np.zeros_like(b)
+    rho = alpha = omega = 1.0
+    limit = (tolerance * np.linalg.norm(b)) ** 2
+    for _ in range(iterations):
+        if float(np.vdot(residual, residual)) <= limit:
+            return Matrix.wrap(x)
+        previous, rho = rho, float(np.vdot(shadow, residual))
+        if rho == 0 or omega == 0:
+            raise ConvergenceError("The biconjugate gradient method broke down")
+        direction = residual + (rho / previous) * (alpha / omega) * (direction - omega * product)
+        product = multiply(direction)
+        projection = float(np.vdot(shadow, product))
+        if projection == 0:
+            raise ConvergenceError("The biconjugate gradient method broke down")
+        alpha = rho / projection
+        intermediate = residual - alpha * product
+        if float(np.vdot(intermediate, intermediate)) <= limit:
+            return Matrix.wrap(x + alpha * direction)
+        stabilizer = multiply(intermediate)
+        length = float(np.vdot(stabilizer, stabilizer))
+        if length == 0:
+            raise ConvergenceError("The biconjugate gradient method broke down")
+        omega = float(np.vdot(stabilizer, intermediate)) / length
+        x += alpha * direction + omega * intermediate
+        residual = intermediate - omega * stabilizer
+    if not float(np.vdot(residual, residual)) <= limit:
+        raise ConvergenceError(f"The biconjugate gradient method did not converge in {iterations} iterations")
+    return Matrix.wrap(x)